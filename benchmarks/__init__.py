@@ -0,0 +1,14 @@
+"""Micro benchmarks of the interpreter. Run them with `python -m benchmarks.<name>`."""
+import timeit
+
+
+def measure(f, repeat=5, number=1):
+    """Return the best time of running `f` `number` times, out of `repeat` tries."""
+    return min(timeit.repeat(f, repeat=repeat, number=number))
+
+
+def report(name, seconds, unit=None, count=None):
+    if count is None:
+        print '%-40s %10.2f ms' % (name, seconds * 1000)
+    else:
+        print '%-40s %10.2f ms %12.0f %s/s' % (name, seconds * 1000, count / seconds, unit)
@@ -0,0 +1,33 @@
+"""Compares running a batch of programs one by one with `jspy.eval_many`."""
+import multiprocessing
+from StringIO import StringIO
+from benchmarks import measure, report
+from jspy import create_default_global_objects, eval_many, eval_string, js
+
+
+PROGRAM = """
+var fib = function (n) {
+    if (n < 2) return n;
+    return fib(n - 1) + fib(n - 2);
+};
+console.log(fib(%d));
+"""
+
+JOBS = 32
+
+
+def main():
+    sources = [PROGRAM % (12 + i % 4) for i in range(JOBS)]
+    def run_serially():
+        for source in sources:
+            global_objects = create_default_global_objects()
+            global_objects['console'] = js.Console(StringIO())
+            eval_string(source, global_objects)
+    report('one by one', measure(run_serially, repeat=3), 'programs', JOBS)
+    workers = multiprocessing.cpu_count()
+    report('eval_many, %d workers' % workers,
+           measure(lambda: list(eval_many(sources, workers)), repeat=3), 'programs', JOBS)
+
+
+if __name__ == '__main__':
+    main()
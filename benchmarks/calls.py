@@ -0,0 +1,44 @@
+"""Measures the number of JavaScript function calls per second."""
+from benchmarks import measure, report
+from jspy import js
+from jspy.parser import Parser
+
+
+FUNCTIONS = """
+var noArguments = function () { return 1; };
+var twoArguments = function (x, y) { return x; };
+var withLocals = function (x, y) { var a = x, b = y, c = 0; return a; };
+"""
+
+LOOP = """
+var i = 0;
+while (i < 10000) {
+    twoArguments(i, 1);
+    ++i;
+}
+"""
+
+CALLS = 100000
+
+
+def main():
+    parser = Parser()
+    program = parser.parse(FUNCTIONS)
+    context = js.ExecutionContext(dict((name, js.UNDEFINED) for name in program.get_declared_vars()))
+    program.eval(context)
+
+    # Calls made directly from Python, measuring just the call path
+    for name, args in [('noArguments', []), ('twoArguments', [1.0, 2.0]), ('withLocals', [1.0, 2.0])]:
+        function = context[name]
+        def calls():
+            for i in xrange(CALLS):
+                function.call(None, args)
+        report('%s()' % name, measure(calls), 'calls', CALLS)
+
+    # Calls made from JavaScript
+    loop = parser.parse(LOOP)
+    report('twoArguments() in a while loop', measure(lambda: loop.eval(context)), 'calls', 10000)
+
+
+if __name__ == '__main__':
+    main()
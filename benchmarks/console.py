@@ -0,0 +1,42 @@
+"""Compares `console.log` in a hot loop with the default and buffered consoles."""
+import os
+import subprocess
+from benchmarks import measure, report
+from jspy import eval_program, js
+from jspy.output import BufferedConsole, FileSink, NullSink
+from jspy.parser import Parser
+
+
+LINES = 20000
+
+PROGRAM = """
+var i = 0;
+while (i < %d) {
+    console.log(i, "of", %d);
+    i++;
+}
+""" % (LINES, LINES)
+
+
+def main():
+    program = Parser().parse(PROGRAM)
+    # Unbuffered pipe to another process, like stdout of `jspy file.js | grep ...`
+    reader = subprocess.Popen(['cat'], stdin=subprocess.PIPE, stdout=open(os.devnull, 'w'))
+    out = reader.stdin
+    consoles = [('Console', lambda: js.Console(out)),
+                ('BufferedConsole', lambda: BufferedConsole(FileSink(out))),
+                ('BufferedConsole, background', lambda: BufferedConsole(FileSink(out), background=True)),
+                ('BufferedConsole, null sink', lambda: BufferedConsole(NullSink()))]
+    for name, make_console in consoles:
+        def run():
+            console = make_console()
+            eval_program(program, {'console': console})
+            if isinstance(console, BufferedConsole):
+                console.close()
+        report(name, measure(run), 'lines', LINES)
+    out.close()
+    reader.wait()
+
+
+if __name__ == '__main__':
+    main()
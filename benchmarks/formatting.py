@@ -0,0 +1,27 @@
+"""Compares formatting arrays for `console.log` by sorting their keys (as
+`js.Array.__str__` used to) with walking them in index order."""
+from benchmarks import measure, report
+from jspy import js
+from jspy.formatting import format_value
+
+
+def format_sorted(array, max_length=100):
+    """Formatting of arrays before `jspy.formatting`, for comparison."""
+    items = list(sorted((int(float(key)), value) for key, value in array.d.items()))
+    max_key = items[-1][0] if len(items) > 0 else -1
+    shown_items = [array.get(i) for i in range(0, min(max_key, max_length - 1) + 1)]
+    return '[%s]' % ', '.join(str(item) for item in shown_items)
+
+
+def main():
+    for size in [10, 1000, 100000]:
+        array = js.Array(range(size))
+        count = 100000 / size
+        def run(f):
+            return lambda: [f(array) for i in xrange(count)]
+        report('%d elements, sorted keys' % size, measure(run(format_sorted)), 'arrays', count)
+        report('%d elements, index order' % size, measure(run(format_value)), 'arrays', count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Compares loading a parsed program from `pickle` and from `jspy.binary`, and
+running a prelude with restoring its snapshot (see `jspy.snapshot`) or forking
+its context (see `jspy.forking`)."""
+import cPickle as pickle
+import os
+import tempfile
+from benchmarks import measure, report
+from jspy import binary, eval_string, snapshot
+from jspy.parser import Parser
+
+
+TEST_FILES = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'jspy', 'test_files')
+
+PRELUDE = """
+var squares = [], names = {x: 0}, i = 0;
+while (i < 2000) {
+    squares[i] = i * i;
+    names[i * 7] = i;
+    i++;
+}
+var lookup = function (name) { return squares[names[name]]; };
+"""
+
+
+def main():
+    source = ''
+    for file_name in sorted(os.listdir(TEST_FILES)):
+        source += open(os.path.join(TEST_FILES, file_name)).read().decode('utf-8') + '\n'
+    # Many small functions, as in a large library, of which only a few are called
+    source = ''.join('var f%d = function (x) { %s };\n' % (i, source) for i in range(50))
+    program = Parser().parse(source)
+    pickled = pickle.dumps(program, 2)
+    fd, file_name = tempfile.mkstemp(suffix='.jsb')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            binary.dump(program, f)
+        report('pickle (%d KB)' % (len(pickled) / 1024), measure(lambda: pickle.loads(pickled)))
+        report('binary (%d KB)' % (os.path.getsize(file_name) / 1024),
+               measure(lambda: binary.load(file_name)))
+    finally:
+        os.remove(file_name)
+
+    result, context = eval_string(PRELUDE)
+    data = snapshot.dumps(context)
+    report('prelude, run', measure(lambda: eval_string(PRELUDE)))
+    report('prelude, restored (%d KB)' % (len(data) / 1024), measure(lambda: snapshot.loads(data)))
+    def run_forked():
+        forked = context.fork()
+        forked['lookup'].call(None, [700])
+    report('prelude, forked and called', measure(run_forked))
+
+
+if __name__ == '__main__':
+    main()
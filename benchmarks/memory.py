@@ -0,0 +1,77 @@
+"""Measures memory used by the AST and by runtime objects."""
+import os.path
+import sys
+import timeit
+from benchmarks import report
+from jspy import ast, js
+from jspy.flatast import FlatTree
+from jspy.parser import Parser
+
+
+TEST_FILES = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'jspy', 'test_files')
+
+ALLOCATIONS = 1000000
+
+
+def get_size(obj):
+    """Return the number of bytes used by `obj`, including its `__dict__` if it has one."""
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+def get_tree_size(value):
+    """Return the number of nodes and bytes used by the AST `value`, with lists and dicts in it."""
+    if isinstance(value, ast.Node):
+        nodes, size = 1, get_size(value)
+        for name in value.child_names:
+            child_nodes, child_size = get_tree_size(getattr(value, name))
+            nodes += child_nodes
+            size += child_size
+        return nodes, size
+    elif isinstance(value, (list, dict)):
+        nodes, size = 0, sys.getsizeof(value)
+        for item in (value.values() if isinstance(value, dict) else value):
+            item_nodes, item_size = get_tree_size(item)
+            nodes += item_nodes
+            size += item_size
+        return nodes, size
+    return 0, 0
+
+
+def get_flat_tree_size(tree):
+    """Return the number of bytes used by `FlatTree` `tree`: its columns and constants."""
+    size = sum(column.buffer_info()[1] * column.itemsize
+               for column in (tree.kinds, tree.starts, tree.fields))
+    size += sys.getsizeof(tree.constants) + sum(sys.getsizeof(value) for value in tree.constants)
+    return size
+
+
+def main():
+    source = ''
+    for file_name in sorted(os.listdir(TEST_FILES)):
+        source += open(os.path.join(TEST_FILES, file_name)).read().decode('utf-8') + '\n'
+    source *= 20
+    program = Parser().parse(source)
+    nodes, size = get_tree_size(program)
+    kilobytes = len(source) / 1024.0
+    print '%-40s %10.0f nodes/KB %10.0f bytes/KB' % ('AST of test files', nodes / kilobytes,
+                                                     size / kilobytes)
+    tree = FlatTree.from_node(program)
+    print '%-40s %10.0f nodes/KB %10.0f bytes/KB' % ('Flat AST of test files', len(tree) / kilobytes,
+                                                     get_flat_tree_size(tree) / kilobytes)
+
+    context = js.ExecutionContext({})
+    body = ast.Block(statements=[])
+    for name, create in [('Reference', lambda: js.Reference('x', context)),
+                         ('ExecutionContext', lambda: js.ExecutionContext({}, context)),
+                         ('Function', lambda: js.Function([], body, context, {})),
+                         ('NativeFunction', lambda: js.NativeFunction(len)),
+                         ('Identifier', lambda: ast.Identifier(name='x'))]:
+        seconds = timeit.timeit(create, number=ALLOCATIONS)
+        report('%s (%d bytes)' % (name, get_size(create())), seconds, 'allocations', ALLOCATIONS)
+
+
+if __name__ == '__main__':
+    main()
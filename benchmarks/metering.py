@@ -0,0 +1,47 @@
+"""Measures the overhead of running programs with a step budget."""
+from benchmarks import measure, report
+from jspy import js, metering
+from jspy.parser import Parser
+
+
+PRIMES = """
+var isPrime = function (n) {
+    var i = 2;
+    while (i * i <= n) {
+        if (n % i === 0) {
+            return false;
+        }
+        ++i;
+    }
+    return true;
+};
+
+var n = 2, count = 0;
+while (n < 3000) {
+    if (isPrime(n)) {
+        ++count;
+    }
+    ++n;
+}
+"""
+
+
+def run(program):
+    context = js.ExecutionContext(dict((name, js.UNDEFINED) for name in program.get_declared_vars()))
+    return program.eval(context)
+
+
+def main():
+    program = Parser().parse(PRIMES)
+    plain = measure(lambda: run(program))
+    def run_metered():
+        with metering.metered(metering.Budget(max_steps=10 ** 9, timeout=3600)):
+            return run(metering.instrument(program))
+    metered = measure(run_metered)
+    report('primes (no budget)', plain)
+    report('primes (with budget)', metered)
+    print '%-40s %10.1f%%' % ('overhead', (metered / plain - 1) * 100)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Measures arithmetic on loop counters, array indexing and bitwise operators."""
+from benchmarks import measure, report
+from jspy import js
+from jspy.parser import Parser
+
+
+COUNTER = """
+var i = 0, total = 0;
+while (i < 10000) {
+    total = total + i * 3 - 1;
+    ++i;
+}
+"""
+
+ARRAY = """
+var a = [], i = 0, total = 0;
+while (i < 5000) {
+    a[i] = i;
+    ++i;
+}
+i = 0;
+while (i < 5000) {
+    total += a[i];
+    ++i;
+}
+"""
+
+BITWISE = """
+var i = 0, hash = 0;
+while (i < 10000) {
+    hash = (hash << 5) - hash + i | 0;
+    ++i;
+}
+"""
+
+WORKLOADS = [('counter loop', COUNTER, 10000),
+             ('array indexing', ARRAY, 10000),
+             ('bitwise hash', BITWISE, 10000)]
+
+
+def main():
+    parser = Parser()
+    for name, source, iterations in WORKLOADS:
+        program = parser.parse(source)
+        def run():
+            context = js.ExecutionContext(dict((name, js.UNDEFINED) for name in program.get_declared_vars()))
+            program.eval(context)
+        report(name, measure(run), 'iterations', iterations)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Compares the recursive `Node.eval` evaluator with the explicit stack one in `jspy.machine`."""
+import os.path
+import sys
+from benchmarks import measure, report
+from jspy import js, machine
+from jspy.parser import Parser
+
+
+FIBGEN = open(os.path.join(os.path.dirname(__file__), '..', 'jspy', 'test_files', 'fibgen.js')).read()
+
+RECURSIVE_FIB = """
+var fib = function (n) {
+    if (n < 2) return n;
+    return fib(n - 1) + fib(n - 2);
+};
+fib(16);
+"""
+
+DEEP_RECURSION = """
+var sum = function (n) {
+    if (n == 0) return 0;
+    return n + sum(n - 1);
+};
+sum(%d);
+"""
+
+LOOP = """
+var i = 0, total = 0;
+while (i < 20000) {
+    total += i * 2;
+    ++i;
+}
+"""
+
+
+def run(program, stackless):
+    context = js.ExecutionContext(dict((name, js.UNDEFINED) for name in program.get_declared_vars()))
+    if stackless:
+        return machine.run(program, context)
+    else:
+        return program.eval(context)
+
+
+def max_recursive_depth(parser):
+    """Find the deepest recursion the recursive evaluator can handle."""
+    low, high = 1, 10000
+    while low < high:
+        depth = (low + high + 1) // 2
+        try:
+            run(parser.parse(DEEP_RECURSION % depth), stackless=False)
+            low = depth
+        except RuntimeError:
+            high = depth - 1
+    return low
+
+
+def main():
+    parser = Parser()
+    depth = max_recursive_depth(parser)
+    print 'Maximum recursion depth of Node.eval: %d (sys.getrecursionlimit() = %d)' % (
+        depth, sys.getrecursionlimit())
+    print
+
+    # Leave some room for frames of the benchmark itself
+    depth = depth // 2
+    workloads = [('fibgen.js', FIBGEN, 20),
+                 ('recursive fib(16)', RECURSIVE_FIB, 1),
+                 ('recursion depth %d' % depth, DEEP_RECURSION % depth, 20),
+                 ('while loop, 20000 iterations', LOOP, 1)]
+    for name, source, number in workloads:
+        program = parser.parse(source)
+        recursive = measure(lambda: run(program, stackless=False), number=number)
+        stackless = measure(lambda: run(program, stackless=True), number=number)
+        report('%s (Node.eval)' % name, recursive)
+        report('%s (machine)' % name, stackless)
+        print '%-40s %10.2fx' % ('slowdown', stackless / recursive)
+        print
+
+    program = parser.parse(DEEP_RECURSION % 100000)
+    report('recursion depth 100000 (machine)', measure(lambda: run(program, stackless=True), repeat=1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""Compares the tree-walking interpreter with tiered execution (see `jspy.compiler`)."""
+from benchmarks import measure, report
+from jspy import compiler, js
+from jspy.parser import Parser
+
+
+FIB = """
+var fib = function (n) {
+    if (n < 2) return n;
+    return fib(n - 1) + fib(n - 2);
+};
+fib(18);
+"""
+
+LOOP = """
+var i = 0, total = 0;
+while (i < 20000) {
+    total = total + i * 3 - 1;
+    ++i;
+}
+"""
+
+WORKLOADS = [('recursive fib(18)', FIB, 'calls', 8361),
+             ('counter loop', LOOP, 'iterations', 20000)]
+
+
+def main():
+    parser = Parser()
+    for name, source, unit, count in WORKLOADS:
+        program = parser.parse(source)
+        def run():
+            context = js.ExecutionContext(dict((name, js.UNDEFINED) for name in program.get_declared_vars()))
+            program.eval(context)
+        compiler.set_thresholds(None, None)
+        report('%s, interpreted' % name, measure(run), unit, count)
+        compiler.set_thresholds(100, 1000)
+        report('%s, tiered' % name, measure(run), unit, count)
+
+
+if __name__ == '__main__':
+    main()
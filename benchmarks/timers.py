@@ -0,0 +1,42 @@
+"""Measures scheduling, clearing and running many pending timers of `jspy.timers.EventLoop`."""
+from benchmarks import measure, report
+from jspy import eval_string, js
+from jspy.timers import EventLoop
+
+
+TIMERS = 200000
+
+PROGRAM = """
+var i = 0;
+var ids = [];
+while (i < %d) {
+    ids[i] = setTimeout(tick, (i * 7919) %% 100000);
+    i++;
+}
+i = 0;
+while (i < %d) {
+    clearTimeout(ids[i]);
+    i += 2;
+}
+"""
+
+
+def main():
+    tick = js.NativeFunction(lambda this, args: None)
+    def run_native():
+        loop = EventLoop(virtual_time=True)
+        ids = [loop.add_timer(tick, (i * 7919) % 100000, []) for i in xrange(TIMERS)]
+        for id in ids[::2]:
+            loop.cancel_timer(id)
+        loop.run()
+    report('schedule, clear half and run', measure(run_native, repeat=3), 'timers', TIMERS)
+    count = TIMERS / 10
+    def run_program():
+        global_objects = EventLoop(virtual_time=True).get_global_objects()
+        global_objects['tick'] = tick
+        eval_string(PROGRAM % (count, count), global_objects)
+    report('same from JavaScript', measure(run_program, repeat=3), 'timers', count)
+
+
+if __name__ == '__main__':
+    main()
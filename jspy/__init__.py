@@ -1,31 +1,147 @@
 import codecs
+from jspy import machine, metering, timers
+from jspy.allocations import instrument as add_allocation_sites
+from jspy.asynchronous import eval_string_async
+from jspy.batch import eval_many
+from jspy.hooks import instrument as add_hooks
 from jspy.parser import Parser
-from jspy.js import Console, ExecutionContext, UNDEFINED
+from jspy.js import Console, ExecutionContext, Function, NativeFunction, UNDEFINED
+from jspy.memoize import memoize_native
+from jspy.output import BufferedConsole
+from jspy.typedarray import ArrayBuffer, Float64Array, Int32Array, Uint8Array
 
 
 __version__ = '1.0'
 
 
 def create_default_global_objects():
-    return {'console': Console()}
+    global_objects = {'console': Console(),
+                      'ArrayBuffer': NativeFunction(ArrayBuffer.construct),
+                      'Float64Array': NativeFunction(Float64Array.construct),
+                      'Int32Array': NativeFunction(Int32Array.construct),
+                      'Uint8Array': NativeFunction(Uint8Array.construct),
+                      'memoize': NativeFunction(memoize_native)}
+    global_objects.update(timers.EventLoop().get_global_objects())
+    return global_objects
 
 
-def eval_string(s, global_objects=None):
-    if global_objects is None:
-        global_objects = create_default_global_objects()
-        
-    # Parse file and create the execution context object
-    program = Parser().parse(s)
+def create_global_context(program, global_objects):
+    """Create the global execution context for running `program`."""
     declared_vars = dict((name, UNDEFINED) for name in program.get_declared_vars())
     declared_vars.update(global_objects)
-    context = ExecutionContext(declared_vars)
+    return ExecutionContext(declared_vars)
 
-    # Run code
-    result = program.eval(context)
+
+def eval_string(s, global_objects=None, stackless=False, max_steps=None, timeout=None, hooks=None,
+                allocations=None, context=None):
+    """Run JavaScript code in string `s`.
+
+    With `stackless` set, the code is run by `jspy.machine`, which doesn't use
+    Python stack for JavaScript calls and nesting, so recursion depth is only
+    bounded by available memory (at a cost of slower execution).
+
+    `max_steps` limits the number of loop iterations and function calls and
+    `timeout` the running time (in seconds). Exceeding any of them raises
+    `jspy.metering.BudgetExceeded`.
+
+    `hooks`, an instance of `jspy.hooks.Hooks`, is called while the code runs.
+    Allocations of objects are counted by `allocations`, an instance of
+    `jspy.allocations.AllocationTracker`.
+
+    The code runs in a new global context with `global_objects` or, if given, in
+    an existing global `context` (e.g. restored by `jspy.snapshot.load`).
+
+    Once the code has finished, timers and microtasks it scheduled are run (see
+    `jspy.timers`), so the call returns when there are none left (an interval
+    that's never cleared runs until it exceeds `max_steps` or `timeout`). Output of
+    a buffered `console` (see `jspy.output`) is flushed then as well."""
+    return eval_program(Parser().parse(s), global_objects, stackless=stackless,
+                        max_steps=max_steps, timeout=timeout, hooks=hooks,
+                        allocations=allocations, context=context)
+
+
+def prepare_program(program, global_objects=None, max_steps=None, timeout=None, hooks=None,
+                    allocations=None, context=None):
+    """Return `(program, context, budget)` ready to be run: the global context,
+    `program` instrumented for `hooks` and `allocations` and its `jspy.metering.Budget`."""
+    if context is None:
+        if global_objects is None:
+            global_objects = create_default_global_objects()
+
+        # Create the execution context object
+        context = create_global_context(program, global_objects)
+    else:
+        for name in program.get_declared_vars():
+            context.env.setdefault(name, UNDEFINED)
+
+    if allocations is not None:
+        program = add_allocation_sites(program, allocations)
+    if hooks is not None:
+        program = add_hooks(program, hooks)
+    budget = None
+    if max_steps is not None or timeout is not None:
+        budget = metering.Budget(max_steps, timeout)
+    return program, context, budget
+
+
+def eval_program(program, global_objects=None, stackless=False, max_steps=None, timeout=None,
+                 hooks=None, allocations=None, context=None):
+    """Run parsed `program` (e.g. loaded by `jspy.binary.load`), see `eval_string`."""
+    program, context, budget = prepare_program(program, global_objects, max_steps, timeout,
+                                               hooks, allocations, context)
+
+    try:
+        with metering.metered(budget):
+            # Run code
+            if stackless:
+                result = machine.run(program, context, budget)
+            else:
+                if budget is not None:
+                    program = metering.instrument(program)
+                result = program.eval(context)
+
+            # Run timers and microtasks scheduled by the code
+            run_event_loop(context, budget, stackless)
+    finally:
+        # Output logged before an error is flushed as well
+        flush_console(context)
     return result.value, context
 
 
-def eval_file(file_name, global_objects=None):
+def flush_console(context):
+    """Flush `console` global of `context` if it's a `jspy.output.BufferedConsole`."""
+    console = context.env.get('console')
+    if isinstance(console, BufferedConsole):
+        console.flush()
+
+
+def run_event_loop(context, budget=None, stackless=False):
+    """Run timers and microtasks scheduled by the program running in `context`.
+
+    Calls of native callbacks count as steps against `budget` too (JavaScript
+    functions count their own), so an interval that's never cleared stops with
+    `jspy.metering.BudgetExceeded` instead of running forever."""
+    loop = timers.get_event_loop(context)
+    if loop is None or not loop.pending:
+        return
+    if stackless:
+        call = lambda function, this, args: machine.call(function, this, args, budget)
+    else:
+        call = timers.call
+    if budget is None:
+        loop.run(call=call)
+        return
+    def call_with_budget(function, this, args):
+        if not isinstance(function, Function):
+            budget.tick()
+        return call(function, this, args)
+    loop.run(call=call_with_budget)
+
+
+def eval_file(file_name, global_objects=None, stackless=False, max_steps=None, timeout=None,
+              hooks=None, allocations=None, context=None):
     f = codecs.open(file_name, encoding='utf-8')
     file_contents = f.read()
-    return eval_string(file_contents)
+    return eval_string(file_contents, global_objects, stackless=stackless,
+                       max_steps=max_steps, timeout=timeout, hooks=hooks,
+                       allocations=allocations, context=context)
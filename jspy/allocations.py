@@ -0,0 +1,150 @@
+"""Counting of objects allocated by every site in source code.
+
+Sites are array and object literals, function definitions (closures), function
+calls (execution contexts), `new` expressions and string concatenation. Like
+hooks (see `jspy.hooks`), counting is done by nodes placed only in an
+instrumented copy of the program, so there's no cost when it's not used.
+
+Sizes are approximate: they include the Python objects allocated by jspy for a
+value (e.g. dictionary of object properties), but not values they refer to."""
+import ctypes
+import sys
+from collections import defaultdict
+from jspy import ast, js
+from jspy.typedarray import ArrayBuffer, TypedArray
+
+
+# Size of an `ExecutionContext` without its variables
+CONTEXT_SIZE = sys.getsizeof(js.ExecutionContext({}))
+
+
+def get_size(value):
+    """Return the approximate number of bytes allocated for `value`."""
+    if isinstance(value, TypedArray):
+        return sys.getsizeof(value) + sys.getsizeof(value.d) + ctypes.sizeof(value.elements)
+    elif isinstance(value, ArrayBuffer):
+        return sys.getsizeof(value) + sys.getsizeof(value.d) + len(value.data)
+    elif isinstance(value, js.Object):
+        return sys.getsizeof(value) + sys.getsizeof(value.d)
+    return sys.getsizeof(value)
+
+
+def get_kind(value):
+    """Return the kind of allocated `value` or None if it isn't counted."""
+    if isinstance(value, js.Array):
+        return 'Array'
+    elif isinstance(value, js.Object):
+        return value.__class__.__name__
+    elif isinstance(value, js.Function):
+        return 'Function'
+    elif isinstance(value, (basestring, js.Rope)):
+        return 'string'
+    return None
+
+
+class AllocationTracker(object):
+    def __init__(self):
+        # Allocation counts and bytes by (line, kind)
+        self.counts = defaultdict(int)
+        self.bytes = defaultdict(int)
+
+    def record(self, line, kind, size):
+        self.counts[line, kind] += 1
+        self.bytes[line, kind] += size
+
+    def record_value(self, line, value):
+        kind = get_kind(value)
+        if kind is not None:
+            self.record(line, kind, get_size(value))
+
+    def record_call(self, line, function, args):
+        """Record allocation of an execution context by a call of `function`."""
+        if isinstance(function, js.Function):
+            # Local variables are a copy of the frame template
+            self.record(line, 'ExecutionContext',
+                        CONTEXT_SIZE + sys.getsizeof(function.frame_template) + sys.getsizeof(args))
+
+    def get_top(self, n=20):
+        """Return up to `n` `(line, kind, count, bytes)` tuples, from the site
+        that allocated the most bytes."""
+        sites = sorted(self.counts, key=lambda site: (-self.bytes[site], site))
+        return [(line, kind, self.counts[line, kind], self.bytes[line, kind])
+                for line, kind in sites[:n]]
+
+    def write_top(self, f, n=20):
+        """Write a table of `n` sites that allocated the most bytes to file `f`."""
+        f.write('%10s %12s  %s\n' % ('count', 'bytes', 'site'))
+        for line, kind, count, size in self.get_top(n):
+            f.write('%10d %12d  %s at line %s\n' % (count, size, kind, line))
+
+
+class AllocationSite(ast.Node):
+    """Records the value of `expression` if it's a new object or string."""
+    arguments = ['tracker']
+    children = ['expression']
+
+    def eval(self, context):
+        value = self.expression.eval(context)
+        self.tracker.record_value(self.expression.line, value)
+        return value
+
+    # A `new` expression may get wrapped by other instrumentation, see `ast.get_call`
+    @property
+    def call(self):
+        return self.expression
+
+    def apply(self, f, args):
+        value = self.expression.apply(f, args)
+        self.tracker.record_value(self.expression.line, value)
+        return value
+
+
+class CallSite(ast.Node):
+    """Function call, recording the execution context it allocates.
+
+    `call` may be wrapped by other instrumentation too, see `ast.get_call`."""
+    arguments = ['tracker']
+    children = ['call']
+
+    def eval(self, context):
+        call = ast.get_call(self.call)
+        f = js.get_value(call.obj.eval(context))
+        args = [js.get_value(argument.eval(context)) for argument in call.arguments]
+        return self.apply(f, args)
+
+    def apply(self, f, args):
+        self.tracker.record_call(self.call.line, f, args)
+        return self.call.apply(f, args)
+
+    def tail_call(self, f, args):
+        # The context is allocated by the calling `js.Function`, but for this site
+        self.tracker.record_call(self.call.line, f, args)
+        return self.call.tail_call(f, args)
+
+
+class TailCallSite(CallSite):
+    """Call in tail position, recording the execution context it allocates."""
+
+    def eval(self, context):
+        call = ast.get_call(self.call)
+        f = js.get_value(call.obj.eval(context))
+        args = [js.get_value(argument.eval(context)) for argument in call.arguments]
+        return self.tail_call(f, args)
+
+
+def instrument(program, tracker):
+    """Return a copy of `program` recording its allocations in `tracker`."""
+    def add_sites(node):
+        if isinstance(node, ast.FunctionCall):
+            return CallSite(tracker=tracker, call=node)
+        elif isinstance(node, ast.TailCallStatement):
+            # Its call has already been replaced with a `CallSite`
+            return TailCallSite(tracker=tracker, call=node.expression.call)
+        elif isinstance(node, (ast.ArrayLiteral, ast.ObjectLiteral, ast.Constructor)):
+            return AllocationSite(tracker=tracker, expression=node)
+        elif isinstance(node, ast.FunctionDefinition):
+            return AllocationSite(tracker=tracker, expression=node)
+        elif isinstance(node, (ast.BinaryOp, ast.Assignment)) and node.op in ('+', '+='):
+            return AllocationSite(tracker=tracker, expression=node)
+        return node
+    return program.transform(add_sites)
@@ -10,53 +10,115 @@ def set_union(sets):
 
 def perform_binary_op(op, left, right):
     if op == '*':
-        return left * right
+        return js.multiply(left, right)
     elif op == '/':
-        return left / right
+        return js.divide(left, right)
     elif op == '%':
-        return left % right
+        return js.remainder(left, right)
     elif op == '+':
-        return left + right
+        return js.add(left, right)
     elif op == '-':
-        return left - right
+        return js.subtract(left, right)
     elif op == '<<':
-        return left << right
+        return js.shift_left(left, right)
     elif op == '>>':
-        return left >> right
+        return js.shift_right(left, right)
     elif op == '&':
-        return left & right
+        return js.bitwise_and(left, right)
     elif op == '^':
-        return left ^ right
+        return js.bitwise_xor(left, right)
     elif op == '|':
-        return left | right
+        return js.bitwise_or(left, right)
     else:
         raise ValueError('Unsupported binary operand: %r' % op)
 
 
+def transform_value(value, f):
+    if isinstance(value, Node):
+        return value.transform(f)
+    elif isinstance(value, list):
+        return [transform_value(item, f) for item in value]
+    elif isinstance(value, dict):
+        return dict((key, transform_value(item, f)) for key, item in value.items())
+    else:
+        return value
+
+
+class NodeType(type):
+    """Metaclass of AST nodes.
+
+    Fields listed in `arguments`, `children` and `metadata` of a node class become
+    its `__slots__` (so nodes don't carry a `__dict__`) and, unless the class defines
+    its own, the constructor is generated to assign them directly. The lists are
+    also stored as `argument_names`, `child_names` and `metadata_names` tuples, as
+    a field may shadow them (e.g. `FunctionCall.arguments`)."""
+    def __new__(mcs, name, bases, attrs):
+        base = bases[0]
+        argument_names = tuple(attrs.get('arguments', getattr(base, 'argument_names', ())))
+        child_names = tuple(attrs.get('children', getattr(base, 'child_names', ())))
+        metadata_names = tuple(attrs.get('metadata', getattr(base, 'metadata_names', ())))
+        fields = argument_names + child_names + metadata_names
+        inherited = set(getattr(base, 'field_names', ()))
+        attrs['__slots__'] = tuple(attrs.get('__slots__', ())) + tuple(
+            field for field in fields if field not in inherited)
+        attrs['argument_names'] = argument_names
+        attrs['child_names'] = child_names
+        attrs['metadata_names'] = metadata_names
+        attrs['field_names'] = fields
+        if '__init__' not in attrs and bases != (object,):
+            attrs['__init__'] = make_constructor(name, argument_names + child_names, metadata_names)
+        return type.__new__(mcs, name, bases, attrs)
+
+
+def make_constructor(class_name, required, optional):
+    """Return `__init__` assigning `required` and `optional` (defaulting to None) keyword arguments."""
+    parameters = ['self'] + list(required) + ['%s=None' % name for name in optional]
+    lines = ['def __init__(%s):' % ', '.join(parameters)]
+    lines.extend('    self.%s = %s' % (name, name) for name in required + optional)
+    if len(lines) == 1:
+        lines.append('    pass')
+    namespace = {}
+    exec compile('\n'.join(lines), '<%s constructor>' % class_name, 'exec') in namespace
+    return namespace['__init__']
+
+
 class Node(object):
-    """Abstract base class for AST nodes."""
+    """Abstract base class for AST nodes.
+
+    Nodes aren't changed after parsing and `eval` keeps all state of a run in
+    the execution context, so one program can run in many threads at once,
+    each in its own context. Caches of derived data (like compiled code in
+    `jspy.compiler`) are kept outside of nodes and guarded by locks."""
+    __metaclass__ = NodeType
+    __slots__ = ('__weakref__',)
     arguments = []
     children = []
-    
+    # Optional attributes not taking part in comparisons, like positions in source code
+    metadata = []
+
     def __init__(self, **kwargs):
-        for name in self.arguments:
+        for name in self.argument_names:
             setattr(self, name, kwargs.pop(name))
-        for name in self.children:
+        for name in self.child_names:
             setattr(self, name, kwargs.pop(name))
+        for name in self.metadata_names:
+            setattr(self, name, kwargs.pop(name, None))
         assert len(kwargs) == 0
 
     def __eq__(self, other):
         if self.__class__ is not other.__class__:
             return False
-        return (self.arguments == other.arguments and self.children == other.children
-                and all(getattr(self, name) == getattr(other, name) for name in self.arguments)
-                and all(getattr(self, name) == getattr(other, name) for name in self.children))
+        return (all(getattr(self, name) == getattr(other, name) for name in self.argument_names)
+                and all(getattr(self, name) == getattr(other, name) for name in self.child_names))
+
+    def __ne__(self, other):
+        return not self == other
 
     def __repr__(self):
         kwargs = {}
-        for name in self.arguments:
+        for name in self.argument_names:
             kwargs[name] = getattr(self, name)
-        for name in self.children:
+        for name in self.child_names:
             kwargs[name] = getattr(self, name)
         kwargs_repr = ', '.join('%s=%r' % (name, value) for name, value in kwargs.items())
         return '%s(%s)' % (self.__class__.__name__, kwargs_repr)
@@ -65,6 +127,19 @@ class Node(object):
         """Evaluate the expression (possibly modifying context) and return its value."""
         raise NotImplementedError()
 
+    def transform(self, f):
+        """Return a transformed copy of the tree, leaving this one intact.
+
+        Every node of the copy is replaced by `f(node)`, after its children."""
+        kwargs = {}
+        for name in self.argument_names:
+            kwargs[name] = getattr(self, name)
+        for name in self.child_names:
+            kwargs[name] = transform_value(getattr(self, name), f)
+        for name in self.metadata_names:
+            kwargs[name] = getattr(self, name)
+        return f(self.__class__(**kwargs))
+
     def get_declared_vars(self):
         """Return a set of all variables declared in this scope.
 
@@ -98,6 +173,7 @@ class Literal(Node):
 
 class ArrayLiteral(Node):
     children = ['items']
+    metadata = ['line']
 
     def eval(self, context):
         items = [self.get_item_value(item, context) for item in self.items]
@@ -112,9 +188,11 @@ class ArrayLiteral(Node):
 
 class ObjectLiteral(Node):
     children = ['items']
+    metadata = ['line']
 
     def eval(self, context):
-        items = dict((name, js.get_value(e.eval(context))) for name, e in self.items.items())
+        items = dict((js.property_key(name), js.get_value(e.eval(context)))
+                     for name, e in self.items.items())
         return js.Object(items=items)
 
 
@@ -122,26 +200,57 @@ class PropertyAccess(Node):
     children = ['obj', 'key']
 
     def eval(self, context):
-        base_value = js.get_value(self.obj.eval(context))
-        property_name_value = js.get_value(self.key.eval(context))
+        base_value = js.flatten(js.get_value(self.obj.eval(context)))
+        property_name_value = js.flatten(js.get_value(self.key.eval(context)))
         return js.Reference(name=property_name_value, base=base_value)
 
 
 class Constructor(Node):
     children = ['obj', 'arguments']
+    metadata = ['line']
 
     def eval(self, context):
-        # TODO
+        constructor = js.get_value(self.obj.eval(context))
+        return self.apply(constructor, [js.get_value(argument.eval(context))
+                                        for argument in self.arguments])
+
+    def apply(self, constructor, args):
+        """Construct an object with evaluated `constructor` and `args`."""
+        if isinstance(constructor, js.NativeFunction):
+            return constructor.call(None, args)
+        # TODO: Constructing objects with JavaScript functions
         return js.Object()
 
 
 class FunctionCall(Node):
     children = ['obj', 'arguments']
+    metadata = ['line']
 
     def eval(self, context):
         f = js.get_value(self.obj.eval(context))
         return f.call(None, [js.get_value(argument.eval(context)) for argument in self.arguments])
 
+    def apply(self, f, args):
+        """Call evaluated function `f` with evaluated `args`."""
+        return f.call(None, args)
+
+    def tail_call(self, f, args):
+        """Return the completion of a call of `f` in tail position, see `TailCallStatement`."""
+        return js.Completion(js.RETURN, js.TailCall(f, None, args), js.EMPTY)
+
+
+def get_call(node):
+    """Return the `FunctionCall` or `Constructor` wrapped by `node`.
+
+    Instrumentation wraps calls in nodes keeping the call in their `call`
+    attribute and having `apply` and `tail_call` methods like the call (see
+    `jspy.hooks.CallHook` and `jspy.allocations.CallSite`). They may wrap each
+    other, in any order; the outermost one evaluates the function and arguments
+    and passes them down through these methods."""
+    while not isinstance(node, (FunctionCall, Constructor)):
+        node = node.call
+    return node
+
 
 class UnaryOp(Node):
     arguments = ['op']
@@ -149,8 +258,10 @@ class UnaryOp(Node):
 
     def eval(self, context):
         expr = self.expression.eval(context)
-        value = js.get_value(expr)
-        
+        return self.apply(expr, js.get_value(expr))
+
+    def apply(self, expr, value):
+        """Apply the operator to `value` of the evaluated expression `expr`."""
         if self.op == 'delete':
             # TODO
             return True
@@ -160,27 +271,27 @@ class UnaryOp(Node):
             # TODO
             return 'object'
         elif self.op == '++':
-            new_value = value + 1
+            new_value = js.add(value, 1)
             js.put_value(expr, new_value)
             return new_value
         elif self.op == '--':
-            new_value = value - 1
+            new_value = js.subtract(value, 1)
             js.put_value(expr, new_value)
             return new_value
         elif self.op == 'postfix++':
             old_value = value
-            js.put_value(expr, old_value + 1)
+            js.put_value(expr, js.add(old_value, 1))
             return old_value
         elif self.op == 'postfix--':
             old_value = value
-            js.put_value(expr, old_value - 1)
+            js.put_value(expr, js.subtract(old_value, 1))
             return old_value           
         elif self.op == '+':
             return +value
         elif self.op == '-':
-            return -value
+            return js.negate(value)
         elif self.op == '~':
-            return ~value
+            return js.bitwise_not(value)
         elif self.op == '!':
             return not value
         else:
@@ -190,24 +301,29 @@ class UnaryOp(Node):
 class BinaryOp(Node):
     arguments = ['op']
     children = ['left_expression', 'right_expression']
+    metadata = ['line']
 
     def eval(self, context):
         left = js.get_value(self.left_expression.eval(context))
         right = js.get_value(self.right_expression.eval(context))
+        return self.apply(left, right)
+
+    def apply(self, left, right):
+        """Apply the operator to values of both operands."""
         if self.op == '*':
-            return left * right
+            return js.multiply(left, right)
         elif self.op == '/':
-            return left / right
+            return js.divide(left, right)
         elif self.op == '%':
-            return left % right
+            return js.remainder(left, right)
         elif self.op == '+':
-            return left + right
+            return js.add(left, right)
         elif self.op == '-':
-            return left - right
+            return js.subtract(left, right)
         elif self.op == '<<':
-            return left << right
+            return js.shift_left(left, right)
         elif self.op == '>>':
-            return left >> right
+            return js.shift_right(left, right)
         elif self.op == '<':
             return left < right
         elif self.op == '<=':
@@ -231,11 +347,11 @@ class BinaryOp(Node):
         elif self.op == '!==':
             return left != right
         elif self.op == '&':
-            return left & right
+            return js.bitwise_and(left, right)
         elif self.op == '^':
-            return left ^ right
+            return js.bitwise_xor(left, right)
         elif self.op == '|':
-            return left | right
+            return js.bitwise_or(left, right)
         elif self.op == '&&':
             return left and right
         elif self.op == '||':
@@ -258,10 +374,14 @@ class ConditionalOp(Node):
 class Assignment(Node):
     arguments = ['op']
     children = ['reference', 'expression']
+    metadata = ['line']
 
     def eval(self, context):
         ref = self.reference.eval(context)
-        value = js.get_value(self.expression.eval(context))
+        return self.apply(ref, js.get_value(self.expression.eval(context)))
+
+    def apply(self, ref, value):
+        """Assign `value` to reference `ref`."""
         if self.op == '=':
             js.put_value(ref, value)
             return value
@@ -356,11 +476,20 @@ class IfStatement(Node):
                           self.false_statement.get_declared_vars()])
 
 
+def tier_up(loop, context):
+    """Return compiled code for a hot `loop` or None (see `jspy.compiler`)."""
+    from jspy import compiler
+    return compiler.compile_loop(loop, context)
+
+
 class WhileStatement(Node):
     children = ['condition', 'statement']
+    # Number of iterations after which the loop is compiled
+    hot_iterations = 1000
 
     def eval(self, context):
         result_value = js.EMPTY
+        iterations = 0
         while True:
             condition_value = js.get_value(self.condition.eval(context))
             if not condition_value:
@@ -372,6 +501,12 @@ class WhileStatement(Node):
                 return js.Completion(js.NORMAL, result_value, js.EMPTY)
             elif js.is_abrupt(stmt) and stmt.type is not js.CONTINUE:
                 return stmt
+            iterations += 1
+            if iterations == self.hot_iterations:
+                code = tier_up(self, context)
+                if code is not None:
+                    # Continue from the next iteration in compiled code
+                    return code.run(context, result_value)
 
     def get_declared_vars(self):
         return self.statement.get_declared_vars()
@@ -379,10 +514,13 @@ class WhileStatement(Node):
 
 class DoWhileStatement(Node):
     children = ['condition', 'statement']
+    # Number of iterations after which the loop is compiled
+    hot_iterations = 1000
 
     def eval(self, context):
         result_value = js.EMPTY
         iterating = True
+        iterations = 0
         while iterating:
             stmt = self.statement.eval(context)
             if stmt.value is not js.EMPTY:
@@ -392,6 +530,11 @@ class DoWhileStatement(Node):
             elif js.is_abrupt(stmt) and stmt.type is not js.CONTINUE:
                 return stmt
             iterating = js.get_value(self.condition.eval(context))
+            iterations += 1
+            if iterating and iterations == self.hot_iterations:
+                code = tier_up(self, context)
+                if code is not None:
+                    return code.run(context, result_value)
         
         return js.Completion(js.NORMAL, result_value, js.EMPTY)
 
@@ -421,6 +564,19 @@ class ReturnStatement(Node):
                                  js.EMPTY)
 
 
+class TailCallStatement(ReturnStatement):
+    """Return statement with a function call in tail position (`return f(...);`).
+
+    Instead of calling the function, it returns a `js.TailCall` and lets the
+    calling `js.Function` make the call, so tail calls don't use up the stack."""
+
+    def eval(self, context):
+        call = self.expression
+        f = js.get_value(call.obj.eval(context))
+        args = [js.get_value(argument.eval(context)) for argument in call.arguments]
+        return js.Completion(js.RETURN, js.TailCall(f, None, args), js.EMPTY)
+
+
 class DebuggerStatement(Node):
     def eval(self, context):
         # According to [ECMA-262 12.15] this statement should
@@ -433,14 +589,24 @@ class DebuggerStatement(Node):
 #
 class FunctionDefinition(Node):
     children = ['parameters', 'body']
+    # Name of the variable or property the function is assigned to and its line in source code
+    metadata = ['name', 'line']
+    __slots__ = ('parameter_names', 'declared_vars', 'frame_template')
 
-    def eval(self, context):
-        return js.Function(parameters=self.get_parameter_names(context),
-                           body=self.body,
-                           scope=context)
-
-    def get_parameter_names(self, context):
+    def __init__(self, **kwargs):
+        super(FunctionDefinition, self).__init__(**kwargs)
+        # Variable hoisting only depends on the code, so do it once instead of on every evaluation
         if self.parameters is None:
-            return []
+            self.parameter_names = []
         else:
-            return [p.eval(context).name for p in self.parameters]
+            self.parameter_names = [p.name for p in self.parameters]
+        self.declared_vars = self.body.get_declared_vars()
+        self.frame_template = js.make_frame_template(self.parameter_names, self.declared_vars)
+
+    def eval(self, context):
+        return js.Function(parameters=self.parameter_names,
+                           body=self.body,
+                           scope=context,
+                           frame_template=self.frame_template,
+                           name=self.name,
+                           line=self.line)
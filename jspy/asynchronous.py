@@ -0,0 +1,144 @@
+"""Running programs that wait for results of native functions without blocking.
+
+A native function doing I/O can return a future instead of its result: any
+object with `add_done_callback` and `result` methods, like `Future` below,
+`concurrent.futures.Future` or futures of Tornado and asyncio. Programs run by
+`eval_string_async` are run by `jspy.machine` and suspended at such a call. The
+caller gets a future of the program's `(value, context)` right away, and the
+program is resumed by the callback of the awaited future, when the host's event
+loop (or thread pool) completes it. So many programs can wait for I/O at once in
+a single thread:
+
+    def fetch(this, args):
+        future = Future()
+        loop.request(args[0], callback=future.set_result)
+        return future
+
+    future = eval_string_async('var page = fetch(url);', {'fetch': NativeFunction(fetch)})
+    future.add_done_callback(lambda f: handle(f.result()))
+
+An exception set on an awaited future ends the program with that exception, as
+JavaScript code can't catch it (there's no `try` statement yet).
+
+Timers and microtasks the program schedules (see `jspy.timers`) are run once it
+has finished, before its future is done. Their callbacks run to completion, so
+they can't wait for futures."""
+import threading
+from jspy.machine import Machine
+from jspy.parser import Parser
+
+
+class Future(object):
+    """Result of an operation that's not done yet, for hosts without futures of their own."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.callbacks = []
+        self.is_done = False
+        self.value = None
+        self.error = None
+
+    def done(self):
+        return self.is_done
+
+    def result(self):
+        """Return the result or raise the exception of the operation."""
+        if not self.is_done:
+            raise RuntimeError('Result isn\'t ready yet')
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def exception(self):
+        if not self.is_done:
+            raise RuntimeError('Result isn\'t ready yet')
+        return self.error
+
+    def add_done_callback(self, f):
+        """Call `f` with this future when it's done (right away if it's done already)."""
+        with self.lock:
+            if not self.is_done:
+                self.callbacks.append(f)
+                return
+        f(self)
+
+    def set_result(self, value):
+        self.finish(value, None)
+
+    def set_exception(self, error):
+        self.finish(None, error)
+
+    def finish(self, value, error):
+        with self.lock:
+            if self.is_done:
+                raise RuntimeError('Future is done already')
+            self.value = value
+            self.error = error
+            self.is_done = True
+            callbacks, self.callbacks = self.callbacks, []
+        for f in callbacks:
+            f(self)
+
+    def __repr__(self):
+        if not self.is_done:
+            return 'Future(pending)'
+        elif self.error is not None:
+            return 'Future(error=%r)' % (self.error,)
+        return 'Future(value=%r)' % (self.value,)
+
+
+def eval_string_async(s, global_objects=None, max_steps=None, timeout=None, hooks=None,
+                      allocations=None, context=None):
+    """Start running JavaScript code in string `s` (see `jspy.eval_string`) and
+    return a `Future` of its `(value, context)`."""
+    return eval_program_async(Parser().parse(s), global_objects, max_steps=max_steps,
+                              timeout=timeout, hooks=hooks, allocations=allocations,
+                              context=context)
+
+
+def eval_program_async(program, global_objects=None, max_steps=None, timeout=None, hooks=None,
+                       allocations=None, context=None):
+    """Start running parsed `program` and return a `Future` of its `(value, context)`."""
+    from jspy import prepare_program
+    program, context, budget = prepare_program(program, global_objects, max_steps, timeout,
+                                               hooks, allocations, context)
+    future = Future()
+    run(Machine(program, context, budget), context, future)
+    return future
+
+
+def run(machine, context, future):
+    """Run `machine` until it finishes or waits for a future that isn't done yet."""
+    while True:
+        try:
+            if machine.run():
+                from jspy import flush_console, run_event_loop
+                run_event_loop(context, machine.budget, stackless=True)
+                flush_console(context)
+                future.set_result((machine.value.value, context))
+                return
+            awaited = machine.future
+            if not awaited.done():
+                awaited.add_done_callback(lambda awaited: resume(machine, context, future, awaited))
+                return
+            machine.resume(awaited.result())
+        except Exception, e:
+            fail(context, future, e)
+            return
+
+
+def resume(machine, context, future, awaited):
+    try:
+        machine.resume(awaited.result())
+    except Exception, e:
+        fail(context, future, e)
+        return
+    run(machine, context, future)
+
+
+def fail(context, future, error):
+    """End the program with `error`, flushing output it logged before."""
+    from jspy import flush_console
+    try:
+        flush_console(context)
+    finally:
+        future.set_exception(error)
@@ -0,0 +1,81 @@
+"""Running many independent programs in a pool of worker processes.
+
+`eval_many` hands programs out to `workers` processes. Every worker creates
+its parser once and runs one program after another. Results are yielded as
+soon as programs finish, so not in the order they were given. Every `Result`
+carries the position of its program, its value converted by `js.to_python`, its
+error, its console output and its running time.
+
+Like with `multiprocessing` in general, on platforms without `fork` the module
+calling `eval_many` must be importable without side effects."""
+import cPickle as pickle
+import multiprocessing
+import os.path
+import time
+from collections import namedtuple
+from StringIO import StringIO
+from jspy import js
+
+
+# `index` of the program, `file_name` it was read from (or None), its `value`,
+# `error` message (or None), console `output` and `seconds` spent parsing and running it
+Result = namedtuple('Result', 'index file_name value error output seconds')
+
+# Parser of the worker process, created by `init_worker`
+parser = None
+
+
+def init_worker():
+    global parser
+    from jspy.parser import Parser
+    parser = Parser()
+
+
+def to_result_value(value):
+    """Return `value` converted to Python, in a form that can be sent between processes."""
+    value = js.to_python(value)
+    if value is js.UNDEFINED:
+        return None
+    pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    return value
+
+
+def run_job(job):
+    """Run a program in a worker and return its `Result`."""
+    from jspy import create_default_global_objects, eval_program
+    index, source, options = job
+    file_name = None
+    if os.path.isfile(source):
+        file_name = source
+        with open(file_name) as f:
+            source = f.read().decode('utf-8')
+    out = StringIO()
+    global_objects = create_default_global_objects()
+    global_objects['console'] = js.Console(out)
+    value = error = None
+    start = time.time()
+    try:
+        result, context = eval_program(parser.parse(source), global_objects, **options)
+        value = to_result_value(result)
+    except Exception, e:
+        # Errors in one program don't affect the others
+        error = '%s: %s' % (e.__class__.__name__, e)
+    return Result(index, file_name, value, error, out.getvalue(), time.time() - start)
+
+
+def eval_many(sources, workers=None, **options):
+    """Run programs in `sources` in `workers` processes (by default one per CPU)
+    and yield their `Result`s in the order they finish.
+
+    Items of `sources` naming existing files are read from them, the others
+    are source code. `options` are passed to `jspy.eval_program` for every
+    program (e.g. `max_steps` or `timeout`)."""
+    jobs = ((index, source, options) for index, source in enumerate(sources))
+    pool = multiprocessing.Pool(workers, initializer=init_worker)
+    try:
+        for result in pool.imap_unordered(run_job, jobs):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,191 @@
+"""Versioned binary format of parsed programs, loaded lazily from `mmap`.
+
+A file holds a `jspy.flatast.FlatTree`, little-endian:
+
+  * header (see `HEADER`): magic, format version, numbers of node classes,
+    nodes, field words and constants, and offsets of the sections below,
+  * names of node classes (from `jspy.ast`), each prefixed by its length,
+  * offsets of constants, then constants, each a type code and its data,
+  * `kinds` (a byte per node), `starts` and `fields` (4-byte words).
+
+`load` maps the file and reads columns and constants straight from the mapped
+pages when they're accessed, so nothing is deserialized up front. The returned
+program has function bodies left as `jspy.flatast.LazyNode`s, materialized on
+their first call. Pages mapped by a process are shared with workers it forks;
+only materialized nodes are private to every worker."""
+import mmap
+import struct
+from jspy import ast
+from jspy.flatast import FlatTree, get_layout
+
+
+MAGIC = 'JSPYAST\0'
+VERSION = 1
+
+# Magic, version, class count, node count, field count, constant count,
+# offsets of class names, constants, kinds, starts and fields
+HEADER = struct.Struct('<8sHIIIIIIIII')
+
+LENGTH = struct.Struct('<I')
+INT = struct.Struct('<q')
+FLOAT = struct.Struct('<d')
+
+
+class FormatError(ValueError):
+    pass
+
+
+def encode_constant(value):
+    if value is None:
+        return 'N'
+    elif value is True:
+        return 'T'
+    elif value is False:
+        return 'F'
+    elif isinstance(value, (int, long)):
+        return 'I' + INT.pack(value)
+    elif isinstance(value, float):
+        return 'D' + FLOAT.pack(value)
+    elif isinstance(value, unicode):
+        data = value.encode('utf-8')
+        return 'U' + LENGTH.pack(len(data)) + data
+    elif isinstance(value, str):
+        return 'S' + LENGTH.pack(len(value)) + value
+    raise FormatError('Can\'t serialize constant %r' % (value,))
+
+
+def decode_constant(data, offset):
+    code = data[offset]
+    if code == 'N':
+        return None
+    elif code == 'T':
+        return True
+    elif code == 'F':
+        return False
+    elif code == 'I':
+        return INT.unpack_from(data, offset + 1)[0]
+    elif code == 'D':
+        return FLOAT.unpack_from(data, offset + 1)[0]
+    length = LENGTH.unpack_from(data, offset + 1)[0]
+    value = data[offset + 5:offset + 5 + length]
+    if code == 'U':
+        return value.decode('utf-8')
+    elif code == 'S':
+        return value
+    raise FormatError('Unknown constant type %r' % code)
+
+
+def align(data):
+    """Pad `data` (a list of strings) to a multiple of 4 bytes."""
+    size = sum(len(chunk) for chunk in data)
+    data.append('\0' * (-size % 4))
+    return size - size % -4
+
+
+def dumps(program):
+    """Return `program` (an `ast.Node`) serialized to a string."""
+    tree = FlatTree.from_node(program)
+    for cls in tree.classes:
+        if getattr(ast, cls.__name__, None) is not cls:
+            raise FormatError('Can\'t serialize %s, not a node class of jspy.ast' % cls.__name__)
+    data = [HEADER.pack(MAGIC, VERSION, 0, 0, 0, 0, 0, 0, 0, 0, 0)]
+    names_offset = align(data)
+    for cls in tree.classes:
+        data.append(LENGTH.pack(len(cls.__name__)) + cls.__name__)
+    constants_offset = align(data)
+    constants = [encode_constant(value) for value in tree.constants]
+    offset = constants_offset + LENGTH.size * len(constants)
+    for constant in constants:
+        data.append(LENGTH.pack(offset))
+        offset += len(constant)
+    data.extend(constants)
+    kinds_offset = align(data)
+    data.append(tree.kinds.tostring())
+    starts_offset = align(data)
+    data.append(struct.pack('<%di' % len(tree.starts), *tree.starts))
+    fields_offset = align(data)
+    data.append(struct.pack('<%di' % len(tree.fields), *tree.fields))
+    data[0] = HEADER.pack(MAGIC, VERSION, len(tree.classes), len(tree.kinds), len(tree.fields),
+                          len(tree.constants), names_offset, constants_offset, kinds_offset,
+                          starts_offset, fields_offset)
+    return ''.join(data)
+
+
+def dump(program, f):
+    """Write `program` serialized to file `f`."""
+    f.write(dumps(program))
+
+
+class Column(object):
+    """Read-only sequence of `length` numbers in `data` at `offset`, like an `array`."""
+    def __init__(self, data, offset, length, format):
+        self.data = data
+        self.offset = offset
+        self.length = length
+        self.struct = struct.Struct('<' + format)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.length:
+            raise IndexError('Column index out of range')
+        return self.struct.unpack_from(self.data, self.offset + i * self.struct.size)[0]
+
+
+class ConstantPool(object):
+    """Constants in `data`, decoded on first access."""
+    def __init__(self, data, offset, length):
+        self.offsets = Column(data, offset, length, 'I')
+        self.data = data
+        self.values = {}
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        try:
+            return self.values[i]
+        except KeyError:
+            value = self.values[i] = decode_constant(self.data, self.offsets[i])
+            return value
+
+
+def load_tree(data):
+    """Return a `FlatTree` reading serialized program `data` (a string or `mmap`) lazily."""
+    if len(data) < HEADER.size:
+        raise FormatError('Not a serialized program')
+    (magic, version, class_count, node_count, field_count, constant_count, names_offset,
+     constants_offset, kinds_offset, starts_offset, fields_offset) = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise FormatError('Not a serialized program')
+    if version != VERSION:
+        raise FormatError('Unsupported format version %d (expected %d)' % (version, VERSION))
+    tree = FlatTree()
+    offset = names_offset
+    for i in xrange(class_count):
+        length = LENGTH.unpack_from(data, offset)[0]
+        name = data[offset + LENGTH.size:offset + LENGTH.size + length]
+        cls = getattr(ast, name, None)
+        if not isinstance(cls, ast.NodeType):
+            raise FormatError('Unknown node class %r' % name)
+        tree.classes.append(cls)
+        tree.layouts.append(get_layout(cls))
+        offset += LENGTH.size + length
+    tree.constants = ConstantPool(data, constants_offset, constant_count)
+    tree.kinds = Column(data, kinds_offset, node_count, 'B')
+    tree.starts = Column(data, starts_offset, node_count, 'i')
+    tree.fields = Column(data, fields_offset, field_count, 'i')
+    return tree
+
+
+def loads(data):
+    """Return the program serialized in `data`, with function bodies materialized on first call."""
+    return load_tree(data).materialize(lazy_functions=True)
+
+
+def load(file_name):
+    """Return the program serialized in file `file_name`, mapping it to memory."""
+    with open(file_name, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return loads(data)
@@ -3,6 +3,7 @@
 
 __all__ = (
     'unittest',
+    'numpy',
 )
 
 import sys
@@ -14,3 +15,9 @@ except ImportError:
         import unittest
     else:
        raise
+
+# NumPy is optional: typed arrays are exported as NumPy arrays only if it's installed
+try:
+    import numpy
+except ImportError:
+    numpy = None
@@ -0,0 +1,759 @@
+"""Compiler turning hot functions and loops into trees of Python closures.
+
+Code starts running in the tree-walking interpreter (`Node.eval`), which costs
+nothing to set up. `js.Function` counts its calls and loops count their
+iterations; once they cross `hot_calls` or `hot_iterations`, the body is compiled
+here. Every node becomes a closure taking the execution context, with operator
+dispatch done once at compile time, identifiers resolved to a fixed depth of
+the scope chain and without `js.Reference` objects for plain reads and writes.
+Hot loops switch to compiled code in the middle of running (on-stack replacement).
+
+Compiled code is shared by all functions created from the same definition, as
+long as they see the same shape of the scope chain (see `get_shape`). It may be
+speculative: `+`, `-`, `++` and `--` assume integer operands. Guards check the
+assumption and fall back to the generic operation, counting a deoptimization.
+After `Code.max_deopts` of them the code is dropped and the function goes back
+to the interpreter until it's hot again and gets compiled without speculation.
+
+With `background` set, compilation is done by a worker thread and the
+interpreter keeps running the code in the meantime."""
+import operator
+import threading
+import weakref
+from Queue import Queue
+from jspy import allocations, ast, hooks, js, metering
+from jspy.flatast import LazyNode
+
+
+# Compile functions in a background thread instead of on the spot
+background = False
+
+
+class Code(object):
+    """Compiled function body or loop. Call `run` with an execution context
+    (and the value of previous iterations for loops)."""
+    # Number of failed guards after which speculative code is dropped
+    max_deopts = 100
+
+    def __init__(self, speculate=True):
+        self.speculate = speculate
+        self.run = None
+        self.valid = True
+        self.deopts = 0
+
+    def deoptimize(self):
+        """Record a failed guard of speculative code."""
+        self.deopts += 1
+        if self.deopts >= self.max_deopts:
+            self.valid = False
+
+    def __repr__(self):
+        return 'Code(speculate=%r, valid=%r, deopts=%r)' % (self.speculate, self.valid, self.deopts)
+
+
+#
+# Scope chain
+#
+def get_scope_chain(context):
+    """Return execution contexts from `context` to the global one."""
+    chain = []
+    while context is not None:
+        chain.append(context)
+        context = context.parent
+    return chain
+
+
+def get_shape(context):
+    """Return a hashable description of names visible in `context`.
+
+    Contexts of function calls never get new names (all variables are hoisted),
+    so code compiled for one shape can read every name at a fixed depth. Only the
+    global context grows, so it's left out and reads from it are guarded."""
+    return tuple(frozenset(scope.env) for scope in get_scope_chain(context)[:-1])
+
+
+def make_getter(name, depth):
+    """Return a closure reading variable `name` from `depth` levels up the scope chain."""
+    if depth is None:
+        def get(context):
+            return context[name]
+    elif depth == 0:
+        def get(context):
+            try:
+                return context.env[name]
+            except KeyError:
+                return context[name]
+    elif depth == 1:
+        def get(context):
+            try:
+                return context.parent.env[name]
+            except KeyError:
+                return context[name]
+    elif depth == 2:
+        def get(context):
+            try:
+                return context.parent.parent.env[name]
+            except KeyError:
+                return context[name]
+    else:
+        def get(context):
+            scope = context
+            for i in xrange(depth):
+                scope = scope.parent
+            try:
+                return scope.env[name]
+            except KeyError:
+                return context[name]
+    return get
+
+
+def make_setter(name, depth):
+    """Return a closure assigning variable `name` at `depth` levels up the scope chain."""
+    if depth is None:
+        def set_(context, value):
+            context.set_mutable_binding(name, value)
+    elif depth == 0:
+        def set_(context, value):
+            context.env[name] = value
+    elif depth == 1:
+        def set_(context, value):
+            context.parent.env[name] = value
+    else:
+        def set_(context, value):
+            scope = context
+            for i in xrange(depth):
+                scope = scope.parent
+            scope.env[name] = value
+    return set_
+
+
+#
+# Operators
+#
+BINARY_OPERATORS = {
+    '*': js.multiply,
+    '/': js.divide,
+    '%': js.remainder,
+    '+': js.add,
+    '-': js.subtract,
+    '<<': js.shift_left,
+    '>>': js.shift_right,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '===': operator.eq,
+    '!==': operator.ne,
+    '&': js.bitwise_and,
+    '^': js.bitwise_xor,
+    '|': js.bitwise_or,
+    '&&': lambda left, right: left and right,
+    '||': lambda left, right: left or right,
+}
+
+
+class Compiler(object):
+    """Compiles nodes of one function body or loop into closures.
+
+    `scopes` holds sets of names visible at each depth of the scope chain."""
+    def __init__(self, code, scopes):
+        self.code = code
+        self.scopes = scopes
+
+    def resolve(self, name):
+        """Return depth of the scope where `name` is defined or None if it's not defined yet."""
+        for depth, names in enumerate(self.scopes):
+            if name in names:
+                return depth
+        return None
+
+    def compile(self, node):
+        """Return a closure evaluating `node` in a context, like `node.eval` does."""
+        compile_node = COMPILERS.get(node.__class__)
+        if compile_node is None:
+            return node.eval
+        return compile_node(self, node)
+
+    def compile_value(self, node):
+        """Like `compile`, but the closure returns a value instead of a reference."""
+        compile_node = VALUE_COMPILERS.get(node.__class__)
+        if compile_node is not None:
+            return compile_node(self, node)
+        elif node.__class__ in COMPILERS:
+            return self.compile(node)
+        evaluate = node.eval
+        return lambda context: js.get_value(evaluate(context))
+
+    #
+    # Expressions
+    #
+    def compile_identifier(self, node):
+        name = node.name
+        return lambda context: js.Reference(name, context)
+
+    def compile_identifier_value(self, node):
+        return make_getter(node.name, self.resolve(node.name))
+
+    def compile_literal(self, node):
+        value = node.value
+        return lambda context: value
+
+    def compile_array_literal(self, node):
+        items = [self.compile_value(item) if item is not None else None for item in node.items]
+        def array_literal(context):
+            values = [item(context) if item is not None else js.UNDEFINED for item in items]
+            # Elision: remove last item if it's undefined
+            if len(values) > 0 and values[-1] is js.UNDEFINED:
+                values.pop()
+            return js.Array(items=values)
+        return array_literal
+
+    def compile_object_literal(self, node):
+        items = [(js.property_key(name), self.compile_value(e)) for name, e in node.items.items()]
+        def object_literal(context):
+            return js.Object(items=dict((key, item(context)) for key, item in items))
+        return object_literal
+
+    def compile_property_access(self, node):
+        obj = self.compile_value(node.obj)
+        key = self.compile_value(node.key)
+        flatten = js.flatten
+        def property_access(context):
+            base = flatten(obj(context))
+            return js.Reference(name=flatten(key(context)), base=base)
+        return property_access
+
+    def compile_property_access_value(self, node):
+        obj = self.compile_value(node.obj)
+        flatten = js.flatten
+        if isinstance(node.key, ast.Literal):
+            name = flatten(node.key.value)
+            def property_access(context):
+                base = flatten(obj(context))
+                if base is js.UNDEFINED:
+                    return js.Reference(name, base).get_value()
+                return base.get_binding_value(name)
+        else:
+            key = self.compile_value(node.key)
+            def property_access(context):
+                base = flatten(obj(context))
+                name = flatten(key(context))
+                if base is js.UNDEFINED:
+                    return js.Reference(name, base).get_value()
+                return base.get_binding_value(name)
+        return property_access
+
+    def compile_constructor(self, node):
+        obj = self.compile_value(node.obj)
+        arguments = [self.compile_value(argument) for argument in node.arguments]
+        def constructor(context):
+            f = obj(context)
+            args = [argument(context) for argument in arguments]
+            if isinstance(f, js.NativeFunction):
+                return f.call(None, args)
+            # TODO: Constructing objects with JavaScript functions
+            return js.Object()
+        return constructor
+
+    def compile_function_call(self, node):
+        obj = self.compile_value(node.obj)
+        arguments = [self.compile_value(argument) for argument in node.arguments]
+        def function_call(context):
+            f = obj(context)
+            return f.call(None, [argument(context) for argument in arguments])
+        return function_call
+
+    def compile_unary_op(self, node):
+        op = node.op
+        if op in ('++', '--', 'postfix++', 'postfix--') and isinstance(node.expression, ast.Identifier):
+            return self.compile_update(node)
+        if op in ('+', '-', '~', '!', 'void'):
+            value = self.compile_value(node.expression)
+            if op == '+':
+                return lambda context: +value(context)
+            elif op == '-':
+                return lambda context: js.negate(value(context))
+            elif op == '~':
+                return lambda context: js.bitwise_not(value(context))
+            elif op == '!':
+                return lambda context: not value(context)
+            else:
+                def void(context):
+                    value(context)
+                    return js.UNDEFINED
+                return void
+        expression = self.compile(node.expression)
+        apply = node.apply
+        def unary_op(context):
+            expr = expression(context)
+            return apply(expr, js.get_value(expr))
+        return unary_op
+
+    def compile_update(self, node):
+        """Compile `++` and `--` applied to a variable."""
+        name = node.expression.name
+        depth = self.resolve(name)
+        get = make_getter(name, depth)
+        set_ = make_setter(name, depth)
+        postfix = node.op.startswith('postfix')
+        if node.op.endswith('++'):
+            step = self.compile_arithmetic(js.add)
+        else:
+            step = self.compile_arithmetic(js.subtract)
+        def update(context):
+            old_value = get(context)
+            new_value = step(old_value, 1)
+            set_(context, new_value)
+            return old_value if postfix else new_value
+        return update
+
+    def compile_arithmetic(self, f):
+        """Return `js.add` or `js.subtract`, guarded by an integer fast path
+        if the code is speculative."""
+        if not self.code.speculate:
+            return f
+        deoptimize = self.code.deoptimize
+        max_safe_integer = js.MAX_SAFE_INTEGER
+        if f is js.add:
+            def arithmetic(left, right):
+                if type(left) is int and type(right) is int:
+                    result = left + right
+                    if -max_safe_integer <= result <= max_safe_integer:
+                        return result
+                else:
+                    deoptimize()
+                return f(left, right)
+        else:
+            def arithmetic(left, right):
+                if type(left) is int and type(right) is int:
+                    result = left - right
+                    if -max_safe_integer <= result <= max_safe_integer:
+                        return result
+                else:
+                    deoptimize()
+                return f(left, right)
+        return arithmetic
+
+    def compile_binary_op(self, node):
+        left = self.compile_value(node.left_expression)
+        right = self.compile_value(node.right_expression)
+        apply = BINARY_OPERATORS.get(node.op)
+        if apply is None:
+            apply = node.apply
+        elif node.op in ('+', '-'):
+            apply = self.compile_arithmetic(apply)
+        return lambda context: apply(left(context), right(context))
+
+    def compile_conditional_op(self, node):
+        condition = self.compile_value(node.condition)
+        true_expression = self.compile_value(node.true_expression)
+        false_expression = self.compile_value(node.false_expression)
+        def conditional_op(context):
+            if condition(context):
+                return true_expression(context)
+            else:
+                return false_expression(context)
+        return conditional_op
+
+    def compile_assignment(self, node):
+        expression = self.compile_value(node.expression)
+        if not isinstance(node.reference, ast.Identifier):
+            reference = self.compile(node.reference)
+            apply = node.apply
+            return lambda context: apply(reference(context), expression(context))
+        name = node.reference.name
+        depth = self.resolve(name)
+        set_ = make_setter(name, depth)
+        if node.op == '=':
+            def assignment(context):
+                value = expression(context)
+                set_(context, value)
+                return value
+        else:
+            get = make_getter(name, depth)
+            op = node.op[:-1]
+            if op in ('+', '-'):
+                apply = self.compile_arithmetic(BINARY_OPERATORS[op])
+            else:
+                apply = lambda left, right: ast.perform_binary_op(op, left, right)
+            def assignment(context):
+                value = expression(context)
+                new_value = apply(get(context), value)
+                set_(context, new_value)
+                return new_value
+        return assignment
+
+    def compile_multi_expression(self, node):
+        left_expression = self.compile(node.left_expression)
+        right_expression = self.compile(node.right_expression)
+        def multi_expression(context):
+            left_expression(context)
+            return right_expression(context)
+        return multi_expression
+
+    def compile_multi_expression_value(self, node):
+        left_expression = self.compile(node.left_expression)
+        right_expression = self.compile_value(node.right_expression)
+        def multi_expression(context):
+            left_expression(context)
+            return right_expression(context)
+        return multi_expression
+
+    def compile_function_definition(self, node):
+        parameters = node.parameter_names
+        body = node.body
+        frame_template = node.frame_template
+        name = node.name
+        line = node.line
+        return lambda context: js.Function(parameters, body, context, frame_template, name, line)
+
+    #
+    # Statements
+    #
+    def compile_block(self, node):
+        statements = [self.compile(statement) for statement in node.statements]
+        def block(context):
+            result = js.EMPTY_COMPLETION
+            for statement in statements:
+                partial_result = statement(context)
+                if partial_result.type is not js.NORMAL:
+                    return partial_result
+                # Ignore empty statement values, as specified in [ECMA-262 12.1]
+                if partial_result.value is not js.EMPTY:
+                    result = partial_result
+            return result
+        return block
+
+    def compile_variable_declaration_list(self, node):
+        declarations = [self.compile(declaration) for declaration in node.declarations]
+        def variable_declaration_list(context):
+            for declaration in declarations:
+                declaration(context)
+            return js.EMPTY_COMPLETION
+        return variable_declaration_list
+
+    def compile_variable_declaration(self, node):
+        if node.initialiser is None:
+            return node.eval
+        name = node.identifier.name
+        set_ = make_setter(name, self.resolve(name))
+        initialiser = self.compile_value(node.initialiser)
+        completion = js.Completion(js.NORMAL, name, js.EMPTY)
+        def variable_declaration(context):
+            set_(context, initialiser(context))
+            return completion
+        return variable_declaration
+
+    def compile_expression_statement(self, node):
+        expression = self.compile_value(node.expression)
+        return lambda context: js.Completion(js.NORMAL, expression(context), js.EMPTY)
+
+    def compile_if_statement(self, node):
+        condition = self.compile_value(node.condition)
+        true_statement = self.compile(node.true_statement)
+        false_statement = self.compile(node.false_statement)
+        def if_statement(context):
+            if condition(context):
+                return true_statement(context)
+            else:
+                return false_statement(context)
+        return if_statement
+
+    def compile_while_statement(self, node):
+        if node.statement.__class__ is metering.Checkpoint:
+            return self.compile_metered_loop(node, True)
+        condition = self.compile_value(node.condition)
+        statement = self.compile(node.statement)
+        def while_statement(context, result_value=js.EMPTY):
+            while condition(context):
+                stmt = statement(context)
+                if stmt.value is not js.EMPTY:
+                    result_value = stmt.value
+                if stmt.type is js.BREAK:
+                    break
+                elif stmt.type is not js.NORMAL and stmt.type is not js.CONTINUE:
+                    return stmt
+            return js.Completion(js.NORMAL, result_value, js.EMPTY)
+        return while_statement
+
+    def compile_do_while_statement(self, node):
+        if node.statement.__class__ is metering.Checkpoint:
+            return self.compile_metered_loop(node, False)
+        condition = self.compile_value(node.condition)
+        statement = self.compile(node.statement)
+        def do_while_statement(context, result_value=js.EMPTY):
+            while True:
+                stmt = statement(context)
+                if stmt.value is not js.EMPTY:
+                    result_value = stmt.value
+                if stmt.type is js.BREAK:
+                    break
+                elif stmt.type is not js.NORMAL and stmt.type is not js.CONTINUE:
+                    return stmt
+                if not condition(context):
+                    break
+            return js.Completion(js.NORMAL, result_value, js.EMPTY)
+        return do_while_statement
+
+    def compile_metered_loop(self, node, test_first):
+        """Compile a loop with a `metering.Checkpoint` body, counting its steps
+        in the loop itself instead of calling the checkpoint every iteration."""
+        condition = self.compile_value(node.condition)
+        statement = self.compile(node.statement.statement)
+        meter = metering.meter
+        def metered_loop(context, result_value=js.EMPTY):
+            budget = meter.budget
+            if test_first and not condition(context):
+                return js.Completion(js.NORMAL, result_value, js.EMPTY)
+            while True:
+                if budget is not None:
+                    budget.steps += 1
+                    if budget.steps >= budget.next_check:
+                        budget.check()
+                stmt = statement(context)
+                if stmt.value is not js.EMPTY:
+                    result_value = stmt.value
+                if stmt.type is js.BREAK:
+                    break
+                elif stmt.type is not js.NORMAL and stmt.type is not js.CONTINUE:
+                    return stmt
+                if not condition(context):
+                    break
+            return js.Completion(js.NORMAL, result_value, js.EMPTY)
+        return metered_loop
+
+    def compile_return_statement(self, node):
+        if node.expression is None:
+            completion = js.Completion(js.RETURN, js.UNDEFINED, js.EMPTY)
+            return lambda context: completion
+        expression = self.compile_value(node.expression)
+        return lambda context: js.Completion(js.RETURN, expression(context), js.EMPTY)
+
+    def compile_tail_call_statement(self, node):
+        call = node.expression
+        obj = self.compile_value(call.obj)
+        arguments = [self.compile_value(argument) for argument in call.arguments]
+        def tail_call_statement(context):
+            f = obj(context)
+            args = [argument(context) for argument in arguments]
+            return js.Completion(js.RETURN, js.TailCall(f, None, args), js.EMPTY)
+        return tail_call_statement
+
+    def compile_lazy_node(self, node):
+        return self.compile(node.load())
+
+    #
+    # Instrumentation, see `jspy.metering`, `jspy.hooks` and `jspy.allocations`
+    #
+    def compile_checkpoint(self, node):
+        statement = self.compile(node.statement)
+        meter = metering.meter
+        def checkpoint(context):
+            budget = meter.budget
+            if budget is not None:
+                # Budget.tick, inlined
+                budget.steps += 1
+                if budget.steps >= budget.next_check:
+                    budget.check()
+            return statement(context)
+        return checkpoint
+
+    def compile_function_hook(self, node):
+        hooks, definition = node.hooks, node.definition
+        body = self.compile(node.body)
+        def function_hook(context):
+            hooks.enter_function(definition, context)
+            result = body(context)
+            if result.type is js.RETURN:
+                hooks.exit_function(definition, context, result.value)
+            else:
+                hooks.exit_function(definition, context, js.UNDEFINED)
+            return result
+        return function_hook
+
+    def compile_statement_hook(self, node):
+        hook, target = node.hooks.statement, node.statement
+        statement = self.compile(node.statement)
+        def statement_hook(context):
+            hook(target, context)
+            return statement(context)
+        return statement_hook
+
+    def compile_back_edge_hook(self, node):
+        back_edge, loop = node.hooks.back_edge, node.loop
+        statement = self.compile(node.statement)
+        def back_edge_hook(context):
+            result = statement(context)
+            if result.type is js.NORMAL or result.type is js.CONTINUE:
+                back_edge(loop, context)
+            return result
+        return back_edge_hook
+
+    def compile_wrapped_call(self, node):
+        """Compile a call wrapped by `hooks.CallHook` or `allocations.CallSite`."""
+        call = ast.get_call(node)
+        obj = self.compile_value(call.obj)
+        arguments = [self.compile_value(argument) for argument in call.arguments]
+        apply = node.apply
+        def wrapped_call(context):
+            f = obj(context)
+            return apply(f, [argument(context) for argument in arguments])
+        return wrapped_call
+
+    def compile_wrapped_tail_call(self, node):
+        """Compile a call in tail position wrapped by `hooks.TailCallHook` or
+        `allocations.TailCallSite`."""
+        call = ast.get_call(node)
+        obj = self.compile_value(call.obj)
+        arguments = [self.compile_value(argument) for argument in call.arguments]
+        tail_call = node.tail_call
+        def wrapped_tail_call(context):
+            f = obj(context)
+            return tail_call(f, [argument(context) for argument in arguments])
+        return wrapped_tail_call
+
+    def compile_allocation_site(self, node):
+        record_value, line = node.tracker.record_value, node.expression.line
+        expression = self.compile(node.expression)
+        def allocation_site(context):
+            value = expression(context)
+            record_value(line, value)
+            return value
+        return allocation_site
+
+
+COMPILERS = {
+    ast.Identifier: Compiler.compile_identifier,
+    ast.Literal: Compiler.compile_literal,
+    ast.ArrayLiteral: Compiler.compile_array_literal,
+    ast.ObjectLiteral: Compiler.compile_object_literal,
+    ast.PropertyAccess: Compiler.compile_property_access,
+    ast.Constructor: Compiler.compile_constructor,
+    ast.FunctionCall: Compiler.compile_function_call,
+    ast.UnaryOp: Compiler.compile_unary_op,
+    ast.BinaryOp: Compiler.compile_binary_op,
+    ast.ConditionalOp: Compiler.compile_conditional_op,
+    ast.Assignment: Compiler.compile_assignment,
+    ast.MultiExpression: Compiler.compile_multi_expression,
+    ast.FunctionDefinition: Compiler.compile_function_definition,
+    ast.Block: Compiler.compile_block,
+    ast.VariableDeclarationList: Compiler.compile_variable_declaration_list,
+    ast.VariableDeclaration: Compiler.compile_variable_declaration,
+    ast.ExpressionStatement: Compiler.compile_expression_statement,
+    ast.IfStatement: Compiler.compile_if_statement,
+    ast.WhileStatement: Compiler.compile_while_statement,
+    ast.DoWhileStatement: Compiler.compile_do_while_statement,
+    ast.ReturnStatement: Compiler.compile_return_statement,
+    ast.TailCallStatement: Compiler.compile_tail_call_statement,
+    LazyNode: Compiler.compile_lazy_node,
+    metering.Checkpoint: Compiler.compile_checkpoint,
+    hooks.FunctionHook: Compiler.compile_function_hook,
+    hooks.StatementHook: Compiler.compile_statement_hook,
+    hooks.BackEdgeHook: Compiler.compile_back_edge_hook,
+    hooks.CallHook: Compiler.compile_wrapped_call,
+    hooks.TailCallHook: Compiler.compile_wrapped_tail_call,
+    allocations.AllocationSite: Compiler.compile_allocation_site,
+    allocations.CallSite: Compiler.compile_wrapped_call,
+    allocations.TailCallSite: Compiler.compile_wrapped_tail_call,
+}
+
+# Nodes that evaluate to references get separate compilers for reading their values
+VALUE_COMPILERS = {
+    ast.Identifier: Compiler.compile_identifier_value,
+    ast.PropertyAccess: Compiler.compile_property_access_value,
+    ast.MultiExpression: Compiler.compile_multi_expression_value,
+}
+
+
+#
+# Code cache
+#
+# Compiled code of every function body and loop, by shape of the scope chain
+cache = weakref.WeakKeyDictionary()
+cache_lock = threading.RLock()
+queue = Queue()
+pending = set()
+worker = None
+
+
+def compile_code(node, scopes, speculate):
+    """Compile `node` and return its `Code`."""
+    code = Code(speculate)
+    code.run = Compiler(code, scopes).compile(node)
+    return code
+
+
+def get_code(node, shape, scopes):
+    """Return compiled code of `node`, compiling it if needed.
+
+    Returns None if the code is being compiled in the background or `node`
+    isn't an `ast.Node` (e.g. a view of a `jspy.flatast.FlatTree`)."""
+    if not isinstance(node, ast.Node):
+        return None
+    with cache_lock:
+        versions = cache.get(node)
+        if versions is None:
+            versions = cache[node] = {}
+        code = versions.get(shape)
+        if code is not None and code.valid:
+            return code
+        # Speculation failed, compile it again without any
+        speculate = code is None
+        if background:
+            if (node, shape) not in pending:
+                pending.add((node, shape))
+                queue.put((node, shape, scopes, speculate))
+                start_worker()
+            return None
+        code = versions[shape] = compile_code(node, scopes, speculate)
+        return code
+
+
+def compile_function(function):
+    """Return compiled code for the body of `js.Function` `function`."""
+    scopes = [set(function.frame_template)]
+    scopes.extend(set(scope.env) for scope in get_scope_chain(function.scope))
+    # The function's own frame is always the same, so it doesn't need to be a part of the shape
+    return get_code(function.body, get_shape(function.scope), scopes)
+
+
+def compile_loop(loop, context):
+    """Return compiled code for `loop` running in `context`."""
+    scopes = [set(scope.env) for scope in get_scope_chain(context)]
+    return get_code(loop, get_shape(context), scopes)
+
+
+def run_worker():
+    while True:
+        node, shape, scopes, speculate = queue.get()
+        try:
+            code = compile_code(node, scopes, speculate)
+            with cache_lock:
+                cache.setdefault(node, {})[shape] = code
+                pending.discard((node, shape))
+        finally:
+            queue.task_done()
+
+
+def start_worker():
+    global worker
+    if worker is None:
+        worker = threading.Thread(target=run_worker, name='jspy-compiler')
+        worker.daemon = True
+        worker.start()
+
+
+def wait():
+    """Wait until all functions queued for background compilation are compiled."""
+    queue.join()
+
+
+def set_thresholds(hot_calls, hot_iterations):
+    """Set how many calls of a function and iterations of a loop make them hot.
+
+    None turns compilation off."""
+    js.Function.hot_calls = hot_calls
+    ast.WhileStatement.hot_iterations = hot_iterations
+    ast.DoWhileStatement.hot_iterations = hot_iterations
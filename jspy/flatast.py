@@ -0,0 +1,294 @@
+"""Compact storage of an AST in flat arrays instead of a `Node` object per node.
+
+`FlatTree` keeps every node as a few integers: its kind (an index into
+`classes`) in `kinds`, and the offset of its fields in `starts`. Fields are
+words in `fields`, tagged in the lowest two bits:
+
+  * `NODE` - index of a child node,
+  * `CONSTANT` - index of a value (name, literal, operator or None) in `constants`,
+  * `LIST` - offset in `fields` of a list: its length followed by the items,
+  * `DICT` - offset in `fields` of a dict: its length followed by key, value pairs.
+
+Nothing is materialized to traverse or run a tree: `NodeView` reads fields of
+one node on attribute access and borrows methods of the node class, so
+`tree.root.eval(context)` runs the usual `Node.eval` code over the flat tree.
+It's slower than running `Node` objects, in exchange for memory, and isn't
+compiled by `jspy.compiler`.
+
+A view can also be materialized with `lazy_functions`, leaving function bodies
+as `LazyNode`s that are materialized on first use (see `jspy.binary`)."""
+import threading
+import types
+from array import array
+from jspy import ast, js
+
+
+# Held while materializing a `LazyNode`, so that threads running the same program agree on its body
+load_lock = threading.Lock()
+
+
+NODE, CONSTANT, LIST, DICT = range(4)
+
+
+# Fields stored besides those of the node class, computed when the tree is built,
+# so that loading a function doesn't need a walk of its body
+EXTRA_FIELDS = {ast.FunctionDefinition: ('declared_var_names',)}
+
+
+def get_field_names(cls):
+    return cls.field_names + EXTRA_FIELDS.get(cls, ())
+
+
+def get_layout(cls):
+    """Return positions of fields of node class `cls` by name."""
+    return dict((name, i) for i, name in enumerate(get_field_names(cls)))
+
+
+def constant_key(value):
+    """Return a key telling apart constants that are equal, but not the same (1, 1.0 and True, 0.0 and -0.0)."""
+    if isinstance(value, float):
+        return (float, repr(value))
+    return (type(value), value)
+
+
+class FlatTree(object):
+    def __init__(self):
+        self.classes = []
+        self.kinds = array('B')
+        self.starts = array('i')
+        self.fields = array('i')
+        self.constants = [None]
+        # Positions of fields in `fields` by name, for every kind
+        self.layouts = []
+        # Lazily computed attributes of function definitions, see `get_function_info`
+        self.function_info = {}
+
+    @classmethod
+    def from_node(cls, node):
+        """Return a flat copy of the tree rooted at `node`."""
+        tree = cls()
+        TreeBuilder(tree).add_node(node)
+        return tree
+
+    @property
+    def root(self):
+        return NodeView(self, 0)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def decode(self, word):
+        tag = word & 3
+        payload = word >> 2
+        if tag == NODE:
+            return NodeView(self, payload)
+        elif tag == CONSTANT:
+            return self.constants[payload]
+        elif tag == LIST:
+            length = self.fields[payload]
+            return [self.decode(self.fields[payload + 1 + i]) for i in xrange(length)]
+        else:
+            length = self.fields[payload]
+            return dict((self.constants[self.fields[payload + 1 + 2 * i]],
+                         self.decode(self.fields[payload + 2 + 2 * i]))
+                        for i in xrange(length))
+
+    def get_function_info(self, index):
+        """Return attributes computed by `ast.FunctionDefinition.__init__` for node `index`."""
+        info = self.function_info.get(index)
+        if info is None:
+            view = NodeView(self, index)
+            parameters = view.parameters
+            parameter_names = [] if parameters is None else [p.name for p in parameters]
+            declared_vars = set(view.declared_var_names)
+            info = self.function_info[index] = {
+                'parameter_names': parameter_names,
+                'declared_vars': declared_vars,
+                'frame_template': js.make_frame_template(parameter_names, declared_vars),
+            }
+        return info
+
+    def materialize(self, index=0, lazy_functions=False):
+        """Return node `index` and its subtree as `ast.Node` objects."""
+        return NodeView(self, index).materialize(lazy_functions)
+
+
+class TreeBuilder(object):
+    def __init__(self, tree):
+        self.tree = tree
+        self.class_indexes = {}
+        self.constant_indexes = {}
+
+    def add_class(self, cls):
+        index = self.class_indexes.get(cls)
+        if index is None:
+            index = self.class_indexes[cls] = len(self.tree.classes)
+            self.tree.classes.append(cls)
+            self.tree.layouts.append(get_layout(cls))
+        return index
+
+    def add_constant(self, value):
+        key = constant_key(value)
+        index = self.constant_indexes.get(key)
+        if index is None:
+            index = self.constant_indexes[key] = len(self.tree.constants)
+            self.tree.constants.append(value)
+        return index
+
+    def add_node(self, node):
+        tree = self.tree
+        cls = node.__class__
+        for name in cls.metadata_names:
+            if isinstance(getattr(node, name), ast.Node):
+                raise ValueError('Can\'t flatten %s with a node in %r' % (cls.__name__, name))
+        index = len(tree.kinds)
+        tree.kinds.append(self.add_class(cls))
+        start = len(tree.fields)
+        tree.starts.append(start)
+        field_names = get_field_names(cls)
+        tree.fields.extend([0] * len(field_names))
+        for i, name in enumerate(field_names):
+            if name == 'declared_var_names':
+                value = sorted(node.declared_vars)
+            else:
+                value = getattr(node, name)
+            tree.fields[start + i] = self.encode(value)
+        return index
+
+    def encode(self, value):
+        fields = self.tree.fields
+        if isinstance(value, ast.Node):
+            return self.add_node(value) << 2 | NODE
+        elif isinstance(value, list):
+            offset = len(fields)
+            fields.append(len(value))
+            fields.extend([0] * len(value))
+            for i, item in enumerate(value):
+                fields[offset + 1 + i] = self.encode(item)
+            return offset << 2 | LIST
+        elif isinstance(value, dict):
+            offset = len(fields)
+            fields.append(len(value))
+            fields.extend([0] * (2 * len(value)))
+            for i, (key, item) in enumerate(value.items()):
+                fields[offset + 1 + 2 * i] = self.add_constant(key)
+                fields[offset + 2 + 2 * i] = self.encode(item)
+            return offset << 2 | DICT
+        return self.add_constant(value) << 2 | CONSTANT
+
+
+# Attributes of `ast.FunctionDefinition` that aren't fields
+FUNCTION_INFO = frozenset(['parameter_names', 'declared_vars', 'frame_template'])
+
+
+class NodeView(object):
+    """Node `index` of a `FlatTree`, with the attributes and methods of its node class."""
+    __slots__ = ('tree', 'index', '__weakref__')
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def node_class(self):
+        return self.tree.classes[self.tree.kinds[self.index]]
+
+    def __getattr__(self, name):
+        tree = self.tree
+        position = tree.layouts[tree.kinds[self.index]].get(name)
+        if position is not None:
+            return tree.decode(tree.fields[tree.starts[self.index] + position])
+        cls = self.node_class
+        if name in FUNCTION_INFO and cls is ast.FunctionDefinition:
+            return tree.get_function_info(self.index)[name]
+        value = getattr(cls, name)
+        if isinstance(value, types.MethodType):
+            return types.MethodType(value.im_func, self)
+        return value
+
+    def iter_children(self):
+        """Yield views of child nodes."""
+        for name in self.node_class.child_names:
+            value = getattr(self, name)
+            if isinstance(value, NodeView):
+                yield value
+            elif isinstance(value, list):
+                for item in value:
+                    if isinstance(item, NodeView):
+                        yield item
+            elif isinstance(value, dict):
+                for item in value.values():
+                    yield item
+
+    def materialize(self, lazy_functions=False):
+        """Return this node and its subtree as `ast.Node` objects.
+
+        With `lazy_functions` set, bodies of functions are left as `LazyNode`s."""
+        cls = self.node_class
+        kwargs = {}
+        for name in cls.field_names:
+            if lazy_functions and cls is ast.FunctionDefinition and name == 'body':
+                kwargs[name] = LazyNode(view=self.body, declared_vars=self.declared_vars)
+            else:
+                kwargs[name] = materialize_value(getattr(self, name), lazy_functions)
+        return cls(**kwargs)
+
+    def __eq__(self, other):
+        return (isinstance(other, NodeView) and self.tree is other.tree
+                and self.index == other.index)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self.tree), self.index))
+
+    def __repr__(self):
+        return '<%s view #%d>' % (self.node_class.__name__, self.index)
+
+
+def materialize_value(value, lazy_functions=False):
+    if isinstance(value, NodeView):
+        return value.materialize(lazy_functions)
+    elif isinstance(value, list):
+        return [materialize_value(item, lazy_functions) for item in value]
+    elif isinstance(value, dict):
+        return dict((key, materialize_value(item, lazy_functions)) for key, item in value.items())
+    return value
+
+
+class LazyNode(ast.Node):
+    """Node of a flat tree at `view`, materialized when it's first evaluated.
+
+    `declared_vars` are variables declared in it, known without materializing.
+    Transforming it (e.g. to add hooks) materializes it as well."""
+    arguments = ['view', 'declared_vars']
+    metadata = ['node']
+
+    def load(self):
+        """Return the materialized node."""
+        node = self.node
+        if node is None:
+            with load_lock:
+                node = self.node
+                if node is None:
+                    node = self.node = self.view.materialize(lazy_functions=True)
+        return node
+
+    def eval(self, context):
+        return self.load().eval(context)
+
+    def transform(self, f):
+        return self.load().transform(f)
+
+    def get_declared_vars(self):
+        return set(self.declared_vars)
+
+    def __reduce__(self):
+        # Views of a mapped file can't be pickled or copied, the materialized node is instead
+        return (get_node, (self.load(),))
+
+
+def get_node(node):
+    """Return `node`, the materialized `LazyNode` it was pickled as."""
+    return node
@@ -0,0 +1,248 @@
+"""Copy-on-write forks of execution contexts.
+
+`fork(context)` (or `context.fork()`) returns a context that behaves like an
+independent copy of `context` with everything reachable from it (variables,
+objects, functions with their scope chains), but copies nothing up front.
+Variables of forked contexts and properties of forked objects are kept in
+`ForkedDict`s, which copy an entry of the original the first time it's read or
+written. So a fork only pays for the part of the state it touches, while the
+rest stays shared:
+
+    result, context = eval_file('prelude.js')
+    for scenario in scenarios:
+        eval_string(scenario, context=context.fork())
+
+Copies are made once per fork (aliases of an object stay aliases in the fork)
+and are shallow: a copied object gets a `ForkedDict` of the original's
+properties. AST nodes, native functions, `console` and primitive values are
+never copied. Compiled code of functions is shared as well. Timer functions
+(see `jspy.timers`) are the exception: each fork gets its own copy of their
+`EventLoop`, so timers scheduled by one fork run in that fork only.
+
+The original context becomes a template: it must not be run or modified while
+it has forks, as entries that a fork hasn't copied yet would change with it."""
+import heapq
+from collections import OrderedDict, deque
+from jspy import js
+from jspy.memoize import MemoizedFunction
+from jspy.timers import EventLoop, Timer
+from jspy.typedarray import ArrayBuffer, TypedArray
+
+
+class ForkedDict(dict):
+    """Dictionary starting as a copy of `base`, copying its entries with `fork` on first access."""
+    __slots__ = ('base', 'fork')
+
+    def __init__(self, base, fork):
+        super(ForkedDict, self).__init__()
+        self.base = base
+        self.fork = fork
+
+    def __missing__(self, key):
+        value = self.fork.copy(self.base[key])
+        dict.__setitem__(self, key, value)
+        return value
+
+    def materialize(self):
+        """Copy all remaining entries of `base`."""
+        if self.base:
+            for key in self.base:
+                if not dict.__contains__(self, key):
+                    self[key]
+            self.base = {}
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.base
+
+    has_key = __contains__
+
+    def keys(self):
+        if not self.base:
+            return dict.keys(self)
+        keys = dict.keys(self)
+        keys.extend(key for key in self.base if not dict.__contains__(self, key))
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    iterkeys = __iter__
+
+    def __len__(self):
+        return len(self.keys())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def setdefault(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            self[key] = default
+            return default
+
+    def pop(self, key, *default):
+        if key in self.base:
+            self[key]
+        return dict.pop(self, key, *default)
+
+    def __delitem__(self, key):
+        self.materialize()
+        dict.__delitem__(self, key)
+
+    def items(self):
+        self.materialize()
+        return dict.items(self)
+
+    def iteritems(self):
+        self.materialize()
+        return dict.iteritems(self)
+
+    def values(self):
+        self.materialize()
+        return dict.values(self)
+
+    def itervalues(self):
+        self.materialize()
+        return dict.itervalues(self)
+
+    def copy(self):
+        self.materialize()
+        return dict.copy(self)
+
+    def __eq__(self, other):
+        self.materialize()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        self.materialize()
+        return dict.__repr__(self)
+
+    def __reduce__(self):
+        # Pickled (e.g. by `jspy.snapshot`) as a plain dictionary
+        return (dict, (self.items(),))
+
+
+# Values that are never copied
+SHARED_TYPES = (type(None), bool, int, long, float, str, unicode, js.Rope, js.Console)
+
+
+class Fork(object):
+    def __init__(self):
+        # Copies by ids of the originals, kept alive here so their ids aren't reused
+        self.copies = {}
+
+    def copy(self, value):
+        """Return the copy of `value` in this fork, making it if needed."""
+        if type(value) in SHARED_TYPES:
+            return value
+        try:
+            return self.copies[id(value)][1]
+        except KeyError:
+            pass
+        copy_value = COPIERS.get(type(value))
+        if copy_value is None:
+            if isinstance(value, MemoizedFunction):
+                copy_value = Fork.copy_memoized_function
+            elif isinstance(value, TypedArray):
+                copy_value = Fork.copy_typed_array
+            elif isinstance(value, js.Object) and not isinstance(value, js.Console):
+                copy_value = Fork.copy_object
+            else:
+                # AST nodes, sentinels, native functions and other host values
+                return value
+        return copy_value(self, value)
+
+    def remember(self, value, copy):
+        self.copies[id(value)] = (value, copy)
+        return copy
+
+    def copy_context(self, context):
+        copy = self.remember(context, js.ExecutionContext.__new__(js.ExecutionContext))
+        copy.env = ForkedDict(context.env, self)
+        copy.parent = self.copy(context.parent)
+        return copy
+
+    def copy_object(self, obj):
+        copy = self.remember(obj, obj.__class__.__new__(obj.__class__))
+        copy.__dict__.update(obj.__dict__)
+        copy.d = ForkedDict(obj.d, self)
+        return copy
+
+    def copy_array_buffer(self, buffer):
+        copy = self.copy_object(buffer)
+        copy.data = bytearray(buffer.data)
+        return copy
+
+    def copy_typed_array(self, array):
+        copy = self.copy_object(array)
+        copy.buffer = self.copy(array.buffer)
+        copy.elements = (array.element_type * len(array.elements)).from_buffer(copy.buffer.data,
+                                                                               array.byte_offset)
+        return copy
+
+    def copy_function(self, function):
+        copy = self.remember(function, js.Function.__new__(js.Function))
+        for name in js.Function.__slots__:
+            setattr(copy, name, getattr(function, name))
+        copy.scope = self.copy(function.scope)
+        return copy
+
+    def copy_memoized_function(self, function):
+        copy = self.remember(function, MemoizedFunction(None, function.max_size))
+        copy.__dict__.update(function.__reduce__()[2])
+        copy.function = self.copy(function.function)
+        copy.cache = OrderedDict((key, self.copy(value)) for key, value in function.cache.items())
+        return copy
+
+    def copy_native_function(self, function):
+        loop = getattr(function.f, 'im_self', None)
+        if not isinstance(loop, EventLoop):
+            return function
+        # Bound to the fork's own loop
+        return self.remember(function, js.NativeFunction(getattr(self.copy(loop), function.f.__name__)))
+
+    def copy_event_loop(self, loop):
+        copy = self.remember(loop, EventLoop(loop.virtual_time))
+        copy.started = loop.started
+        copy.virtual_now = loop.virtual_now
+        copy.sequence = loop.sequence
+        copy.last_id = loop.last_id
+        for when, sequence, timer in loop.heap:
+            if not timer.cancelled:
+                copy_timer = Timer(timer.id, self.copy(timer.callback), self.copy(timer.args),
+                                   timer.interval)
+                copy.heap.append((when, sequence, copy_timer))
+                copy.timers[timer.id] = copy_timer
+        heapq.heapify(copy.heap)
+        copy.microtasks = deque((self.copy(callback), self.copy(args))
+                                for callback, args in loop.microtasks)
+        return copy
+
+    def copy_list(self, values):
+        copy = self.remember(values, [])
+        copy.extend(self.copy(value) for value in values)
+        return copy
+
+
+COPIERS = {
+    js.ExecutionContext: Fork.copy_context,
+    js.Object: Fork.copy_object,
+    js.Array: Fork.copy_object,
+    ArrayBuffer: Fork.copy_array_buffer,
+    js.Function: Fork.copy_function,
+    js.NativeFunction: Fork.copy_native_function,
+    EventLoop: Fork.copy_event_loop,
+    list: Fork.copy_list,
+}
+
+
+def fork(context):
+    """Return a copy-on-write fork of execution `context`."""
+    return Fork().copy(context)
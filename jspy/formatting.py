@@ -0,0 +1,218 @@
+"""Formatting JavaScript values for `console.log`, like Node's `util.inspect`.
+
+    >>> format_value(js.Array([1, 2.0, 'three', js.Object({'four': 4.5})]))
+    "[ 1, 2, 'three', { four: 4.5 } ]"
+
+Numbers are shown like JavaScript shows them (`2`, not `2.0`), strings inside
+arrays and objects are quoted and containers nested deeper than `max_depth`
+are shown as `[Array]` or `[Object]`. Only the first `max_array_length`
+elements of arrays and `max_string_length` characters of nested strings are
+shown, and they're found without going through the rest: arrays are walked in
+index order instead of sorting their keys, so `console.log(row)` costs about
+as much as the part of `row` it prints."""
+import math
+import re
+from itertools import islice
+from jspy import js
+from jspy.typedarray import ArrayBuffer, TypedArray
+
+
+IDENTIFIER = re.compile(r'^[A-Za-z_$][\w$]*$')
+
+
+def format_number(value):
+    """Return number `value` as a string, as defined in [ECMA-262 9.8.1]."""
+    if type(value) in (int, long):
+        return str(value)
+    if value != value:
+        return 'NaN'
+    if value == 0:
+        return '-0' if js.is_negative_zero(value) else '0'
+    if math.isinf(value):
+        return 'Infinity' if value > 0 else '-Infinity'
+    sign = '-' if value < 0 else ''
+    # `repr` gives the shortest digits that read back as the same double,
+    # only their placement differs between Python and JavaScript
+    mantissa, _, exponent = repr(abs(value)).partition('e')
+    whole, _, fraction = mantissa.partition('.')
+    digits = (whole + fraction).lstrip('0')
+    point = len(whole) + int(exponent or 0) - (len(whole + fraction) - len(digits))
+    digits = digits.rstrip('0')
+    if len(digits) <= point <= 21:
+        return sign + digits + '0' * (point - len(digits))
+    if 0 < point <= 21:
+        return sign + digits[:point] + '.' + digits[point:]
+    if -6 < point <= 0:
+        return sign + '0.' + '0' * -point + digits
+    exponent = point - 1
+    if len(digits) > 1:
+        digits = digits[0] + '.' + digits[1:]
+    return '%s%se%s%d' % (sign, digits, '+' if exponent > 0 else '-', abs(exponent))
+
+
+def get_index(key):
+    """Return array index named by property `key`, or None if it's not an index."""
+    if key.isdigit() and (key == '0' or key[0] != '0'):
+        return int(key)
+    return None
+
+
+def iter_elements(array):
+    """Yield `(index, value)` pairs of elements of `array` in index order.
+
+    Indices are looked up one by one, so getting the first elements doesn't
+    cost more than that. Only arrays with more holes than elements have their
+    (remaining) keys sorted instead."""
+    d = array.d
+    count = len(d)
+    index = found = 0
+    while found < count:
+        value = d.get(str(index), js.EMPTY)
+        if value is not js.EMPTY:
+            yield index, value
+            found += 1
+        elif index - found > count:
+            indices = sorted(i for i in (get_index(key) for key in d) if i is not None and i > index)
+            for index in indices:
+                yield index, d[str(index)]
+            return
+        index += 1
+
+
+def format_holes(count):
+    return '<%d empty item%s>' % (count, 's' if count > 1 else '')
+
+
+def quote(s):
+    if "'" in s and '"' not in s:
+        return '"%s"' % s.replace('\\', '\\\\').replace('\n', '\\n')
+    return "'%s'" % s.replace('\\', '\\\\').replace("'", "\\'").replace('\n', '\\n')
+
+
+class Formatter(object):
+    """Formats values with limits given to the constructor or the defaults below."""
+    max_depth = 2
+    max_array_length = 100
+    max_string_length = 10000
+
+    def __init__(self, max_depth=None, max_array_length=None, max_string_length=None):
+        if max_depth is not None:
+            self.max_depth = max_depth
+        if max_array_length is not None:
+            self.max_array_length = max_array_length
+        if max_string_length is not None:
+            self.max_string_length = max_string_length
+
+    def format_log(self, args):
+        """Return a line printed by `console.log` with `args`, encoded in UTF-8."""
+        line = ' '.join(self.format_arg(arg) for arg in args)
+        if isinstance(line, unicode):
+            line = line.encode('utf-8')
+        return line
+
+    def format_arg(self, value):
+        """Format `value`, showing strings as they are."""
+        if isinstance(value, basestring):
+            return value
+        elif isinstance(value, js.Rope):
+            return value.flatten()
+        return self.format_value(value)
+
+    def format_value(self, value, depth=0, path=()):
+        """Format `value` nested in `depth` containers, `path` being their ids."""
+        if type(value) is int:
+            return str(value)
+        elif value is None:
+            return 'null'
+        elif value is js.UNDEFINED:
+            return 'undefined'
+        elif isinstance(value, bool):
+            return 'true' if value else 'false'
+        elif isinstance(value, (int, long, float)):
+            return format_number(value)
+        elif isinstance(value, (basestring, js.Rope)):
+            return self.format_string(js.flatten(value))
+        elif isinstance(value, js.Function):
+            return '[Function: %s]' % value.name if value.name else '[Function (anonymous)]'
+        elif isinstance(value, js.NativeFunction):
+            return '[Function (native)]'
+        elif isinstance(value, js.Object):
+            if id(value) in path:
+                return '[Circular]'
+            return self.format_object(value, depth, path + (id(value),))
+        return str(value)
+
+    def format_string(self, s):
+        if len(s) > self.max_string_length:
+            more = len(s) - self.max_string_length
+            return "%s... %d more character%s" % (quote(s[:self.max_string_length]), more,
+                                                  's' if more > 1 else '')
+        return quote(s)
+
+    def format_object(self, obj, depth, path):
+        if isinstance(obj, js.Array):
+            if depth > self.max_depth:
+                return '[Array]'
+            return self.format_array(obj, depth, path)
+        elif isinstance(obj, TypedArray):
+            return self.format_typed_array(obj)
+        elif isinstance(obj, ArrayBuffer):
+            return 'ArrayBuffer { byteLength: %d }' % len(obj.data)
+        if depth > self.max_depth:
+            return '[Object]'
+        items = [self.format_property(key, value, depth, path) for key, value in obj.d.iteritems()]
+        if not items:
+            return '{}'
+        return '{ %s }' % ', '.join(items)
+
+    def format_property(self, key, value, depth, path):
+        if not IDENTIFIER.match(key):
+            key = quote(key)
+        return '%s: %s' % (key, self.format_value(value, depth + 1, path))
+
+    def format_array(self, array, depth, path):
+        d = array.d
+        shown = min(len(d), self.max_array_length)
+        try:
+            # Dense arrays, the common case
+            items = [self.format_value(d[str(index)], depth + 1, path) for index in xrange(shown)]
+        except KeyError:
+            items, shown = self.format_elements(array, depth, path)
+        if len(d) > shown:
+            # Properties that aren't indices
+            named = [(key, value) for key, value in d.iteritems() if get_index(key) is None]
+            rest = len(d) - shown - len(named)
+            if rest > 0:
+                items.append('... %d more item%s' % (rest, 's' if rest > 1 else ''))
+            items.extend(self.format_property(key, value, depth, path) for key, value in named)
+        if not items:
+            return '[]'
+        return '[ %s ]' % ', '.join(items)
+
+    def format_elements(self, array, depth, path):
+        """Return formatted elements and holes of sparse `array` and the number of elements."""
+        items = []
+        shown = next_index = 0
+        for index, value in islice(iter_elements(array), self.max_array_length):
+            if index > next_index:
+                items.append(format_holes(index - next_index))
+            items.append(self.format_value(value, depth + 1, path))
+            shown += 1
+            next_index = index + 1
+        return items, shown
+
+    def format_typed_array(self, array):
+        elements = array.elements
+        items = [format_number(value) for value in islice(elements, self.max_array_length)]
+        rest = len(elements) - len(items)
+        if rest > 0:
+            items.append('... %d more item%s' % (rest, 's' if rest > 1 else ''))
+        name = '%s(%d)' % (array.__class__.__name__, len(elements))
+        if not items:
+            return name + ' []'
+        return '%s [ %s ]' % (name, ', '.join(items))
+
+
+default_formatter = Formatter()
+format_value = default_formatter.format_value
+format_log = default_formatter.format_log
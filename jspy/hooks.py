@@ -0,0 +1,150 @@
+"""Hooks called by the interpreter when functions are entered and left, statements
+are executed, loops jump back and native functions are called.
+
+Like `jspy.metering`, hooks are placed only in an instrumented copy of the program
+(see `instrument`), so a program run without hooks doesn't pay anything for them."""
+from jspy import allocations, ast, js
+
+
+class Hooks(object):
+    """Base class for hooks, doing nothing. Override the methods you need."""
+
+    def enter_function(self, definition, context):
+        """Called before the body of a function defined by `ast.FunctionDefinition`
+        `definition` is run in `context` (arguments are in `context['arguments']`)."""
+
+    def exit_function(self, definition, context, value):
+        """Called after the body of a function has finished with return value `value`.
+
+        For calls in tail position (see `ast.TailCallStatement`) `value` is a
+        `js.TailCall` and the called function is entered next. Not called when
+        the body raises an exception."""
+
+    def statement(self, statement, context):
+        """Called before `statement` is executed."""
+
+    def back_edge(self, loop, context):
+        """Called after each iteration of `loop` that doesn't leave it."""
+
+    def enter_native(self, function, args):
+        """Called before `js.NativeFunction` `function` is called with `args`."""
+
+    def exit_native(self, function, args, value):
+        """Called after `function` has returned `value`."""
+
+
+def call_native(hooks, function, args):
+    hooks.enter_native(function, args)
+    value = function.call(None, args)
+    hooks.exit_native(function, args, value)
+    return value
+
+
+class FunctionHook(ast.Node):
+    """Body of a function, calling `hooks` when it's entered and left."""
+    arguments = ['hooks']
+    children = ['body']
+    metadata = ['definition']
+
+    def eval(self, context):
+        self.hooks.enter_function(self.definition, context)
+        result = self.body.eval(context)
+        if result.type is js.RETURN:
+            self.hooks.exit_function(self.definition, context, result.value)
+        else:
+            self.hooks.exit_function(self.definition, context, js.UNDEFINED)
+        return result
+
+    def get_declared_vars(self):
+        return self.body.get_declared_vars()
+
+
+class StatementHook(ast.Node):
+    arguments = ['hooks']
+    children = ['statement']
+
+    def eval(self, context):
+        self.hooks.statement(self.statement, context)
+        return self.statement.eval(context)
+
+    def get_declared_vars(self):
+        return self.statement.get_declared_vars()
+
+
+class BackEdgeHook(ast.Node):
+    """Body of `loop`, calling `hooks` after iterations that don't leave the loop."""
+    arguments = ['hooks']
+    children = ['statement']
+    metadata = ['loop']
+
+    def eval(self, context):
+        result = self.statement.eval(context)
+        if result.type is js.NORMAL or result.type is js.CONTINUE:
+            self.hooks.back_edge(self.loop, context)
+        return result
+
+    def get_declared_vars(self):
+        return self.statement.get_declared_vars()
+
+
+class CallHook(ast.Node):
+    """Function call or `new` expression, calling `hooks` around native functions.
+
+    `call` may be wrapped by other instrumentation too, see `ast.get_call`."""
+    arguments = ['hooks']
+    children = ['call']
+    metadata = ['line']
+
+    def eval(self, context):
+        call = ast.get_call(self.call)
+        f = js.get_value(call.obj.eval(context))
+        args = [js.get_value(argument.eval(context)) for argument in call.arguments]
+        return self.apply(f, args)
+
+    def apply(self, f, args):
+        if isinstance(f, js.NativeFunction):
+            self.hooks.enter_native(f, args)
+            value = self.call.apply(f, args)
+            self.hooks.exit_native(f, args, value)
+            return value
+        return self.call.apply(f, args)
+
+    def tail_call(self, f, args):
+        if isinstance(f, js.NativeFunction):
+            # Called right away, so the hooks see it
+            return js.Completion(js.RETURN, self.apply(f, args), js.EMPTY)
+        return self.call.tail_call(f, args)
+
+
+class TailCallHook(CallHook):
+    """Call in tail position, calling `hooks` around native functions."""
+
+    def eval(self, context):
+        call = ast.get_call(self.call)
+        f = js.get_value(call.obj.eval(context))
+        args = [js.get_value(argument.eval(context)) for argument in call.arguments]
+        return self.tail_call(f, args)
+
+
+STATEMENTS = (ast.VariableDeclarationList, ast.EmptyStatement, ast.ExpressionStatement,
+              ast.IfStatement, ast.WhileStatement, ast.DoWhileStatement, ast.ContinueStatement,
+              ast.BreakStatement, ast.ReturnStatement, ast.DebuggerStatement)
+
+
+def instrument(program, hooks):
+    """Return a copy of `program` calling `hooks`, an instance of `Hooks`."""
+    def add_hooks(node):
+        if isinstance(node, (ast.FunctionCall, ast.Constructor)):
+            # Allocation sites (see `jspy.allocations`) read the line of what they wrap
+            return CallHook(hooks=hooks, call=node, line=node.line)
+        elif isinstance(node, ast.TailCallStatement):
+            # Its call has already been replaced with a `CallHook`
+            node = TailCallHook(hooks=hooks, call=node.expression.call, line=node.expression.line)
+        elif isinstance(node, ast.FunctionDefinition):
+            node.body = FunctionHook(hooks=hooks, body=node.body, definition=node)
+        if isinstance(node, (ast.WhileStatement, ast.DoWhileStatement)):
+            node.statement = BackEdgeHook(hooks=hooks, statement=node.statement, loop=node)
+        if isinstance(node, STATEMENTS + (TailCallHook, allocations.TailCallSite)):
+            return StatementHook(hooks=hooks, statement=node)
+        return node
+    return program.transform(add_hooks)
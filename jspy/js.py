@@ -1,5 +1,8 @@
 """Module containing basic JavaScript types and objects."""
 from collections import namedtuple
+from itertools import islice, izip
+import math
+import re
 import sys
 
 
@@ -16,6 +19,9 @@ Completion = namedtuple('Completion', 'type value target')
 
 EMPTY_COMPLETION = Completion(NORMAL, EMPTY, EMPTY)
 
+# Function call in tail position, performed by the caller after the callee returns
+TailCall = namedtuple('TailCall', 'function this args')
+
 
 def is_abrupt(completion):
     return completion.type is not NORMAL
@@ -24,10 +30,315 @@ def is_abrupt(completion):
 def to_python(value):
     if isinstance(value, (Object, Function, NativeFunction)):
         return value.to_python()
+    elif isinstance(value, Rope):
+        return value.flatten()
     else:
         return value
 
 
+def flatten(value):
+    """Return `value`, converting ropes to plain Python strings."""
+    if isinstance(value, Rope):
+        return value.flatten()
+    return value
+
+
+#
+# Numbers
+#
+# JavaScript numbers are doubles. Integral values are kept as Python ints as long as
+# doubles can represent them exactly, falling back to floats only when needed.
+#
+MAX_SAFE_INTEGER = 2 ** 53 - 1
+NAN = float('nan')
+INFINITY = float('inf')
+
+
+def int_or_float(value):
+    """Return integer `value`, converted to float if doubles can't represent it exactly."""
+    if -MAX_SAFE_INTEGER <= value <= MAX_SAFE_INTEGER:
+        return value
+    return float(value)
+
+
+def is_negative_zero(value):
+    return value == 0 and math.copysign(1.0, value) < 0
+
+
+# String numeric literals, see [ECMA-262 9.3.1]
+NUMERIC_STRING = re.compile(r'^[+-]?(Infinity|(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?)$')
+HEX_STRING = re.compile(r'^0[xX][0-9a-fA-F]+$')
+
+
+def to_number(value):
+    """Convert `value` to a number, as defined in [ECMA-262 9.3].
+
+    Objects are converted to NaN, as there's no ToPrimitive yet."""
+    if isinstance(value, bool):
+        return int(value)
+    elif isinstance(value, (int, long, float)):
+        return value
+    elif value is None:
+        return 0
+    elif isinstance(value, (basestring, Rope)):
+        s = flatten(value).strip()
+        if not s:
+            return 0
+        elif HEX_STRING.match(s):
+            return int_or_float(int(s[2:], 16))
+        elif not NUMERIC_STRING.match(s):
+            return NAN
+        elif s.endswith('Infinity'):
+            return -INFINITY if s.startswith('-') else INFINITY
+        try:
+            return int_or_float(int(s))
+        except ValueError:
+            return float(s)
+    return NAN
+
+
+def property_key(name):
+    """Convert `name` to a string used as a property name, see [ECMA-262 9.8.1]."""
+    if type(name) is int:
+        return str(name)
+    elif isinstance(name, basestring):
+        return name
+    elif isinstance(name, float):
+        if name % 1 == 0 and abs(name) < 1e21:
+            # 1.0 and 1 are the same number, so they must refer to the same property
+            return str(int(name))
+        # NaN, infinities and fractions are named like JavaScript shows them
+        from jspy.formatting import format_number
+        return format_number(name)
+    return to_string(name)
+
+
+def to_int32(value):
+    """Convert `value` to a signed 32-bit integer, as defined in [ECMA-262 9.5]."""
+    if type(value) is not int:
+        value = to_number(value)
+        if value != value or value in (INFINITY, -INFINITY):
+            return 0
+        value = int(value)
+    value &= 0xFFFFFFFF
+    if value >= 0x80000000:
+        return value - 0x100000000
+    return value
+
+
+def to_uint32(value):
+    """Convert `value` to an unsigned 32-bit integer, as defined in [ECMA-262 9.6]."""
+    if type(value) is not int:
+        value = to_number(value)
+        if value != value or value in (INFINITY, -INFINITY):
+            return 0
+        value = int(value)
+    return value & 0xFFFFFFFF
+
+
+def add(left, right):
+    """Perform the addition operator, as defined in [ECMA-262 11.6.1].
+
+    Concatenating longer strings creates a rope, so building a string
+    piece by piece doesn't copy it over and over again."""
+    if type(left) is int and type(right) is int:
+        result = left + right
+        if -MAX_SAFE_INTEGER <= result <= MAX_SAFE_INTEGER:
+            return result
+        return float(result)
+    left_is_string = isinstance(left, (basestring, Rope))
+    right_is_string = isinstance(right, (basestring, Rope))
+    if left_is_string or right_is_string:
+        # The other operand is converted, e.g. "n" + 1 is "n1"
+        if not left_is_string:
+            left = to_string(left)
+        elif not right_is_string:
+            right = to_string(right)
+        if len(left) + len(right) < Rope.min_length:
+            return flatten(left) + flatten(right)
+        return Rope(left, right)
+    return left + right
+
+
+def to_string(value):
+    """Convert primitive `value` to a string, as defined in [ECMA-262 9.8].
+
+    Objects are converted without calling their `toString` methods."""
+    if isinstance(value, (basestring, Rope)):
+        return flatten(value)
+    elif value is None:
+        return 'null'
+    elif value is UNDEFINED:
+        return 'undefined'
+    elif isinstance(value, bool):
+        return 'true' if value else 'false'
+    elif isinstance(value, (int, long, float)):
+        from jspy.formatting import format_number
+        return format_number(value)
+    elif isinstance(value, Array):
+        from jspy.formatting import iter_elements
+        parts = []
+        for index, item in iter_elements(value):
+            # Holes and null or undefined elements are empty
+            parts.extend([''] * (index - len(parts)))
+            parts.append('' if item is None or item is UNDEFINED else to_string(item))
+        return ','.join(parts)
+    return '[object Object]'
+
+
+def subtract(left, right):
+    if type(left) is int and type(right) is int:
+        result = left - right
+        if -MAX_SAFE_INTEGER <= result <= MAX_SAFE_INTEGER:
+            return result
+        return float(result)
+    return left - right
+
+
+def multiply(left, right):
+    if type(left) is int and type(right) is int:
+        result = left * right
+        if result == 0 and (left < 0 or right < 0):
+            return -0.0
+        return int_or_float(result)
+    return left * right
+
+
+def divide(left, right):
+    """Perform the division operator, see [ECMA-262 11.5.2]."""
+    try:
+        result = float(left) / right
+    except ZeroDivisionError:
+        if left != left or left == 0:
+            return NAN
+        if (left > 0) == (math.copysign(1.0, right) > 0):
+            return INFINITY
+        return -INFINITY
+    if result % 1 == 0 and abs(result) <= MAX_SAFE_INTEGER and not is_negative_zero(result):
+        return int(result)
+    return result
+
+
+def remainder(left, right):
+    """Perform the remainder operator, see [ECMA-262 11.5.3].
+
+    Unlike in Python, the result has the sign of the dividend."""
+    if type(left) is int and type(right) is int and right != 0:
+        result = abs(left) % abs(right)
+        if left < 0:
+            return -result if result != 0 else -0.0
+        return result
+    try:
+        return math.fmod(left, right)
+    except ValueError:
+        return NAN
+
+
+def negate(value):
+    if type(value) is int and value == 0:
+        return -0.0
+    return -value
+
+
+def shift_left(left, right):
+    return to_int32(to_int32(left) << (to_uint32(right) & 0x1F))
+
+
+def shift_right(left, right):
+    return to_int32(left) >> (to_uint32(right) & 0x1F)
+
+
+def bitwise_and(left, right):
+    return to_int32(left) & to_int32(right)
+
+
+def bitwise_xor(left, right):
+    return to_int32(left) ^ to_int32(right)
+
+
+def bitwise_or(left, right):
+    return to_int32(left) | to_int32(right)
+
+
+def bitwise_not(value):
+    return ~to_int32(value)
+
+
+class Rope(object):
+    """String created by concatenation, flattened lazily on first use."""
+    min_length = 256
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+        self.length = len(left) + len(right)
+        self.flat = None
+
+    def flatten(self):
+        if self.flat is None:
+            # Ropes built in a loop are deeply nested, so walk them without recursion
+            parts = []
+            stack = [self]
+            while stack:
+                node = stack.pop()
+                if not isinstance(node, Rope):
+                    parts.append(node)
+                elif node.flat is not None:
+                    parts.append(node.flat)
+                else:
+                    stack.append(node.right)
+                    stack.append(node.left)
+            self.flat = ''.join(parts)
+            # Drop the pieces, so they can be garbage collected
+            self.left = self.right = None
+        return self.flat
+
+    def __len__(self):
+        return self.length
+
+    def __nonzero__(self):
+        return self.length > 0
+
+    def __getitem__(self, index):
+        return self.flatten()[index]
+
+    def __add__(self, other):
+        return add(self, other)
+
+    def __radd__(self, other):
+        return add(other, self)
+
+    def __eq__(self, other):
+        return self.flatten() == flatten(other)
+
+    def __ne__(self, other):
+        return self.flatten() != flatten(other)
+
+    def __lt__(self, other):
+        return self.flatten() < flatten(other)
+
+    def __le__(self, other):
+        return self.flatten() <= flatten(other)
+
+    def __gt__(self, other):
+        return self.flatten() > flatten(other)
+
+    def __ge__(self, other):
+        return self.flatten() >= flatten(other)
+
+    def __hash__(self):
+        return hash(self.flatten())
+
+    def __str__(self):
+        return str(self.flatten())
+
+    def __unicode__(self):
+        return unicode(self.flatten())
+
+    def __repr__(self):
+        return 'Rope(%r)' % self.flatten()
+
+
 class Object(object):
     """JavaScript Object as defined in [ECMA-262 8.6]."""
     def __init__(self, items=None):
@@ -36,14 +347,14 @@ class Object(object):
         self.d = items
 
     def __getitem__(self, name):
-        return self.d[str(name)]
+        return self.d[property_key(name)]
 
     def __setitem__(self, name, value):
-        self.d[str(name)] = value
+        self.d[property_key(name)] = value
 
     def get(self, name):
         try:
-            return self.d[str(name)]
+            return self.d[property_key(name)]
         except KeyError:
             return UNDEFINED
 
@@ -75,58 +386,96 @@ class Array(Object):
             items = []
         super(Array, self).__init__()
         for i, item in enumerate(items):
-            self[float(i)] = item
+            self[i] = item
 
     def __repr__(self):
-        items = list(sorted((int(float(key)), value) for key, value in self.d.items()))
-        max_key = items[-1][0] if len(items) > 0 else -1
-        shown_items = [self.get(float(i)) for i in range(0, min(max_key, self.max_repr_len) + 1)]
+        from jspy.formatting import iter_elements
+        shown_items = [value for index, value in islice(iter_elements(self), self.max_repr_len + 1)]
         return 'Array(%r)' % shown_items
 
     def __str__(self):
-        items = list(sorted((int(float(key)), value) for key, value in self.d.items()))
-        max_key = items[-1][0] if len(items) > 0 else -1
-        shown_items = [self.get(float(i)) for i in range(0, min(max_key, self.max_repr_len) + 1)]
-        return '[%s]' % ', '.join(str(item) for item in shown_items)
+        from jspy.formatting import format_value
+        return format_value(self)
 
     def to_python(self):
         return [to_python(value) for key, value in sorted(self.d.items(), key=lambda x: x[0])]
 
 
+def make_frame_template(parameters, declared_vars):
+    """Return local variables of a function call before binding its arguments."""
+    frame_template = dict.fromkeys(declared_vars, UNDEFINED)
+    frame_template['arguments'] = UNDEFINED
+    frame_template.update(dict.fromkeys(parameters, UNDEFINED))
+    return frame_template
+
+
 class Function(object):
     """Function object as defined in [ECMA-262 15.3].
 
     Algorithm for creating Function objects is in [ECMA-262 13.2]."""
-    def __init__(self, parameters, body, scope):
+    __slots__ = ('parameters', 'body', 'scope', 'name', 'line', 'frame_template', 'calls', 'code')
+    # Number of calls after which the body is compiled, see `jspy.compiler`
+    hot_calls = 100
+
+    def __init__(self, parameters, body, scope, frame_template=None, name=None, line=None):
         self.parameters = parameters
         self.body = body
         self.scope = scope
-        self.declared_vars = body.get_declared_vars()
-    
+        self.name = name
+        self.line = line
+        if frame_template is None:
+            frame_template = make_frame_template(parameters, body.get_declared_vars())
+        # Local variables of a new call, copied by `prepare_function_context`
+        self.frame_template = frame_template
+        self.calls = 0
+        self.code = None
+
     def call(self, this, args):
         """Internal [[Call]] method of Function object.
 
-        See [ECMA-262 13.2.1] for a basic algorithm."""
-        function_context = self.prepare_function_context(args)
-        result = self.body.eval(function_context)
-        if result.type is RETURN:
-            return result.value
-        else:
-            # No return statement in function
-            return UNDEFINED
+        See [ECMA-262 13.2.1] for a basic algorithm. Calls in tail position
+        are run here in a loop, instead of recursively."""
+        function = self
+        while True:
+            function_context = function.prepare_function_context(args)
+            code = function.code
+            if code is not None and code.valid:
+                result = code.run(function_context)
+            else:
+                result = function.body.eval(function_context)
+                function.calls += 1
+                if function.calls == function.hot_calls:
+                    function.tier_up()
+            if result.type is not RETURN:
+                # No return statement in function
+                return UNDEFINED
+            if not isinstance(result.value, TailCall):
+                return result.value
+            function, this, args = result.value
+            if not isinstance(function, Function):
+                return function.call(this, args)
+
+    def tier_up(self):
+        """Switch a hot function to compiled code (or try again later if it's not ready)."""
+        from jspy import compiler
+        self.calls = 0
+        self.code = compiler.compile_function(self)
 
     def prepare_function_context(self, args):
-        local_vars_dict = dict((name, UNDEFINED) for name in self.declared_vars)
-        local_vars_dict.update(self.prepare_args_dict(args))
-        return ExecutionContext(local_vars_dict, parent=self.scope)
-
-    def prepare_args_dict(self, args):
-        result = {'arguments': args}
-        for name in self.parameters:
-            result[name] = UNDEFINED
-        for name, value in zip(self.parameters, args):
-            result[name] = value
-        return result
+        local_vars_dict = self.frame_template.copy()
+        local_vars_dict['arguments'] = args
+        local_vars_dict.update(izip(self.parameters, args))
+        return ExecutionContext(local_vars_dict, self.scope)
+
+    def __getstate__(self):
+        # Compiled code is made of closures, which can't be pickled or copied.
+        # It's compiled again once the function is hot.
+        return dict((name, getattr(self, name)) for name in self.__slots__ if name != 'code')
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.code = None
 
     def __repr__(self):
         return 'Function(parameters=%r, body=%r, scope=%r)' % (self.parameters,
@@ -139,11 +488,13 @@ class Function(object):
 
 class NativeFunction(object):
     """Function implemented in Python, callable from JavaScript code."""
+    __slots__ = ('f', '__weakref__')
+
     def __init__(self, f):
         self.f = f
 
     def call(self, this, args):
-        return self.f(this, args)
+        return self.f(this, [flatten(arg) for arg in args])
 
     def __repr__(self):
         return 'NativeFunction(f=%r)' % (self.f)
@@ -153,23 +504,35 @@ class NativeFunction(object):
 
 
 class Console(Object):
-    """Global `console` object, behaving similar to Firebug's one."""
-    def __init__(self, out=None):
+    """Global `console` object, behaving similar to Firebug's one.
+
+    Values are formatted by `formatter`, by default `jspy.formatting.default_formatter`."""
+    def __init__(self, out=None, formatter=None):
+        from jspy.formatting import default_formatter
         self.out = out if out is not None else sys.stdout
+        self.formatter = formatter if formatter is not None else default_formatter
         self.d = {'log': NativeFunction(self.log)}
 
     def log(self, this, args):
-        self.out.write(' '.join(str(arg) for arg in args))
-        self.out.write('\n')
+        self.out.write(self.formatter.format_log(args) + '\n')
 
 
 class ReferenceError(RuntimeError):
     pass
 
 
+class RangeError(RuntimeError):
+    pass
+
+
+class TypeError(TypeError):
+    """JavaScript `TypeError`, still caught by `except TypeError` of Python code."""
+
+
 class ExecutionContext(object):
+    __slots__ = ('env', 'parent')
+
     def __init__(self, env, parent=None):
-        assert isinstance(env, dict)
         self.env = env
         self.parent = parent
 
@@ -201,12 +564,19 @@ class ExecutionContext(object):
     def get_this_reference(self):
         return self['this']
 
+    def fork(self):
+        """Return a copy-on-write fork of this context, see `jspy.forking`."""
+        from jspy import forking
+        return forking.fork(self)
+
     def __repr__(self):
         return 'ExecutionContext(%r, parent=%r)' % (self.env, self.parent)
 
 
 class Reference(object):
     """JavaScript reference specification type as defined in [ECMA-262 8.7]."""
+    __slots__ = ('name', 'base')
+
     def __init__(self, name, base):
         self.name = name
         self.base = base
@@ -215,7 +585,7 @@ class Reference(object):
         return self.base is UNDEFINED
 
     def has_primitive_base(self):
-        return isinstance(self.base, (basestring, float, bool))
+        return isinstance(self.base, (basestring, Rope, float, bool))
 
     def is_property(self):
         return isinstance(self.base, Object) or self.has_primitive_base()
@@ -1,4 +1,5 @@
 import ply.lex as lex
+from jspy.js import int_or_float
 
 
 class Lexer(object):
@@ -7,6 +8,7 @@ class Lexer(object):
 
     def input(self, data):
         self.lexer.input(data)
+        self.lexer.lineno = 1
 
     def token(self):
         return self.lexer.token()
@@ -148,7 +150,8 @@ class Lexer(object):
 
     def t_NUMBER(self, t):
         r'\d+'
-        t.value = float(t.value)
+        # Integers are kept as ints while doubles can represent them exactly
+        t.value = int_or_float(int(t.value))
         return t
 
     def t_STRING(self, t):
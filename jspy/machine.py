@@ -0,0 +1,403 @@
+"""Evaluator keeping JavaScript nesting on an explicit stack instead of the Python one.
+
+`Node.eval` methods call each other recursively, so deeply nested code or deep
+JavaScript recursion ends with a `RuntimeError` (maximum recursion depth exceeded).
+Here evaluation of every node with children is a generator, kept on a stack of
+frames owned by `Machine`. A generator yields:
+
+  * a `(node, context)` tuple to evaluate `node` in `context` and get its value back,
+  * another generator to run it as a new frame and get its last yielded value back,
+  * `CHECKPOINT` at loop back-edges and calls, where the machine may be suspended,
+  * an `Await` to suspend the machine until a native function's result is ready,
+  * anything else as its final value.
+
+Nodes without runners (identifiers, literals, etc.) are evaluated with `Node.eval`."""
+import types
+from jspy import allocations, ast, hooks, js
+from jspy.flatast import LazyNode
+
+
+CHECKPOINT = object()
+
+
+class Await(object):
+    """Request to suspend the machine until `future` (see `is_awaitable`) is done."""
+    __slots__ = ('future',)
+
+    def __init__(self, future):
+        self.future = future
+
+
+def is_awaitable(value):
+    """Return True if `value` is a future, like `concurrent.futures.Future` or
+    `jspy.asynchronous.Future`, which a native function returned instead of its result."""
+    return hasattr(value, 'add_done_callback') and hasattr(value, 'result')
+
+
+class Machine(object):
+    def __init__(self, node, context, budget=None):
+        self.stack = [run_node(node, context)]
+        self.value = None
+        self.budget = budget
+        # Future the program is waiting for, see `resume`
+        self.future = None
+
+    @property
+    def finished(self):
+        return len(self.stack) == 0
+
+    def run(self, steps=None):
+        """Run the program until it finishes or, if `steps` is given, until it
+        passes `steps` checkpoints. Calling `run` again resumes a suspended program.
+
+        Returns True if the program has finished, its value is in `self.value`.
+        Returns False as well when the program waits for `self.future`."""
+        if self.future is not None:
+            raise RuntimeError('Program is waiting for %r, resume it with its result' % self.future)
+        stack = self.stack
+        value = self.value
+        budget = self.budget
+        while stack:
+            request = stack[-1].send(value)
+            value = None
+            if type(request) is tuple:
+                node, context = request
+                runner = RUNNERS.get(node.__class__)
+                if runner is None:
+                    value = node.eval(context)
+                else:
+                    stack.append(runner(node, context))
+            elif request is CHECKPOINT:
+                if budget is not None:
+                    budget.tick()
+                if steps is not None:
+                    steps -= 1
+                    if steps <= 0:
+                        self.value = None
+                        return False
+            elif type(request) is types.GeneratorType:
+                stack.append(request)
+            elif type(request) is Await:
+                self.future = request.future
+                self.value = None
+                return False
+            else:
+                stack.pop()
+                value = request
+        self.value = value
+        return True
+
+    def resume(self, value):
+        """Continue a program that waited for `self.future` with its result `value`
+        (call `run` next)."""
+        self.future = None
+        self.value = value
+
+
+def run(node, context, budget=None):
+    """Evaluate `node` in `context` using an explicit stack."""
+    return finish(Machine(node, context, budget))
+
+
+def call(function, this, args, budget=None):
+    """Call `function` using an explicit stack."""
+    machine = Machine(None, None, budget)
+    machine.stack = [run_call(function, this, args)]
+    return finish(machine)
+
+
+def finish(machine):
+    if not machine.run():
+        raise RuntimeError('A native function returned %r, run the program with '
+                           'jspy.eval_string_async to wait for it' % machine.future)
+    return machine.value
+
+
+def run_node(node, context):
+    yield (yield (node, context))
+
+
+def run_call(function, this, args):
+    """Call `function`, see `js.Function.call`."""
+    while isinstance(function, js.Function):
+        yield CHECKPOINT
+        result = yield (function.body, function.prepare_function_context(args))
+        if result.type is not js.RETURN:
+            yield js.UNDEFINED
+            return
+        if not isinstance(result.value, js.TailCall):
+            yield result.value
+            return
+        function, this, args = result.value
+    value = function.call(this, args)
+    if is_awaitable(value):
+        value = yield Await(value)
+    yield value
+
+
+def run_arguments(arguments, context):
+    args = []
+    for argument in arguments:
+        args.append(js.get_value((yield (argument, context))))
+    yield args
+
+
+#
+# Expressions
+#
+def run_array_literal(node, context):
+    items = []
+    for item in node.items:
+        if item is None:
+            items.append(js.UNDEFINED)
+        else:
+            items.append(js.get_value((yield (item, context))))
+    # Elision: remove last item if it's undefined
+    if len(items) > 0 and items[-1] is js.UNDEFINED:
+        items.pop()
+    yield js.Array(items=items)
+
+
+def run_object_literal(node, context):
+    items = {}
+    for name, e in node.items.items():
+        items[js.property_key(name)] = js.get_value((yield (e, context)))
+    yield js.Object(items=items)
+
+
+def run_property_access(node, context):
+    base_value = js.flatten(js.get_value((yield (node.obj, context))))
+    property_name_value = js.flatten(js.get_value((yield (node.key, context))))
+    yield js.Reference(name=property_name_value, base=base_value)
+
+
+def run_constructor(node, context):
+    constructor = js.get_value((yield (node.obj, context)))
+    args = yield run_arguments(node.arguments, context)
+    if isinstance(constructor, js.NativeFunction):
+        yield constructor.call(None, args)
+    else:
+        # TODO: Constructing objects with JavaScript functions
+        yield js.Object()
+
+
+def run_function_call(node, context):
+    f = js.get_value((yield (node.obj, context)))
+    args = yield run_arguments(node.arguments, context)
+    yield (yield run_call(f, None, args))
+
+
+def run_unary_op(node, context):
+    expr = yield (node.expression, context)
+    yield node.apply(expr, js.get_value(expr))
+
+
+def run_binary_op(node, context):
+    left = js.get_value((yield (node.left_expression, context)))
+    right = js.get_value((yield (node.right_expression, context)))
+    yield node.apply(left, right)
+
+
+def run_conditional_op(node, context):
+    if js.get_value((yield (node.condition, context))):
+        yield js.get_value((yield (node.true_expression, context)))
+    else:
+        yield js.get_value((yield (node.false_expression, context)))
+
+
+def run_assignment(node, context):
+    ref = yield (node.reference, context)
+    yield node.apply(ref, js.get_value((yield (node.expression, context))))
+
+
+def run_multi_expression(node, context):
+    yield (node.left_expression, context)
+    yield (yield (node.right_expression, context))
+
+
+#
+# Statements
+#
+def run_block(node, context):
+    result = js.EMPTY_COMPLETION
+    for statement in node.statements:
+        partial_result = yield (statement, context)
+        if js.is_abrupt(partial_result):
+            yield partial_result
+            return
+        # Ignore empty statement values, as specified in [ECMA-262 12.1]
+        if partial_result.value is not js.EMPTY:
+            result = partial_result
+    yield result
+
+
+def run_variable_declaration_list(node, context):
+    for declaration in node.declarations:
+        yield (declaration, context)
+    yield js.EMPTY_COMPLETION
+
+
+def run_variable_declaration(node, context):
+    ref = node.identifier.eval(context)
+    value = js.get_value((yield (node.initialiser, context)))
+    js.put_value(ref, value)
+    yield js.Completion(js.NORMAL, ref.name, js.EMPTY)
+
+
+def run_expression_statement(node, context):
+    value = js.get_value((yield (node.expression, context)))
+    yield js.Completion(js.NORMAL, value, js.EMPTY)
+
+
+def run_if_statement(node, context):
+    if js.get_value((yield (node.condition, context))):
+        yield (yield (node.true_statement, context))
+    else:
+        yield (yield (node.false_statement, context))
+
+
+def run_while_statement(node, context):
+    result_value = js.EMPTY
+    while True:
+        if not js.get_value((yield (node.condition, context))):
+            break
+        stmt = yield (node.statement, context)
+        if stmt.value is not js.EMPTY:
+            result_value = stmt.value
+        if stmt.type is js.BREAK:
+            break
+        elif js.is_abrupt(stmt) and stmt.type is not js.CONTINUE:
+            yield stmt
+            return
+        yield CHECKPOINT
+    yield js.Completion(js.NORMAL, result_value, js.EMPTY)
+
+
+def run_do_while_statement(node, context):
+    result_value = js.EMPTY
+    while True:
+        stmt = yield (node.statement, context)
+        if stmt.value is not js.EMPTY:
+            result_value = stmt.value
+        if stmt.type is js.BREAK:
+            break
+        elif js.is_abrupt(stmt) and stmt.type is not js.CONTINUE:
+            yield stmt
+            return
+        if not js.get_value((yield (node.condition, context))):
+            break
+        yield CHECKPOINT
+    yield js.Completion(js.NORMAL, result_value, js.EMPTY)
+
+
+def run_return_statement(node, context):
+    if node.expression is None:
+        yield js.Completion(js.RETURN, js.UNDEFINED, js.EMPTY)
+    else:
+        value = js.get_value((yield (node.expression, context)))
+        yield js.Completion(js.RETURN, value, js.EMPTY)
+
+
+def run_tail_call_statement(node, context):
+    call = node.expression
+    f = js.get_value((yield (call.obj, context)))
+    args = yield run_arguments(call.arguments, context)
+    yield js.Completion(js.RETURN, js.TailCall(f, None, args), js.EMPTY)
+
+
+#
+# Hooks, see `jspy.hooks`
+#
+def run_function_hook(node, context):
+    node.hooks.enter_function(node.definition, context)
+    result = yield (node.body, context)
+    if result.type is js.RETURN:
+        node.hooks.exit_function(node.definition, context, result.value)
+    else:
+        node.hooks.exit_function(node.definition, context, js.UNDEFINED)
+    yield result
+
+
+def run_statement_hook(node, context):
+    node.hooks.statement(node.statement, context)
+    yield (yield (node.statement, context))
+
+
+def run_back_edge_hook(node, context):
+    result = yield (node.statement, context)
+    if result.type is js.NORMAL or result.type is js.CONTINUE:
+        node.hooks.back_edge(node.loop, context)
+    yield result
+
+
+def run_wrapped_call(node, context):
+    """Run a call wrapped by instrumentation (`hooks.CallHook` or `allocations.CallSite`)."""
+    call = ast.get_call(node)
+    f = js.get_value((yield (call.obj, context)))
+    args = yield run_arguments(call.arguments, context)
+    if isinstance(f, js.Function) and isinstance(call, ast.FunctionCall):
+        # Let the wrappers see the call without making it, it's made here
+        node.tail_call(f, args)
+        yield (yield run_call(f, None, args))
+        return
+    value = node.apply(f, args)
+    if is_awaitable(value):
+        value = yield Await(value)
+    yield value
+
+
+def run_wrapped_tail_call(node, context):
+    """Run a call in tail position wrapped by instrumentation (`hooks.TailCallHook`
+    or `allocations.TailCallSite`)."""
+    call = ast.get_call(node)
+    f = js.get_value((yield (call.obj, context)))
+    args = yield run_arguments(call.arguments, context)
+    result = node.tail_call(f, args)
+    if is_awaitable(result.value):
+        result = js.Completion(js.RETURN, (yield Await(result.value)), js.EMPTY)
+    yield result
+
+
+#
+# Allocation tracking, see `jspy.allocations`
+#
+def run_allocation_site(node, context):
+    value = yield (node.expression, context)
+    node.tracker.record_value(node.expression.line, value)
+    yield value
+
+
+def run_lazy_node(node, context):
+    yield (yield (node.load(), context))
+
+
+RUNNERS = {
+    ast.ArrayLiteral: run_array_literal,
+    ast.ObjectLiteral: run_object_literal,
+    ast.PropertyAccess: run_property_access,
+    ast.Constructor: run_constructor,
+    ast.FunctionCall: run_function_call,
+    ast.UnaryOp: run_unary_op,
+    ast.BinaryOp: run_binary_op,
+    ast.ConditionalOp: run_conditional_op,
+    ast.Assignment: run_assignment,
+    ast.MultiExpression: run_multi_expression,
+    ast.Block: run_block,
+    ast.VariableDeclarationList: run_variable_declaration_list,
+    ast.VariableDeclaration: run_variable_declaration,
+    ast.ExpressionStatement: run_expression_statement,
+    ast.IfStatement: run_if_statement,
+    ast.WhileStatement: run_while_statement,
+    ast.DoWhileStatement: run_do_while_statement,
+    ast.ReturnStatement: run_return_statement,
+    ast.TailCallStatement: run_tail_call_statement,
+    hooks.FunctionHook: run_function_hook,
+    hooks.StatementHook: run_statement_hook,
+    hooks.BackEdgeHook: run_back_edge_hook,
+    hooks.CallHook: run_wrapped_call,
+    hooks.TailCallHook: run_wrapped_tail_call,
+    allocations.AllocationSite: run_allocation_site,
+    allocations.CallSite: run_wrapped_call,
+    allocations.TailCallSite: run_wrapped_tail_call,
+    LazyNode: run_lazy_node,
+}
@@ -0,0 +1,125 @@
+"""Memoization of pure JavaScript functions.
+
+Wrap a function with `memoize` on the Python side:
+
+    context['isPrime'] = memoize(context['isPrime'], max_size=1000)
+
+or with the `memoize(f[, maxSize])` global function in JavaScript:
+
+    var isPrime = memoize(function (n) { ... }, 1000);
+
+Results are cached by argument values, so it's only safe for functions
+without side effects. Calls with objects or functions as arguments are
+not cached at all."""
+import math
+import threading
+from collections import OrderedDict
+from jspy import js
+
+
+def make_key(args):
+    """Return a cache key for `args`, or None if some of them aren't primitive values."""
+    key = []
+    for arg in args:
+        if arg is None or arg is js.UNDEFINED:
+            key.append(arg)
+        elif isinstance(arg, bool):
+            # Python thinks that True == 1, but JavaScript functions can tell them apart
+            key.append(('boolean', arg))
+        elif isinstance(arg, (int, long, float)):
+            if arg == 0:
+                # Same for 0 and -0
+                key.append(('zero', math.copysign(1.0, arg)))
+            else:
+                key.append(('number', arg))
+        elif isinstance(arg, basestring):
+            key.append(('string', arg))
+        else:
+            return None
+    return tuple(key)
+
+
+class MemoizedFunction(js.NativeFunction):
+    """Function caching results of the wrapped function in a LRU cache of `max_size` entries."""
+    def __init__(self, function, max_size=128):
+        if max_size < 0:
+            raise ValueError('Cache size must not be negative, got %r' % max_size)
+        super(MemoizedFunction, self).__init__(self.call_cached)
+        self.function = function
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        # Guards the cache, as the function may be called by many threads
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bypasses = 0
+
+    def call_cached(self, this, args):
+        key = make_key(args)
+        if key is None:
+            self.bypasses += 1
+            return self.function.call(this, args)
+        cache = self.cache
+        with self.lock:
+            try:
+                # Move the entry to the end, making it the most recently used one
+                value = cache.pop(key)
+                self.hits += 1
+                cache[key] = value
+                return value
+            except KeyError:
+                self.misses += 1
+        # Not holding the lock, as the function may call this one recursively
+        value = self.function.call(this, args)
+        if self.max_size == 0:
+            # Nothing is cached, like with `functools.lru_cache(maxsize=0)`
+            return value
+        with self.lock:
+            if key not in cache and len(cache) >= self.max_size:
+                cache.popitem(last=False)
+                self.evictions += 1
+            cache[key] = value
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'bypasses': self.bypasses,
+                'size': len(self.cache),
+                'max_size': self.max_size}
+
+    def __reduce__(self):
+        # `f` is a bound method and `lock` a lock, which can't be pickled, so they're
+        # created again by the constructor
+        state = self.__dict__.copy()
+        del state['lock']
+        return (MemoizedFunction, (self.function, self.max_size), state)
+
+    def __repr__(self):
+        return 'MemoizedFunction(function=%r, max_size=%r)' % (self.function, self.max_size)
+
+
+def memoize(function, max_size=128):
+    """Return `function` wrapped in a cache of `max_size` most recently used results."""
+    return MemoizedFunction(function, max_size)
+
+
+def memoize_native(this, args):
+    """Implementation of `memoize(f[, maxSize])` global JavaScript function."""
+    function = args[0] if args else js.UNDEFINED
+    if not isinstance(function, (js.Function, js.NativeFunction)):
+        raise js.TypeError('memoize: %r is not a function' % (function,))
+    if len(args) < 2 or args[1] is js.UNDEFINED:
+        return memoize(function)
+    max_size = js.to_number(args[1])
+    if max_size != max_size or max_size in (float('inf'), float('-inf')):
+        raise js.TypeError('memoize: cache size %r is not a number' % (args[1],))
+    if max_size < 0:
+        raise js.RangeError('memoize: cache size %r is negative' % (args[1],))
+    return memoize(function, int(max_size))
@@ -0,0 +1,99 @@
+"""Limits on the number of steps and running time of programs.
+
+A step is a single loop iteration or a call of a JavaScript function. To keep
+the plain interpreter free of any bookkeeping, steps are counted by `Checkpoint`
+nodes, inserted only into a copy of the program that is run with a budget.
+
+Checkpoints count steps against the budget of the current thread (see
+`metered`) rather than one of their own, so the instrumented copy of a program
+is made once and reused by every run, along with its compiled code."""
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from jspy import ast
+
+
+class BudgetExceeded(RuntimeError):
+    pass
+
+
+class Budget(object):
+    # Number of steps between checks of the clock
+    check_interval = 1000
+
+    def __init__(self, max_steps=None, timeout=None):
+        self.max_steps = max_steps
+        self.deadline = time.time() + timeout if timeout is not None else None
+        self.steps = 0
+        self.next_check = 0
+        self.check()
+
+    def tick(self):
+        self.steps += 1
+        if self.steps >= self.next_check:
+            self.check()
+
+    def check(self):
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise BudgetExceeded('Program exceeded the limit of %d steps' % self.max_steps)
+        if self.deadline is not None and time.time() > self.deadline:
+            raise BudgetExceeded('Program exceeded its time limit')
+        self.next_check = self.steps + self.check_interval
+        if self.max_steps is not None:
+            self.next_check = min(self.next_check, self.max_steps + 1)
+
+
+class Meter(threading.local):
+    # Budget that checkpoints count steps against, None to not count them
+    budget = None
+
+
+meter = Meter()
+
+
+@contextmanager
+def metered(budget):
+    """Count steps of instrumented programs run in the block against `budget`."""
+    previous = meter.budget
+    meter.budget = budget
+    try:
+        yield budget
+    finally:
+        meter.budget = previous
+
+
+class Checkpoint(ast.Node):
+    """Counts a step against the current budget before evaluating `statement`."""
+    children = ['statement']
+
+    def eval(self, context):
+        budget = meter.budget
+        if budget is not None:
+            budget.tick()
+        return self.statement.eval(context)
+
+    def get_declared_vars(self):
+        return self.statement.get_declared_vars()
+
+
+# Instrumented copies of programs
+instrumented = weakref.WeakKeyDictionary()
+
+
+def add_checkpoints(node):
+    if isinstance(node, (ast.WhileStatement, ast.DoWhileStatement)):
+        node.statement = Checkpoint(statement=node.statement)
+    elif isinstance(node, ast.FunctionDefinition):
+        node.body = Checkpoint(statement=node.body)
+    return node
+
+
+def instrument(program):
+    """Return a copy of `program` counting its steps against the budget given to `metered`.
+
+    Checkpoints are placed around loop bodies and function bodies."""
+    copy = instrumented.get(program)
+    if copy is None:
+        copy = instrumented[program] = program.transform(add_checkpoints)
+    return copy
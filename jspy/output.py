@@ -0,0 +1,168 @@
+"""Buffered `console` writing lines in batches.
+
+`js.Console` writes every `console.log` call straight to its file, which makes
+programs logging in hot loops spend most of their time in `write` calls when
+the output is a pipe. `BufferedConsole` collects lines and hands them in
+batches to a sink:
+
+  * `FileSink` writes them to a file (e.g. `sys.stdout`),
+  * `ListSink` keeps them in a list,
+  * `NullSink` drops them (e.g. for benchmarks).
+
+A batch is flushed when the buffered lines reach `buffer_size` characters,
+when the oldest of them has waited `flush_interval` seconds and when the
+program ends (`jspy.eval_program` flushes the `console` global). With
+`background` set, batches are written by a separate thread, so the program
+doesn't wait for slow sinks, and lines are flushed on time even if the program
+doesn't log anything else. Call `close` to stop the thread. An error raised
+by the sink in the thread is raised by the next `flush` (or `close`).
+
+    console = BufferedConsole(FileSink(sys.stdout), flush_interval=0.5, background=True)
+    global_objects['console'] = console
+    eval_file('file.js', global_objects)
+    console.close()"""
+import Queue
+import sys
+import threading
+import time
+from jspy import js
+
+
+class FileSink(object):
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, lines):
+        self.f.write('\n'.join(lines) + '\n')
+
+    def flush(self):
+        self.f.flush()
+
+
+class ListSink(object):
+    def __init__(self):
+        self.lines = []
+
+    def write(self, lines):
+        self.lines.extend(lines)
+
+    def flush(self):
+        pass
+
+
+class NullSink(object):
+    def write(self, lines):
+        pass
+
+    def flush(self):
+        pass
+
+
+class BufferedConsole(js.Console):
+    """`console` writing lines to `sink` in batches."""
+    def __init__(self, sink=None, buffer_size=65536, flush_interval=None, background=False,
+                 formatter=None):
+        from jspy.formatting import default_formatter
+        self.formatter = formatter if formatter is not None else default_formatter
+        self.sink = sink if sink is not None else FileSink(sys.stdout)
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.d = {'log': js.NativeFunction(self.log)}
+        self.lock = threading.Lock()
+        self.lines = []
+        self.size = 0
+        # Time the oldest buffered line was logged
+        self.since = None
+        # Batches for the writer thread, None stops it
+        self.batches = None
+        self.writer = None
+        # Error of the writer thread, raised by the next `flush`
+        self.error = None
+        if background:
+            self.batches = Queue.Queue()
+            self.writer = threading.Thread(target=self.write_batches, name='BufferedConsole writer')
+            self.writer.daemon = True
+            self.writer.start()
+
+    def log(self, this, args):
+        line = self.formatter.format_log(args)
+        lock = self.lock
+        lock.acquire()
+        try:
+            lines = self.lines
+            if not lines:
+                self.since = time.time()
+            lines.append(line)
+            self.size += len(line) + 1
+            if self.size >= self.buffer_size or (self.flush_interval is not None and
+                                                 self.is_overdue()):
+                self.write(self.take_lines())
+        finally:
+            lock.release()
+
+    def is_overdue(self):
+        return (self.flush_interval is not None and self.lines and
+                time.time() - self.since >= self.flush_interval)
+
+    def take_lines(self):
+        lines = self.lines
+        self.lines = []
+        self.size = 0
+        return lines
+
+    def write(self, batch):
+        # Called with the lock held, so batches keep the order of lines
+        if self.batches is not None:
+            self.batches.put(batch)
+        else:
+            self.sink.write(batch)
+
+    def flush(self):
+        """Write all buffered lines and wait until the sink has them."""
+        with self.lock:
+            if self.lines:
+                self.write(self.take_lines())
+        if self.batches is not None:
+            self.batches.join()
+            if self.error is not None:
+                error, self.error = self.error, None
+                raise error
+        self.sink.flush()
+
+    def close(self):
+        """Flush buffered lines and stop the writer thread."""
+        try:
+            self.flush()
+        finally:
+            if self.writer is not None:
+                self.batches.put(None)
+                self.writer.join()
+                self.writer = None
+                self.batches = None
+
+    def write_batches(self):
+        batches = self.batches
+        timeout = self.flush_interval
+        while True:
+            try:
+                batch = batches.get(timeout=timeout)
+            except Queue.Empty:
+                # Nothing logged for a while, write lines waiting too long
+                with self.lock:
+                    if self.is_overdue():
+                        batches.put(self.take_lines())
+                continue
+            try:
+                if batch is None:
+                    return
+                self.sink.write(batch)
+                if batches.empty():
+                    self.sink.flush()
+            except Exception, e:
+                # Keep the thread running, so `flush` doesn't wait forever
+                self.error = e
+            finally:
+                batches.task_done()
+
+    def __repr__(self):
+        return 'BufferedConsole(sink=%r, buffered=%d)' % (self.sink, len(self.lines))
@@ -4,6 +4,12 @@ from jspy.lexer import Lexer
 from jspy import ast
 
 
+def set_function_name(node, name):
+    """Name an anonymous function after the variable or property it's assigned to."""
+    if isinstance(node, ast.FunctionDefinition) and node.name is None:
+        node.name = name
+
+
 class Parser(object):
     #
     # Note
@@ -85,7 +91,7 @@ class Parser(object):
     # TODO: Other ways of defining/declaring functions
     def p_function_expression(self, p):
         """function_expression : FUNCTION LPAREN formal_parameter_list_opt RPAREN block"""
-        p[0] = ast.FunctionDefinition(parameters=p[3], body=p[5])
+        p[0] = ast.FunctionDefinition(parameters=p[3], body=p[5], line=p.lineno(1))
     
     def p_formal_parameter_list(self, p):
         """formal_parameter_list : identifier
@@ -144,6 +150,7 @@ class Parser(object):
         if len(p) == 2:
             p[0] = ast.VariableDeclaration(identifier=p[1], initialiser=None)
         else:
+            set_function_name(p[3], p[1].name)
             p[0] = ast.VariableDeclaration(identifier=p[1], initialiser=p[3])
 
     #
@@ -211,7 +218,10 @@ class Parser(object):
     #
     def p_return_statement(self, p):
         """return_statement : RETURN expression_opt SEMICOLON"""
-        p[0] = ast.ReturnStatement(expression=p[2])
+        if isinstance(p[2], ast.FunctionCall):
+            p[0] = ast.TailCallStatement(expression=p[2])
+        else:
+            p[0] = ast.ReturnStatement(expression=p[2])
 
     #
     # [ECMA-262 12.15] The debugger statement
@@ -250,7 +260,7 @@ class Parser(object):
 
     def p_array_literal(self, p):
         """array_literal : LBRACKET element_list_opt RBRACKET"""
-        p[0] = ast.ArrayLiteral(items=p[2])
+        p[0] = ast.ArrayLiteral(items=p[2], line=p.lineno(1))
         
     def p_element_list(self, p):
         """element_list : element_list COMMA assignment_expression_opt
@@ -272,9 +282,9 @@ class Parser(object):
         """object_literal : LBRACE RBRACE
                           | LBRACE property_name_and_value_list RBRACE"""
         if len(p) == 3:
-            p[0] = ast.ObjectLiteral(items=[])
+            p[0] = ast.ObjectLiteral(items=[], line=p.lineno(1))
         else:
-            p[0] = ast.ObjectLiteral(items=p[2])
+            p[0] = ast.ObjectLiteral(items=p[2], line=p.lineno(1))
 
     def p_property_name_and_value_list(self, p):
         """property_name_and_value_list : property_assignment
@@ -289,6 +299,7 @@ class Parser(object):
 
     def p_property_assignment(self, p):
         """property_assignment : property_name COLON assignment_expression"""
+        set_function_name(p[3], unicode(p[1]))
         p[0] = (p[1], p[3])
 
     def p_property_name(self, p):
@@ -317,7 +328,7 @@ class Parser(object):
     
     def p_constructor_expression(self, p):
         """constructor_expression : NEW member_expression arguments"""
-        p[0] = ast.Constructor(obj=p[2], arguments=p[3])
+        p[0] = ast.Constructor(obj=p[2], arguments=p[3], line=p.lineno(1))
     
     def p_new_expression(self, p):
         """new_expression : member_expression
@@ -325,12 +336,12 @@ class Parser(object):
         if len(p) == 2:
             p[0] = p[1]
         else:
-            p[0] = ast.Constructor(obj=p[2], arguments=[])
+            p[0] = ast.Constructor(obj=p[2], arguments=[], line=p.lineno(1))
     
     def p_call_expression(self, p):
         """call_expression : member_expression arguments
                            | call_expression arguments"""
-        p[0] = ast.FunctionCall(obj=p[1], arguments=p[2])
+        p[0] = ast.FunctionCall(obj=p[1], arguments=p[2], line=p.lineno(2))
 
     def p_property_access_call_expression(self, p):
         """call_expression : call_expression LBRACE expression RBRACE
@@ -343,6 +354,8 @@ class Parser(object):
     def p_arguments(self, p):
         """arguments : LPAREN RPAREN
                      | LPAREN argument_list RPAREN"""
+        # Line of the call, see `p_call_expression`
+        p.set_lineno(0, p.lineno(1))
         if len(p) == 3:
             p[0] = []
         else:
@@ -415,7 +428,8 @@ class Parser(object):
         if len(p) == 2:
             p[0] = p[1]
         else:
-            p[0] = ast.BinaryOp(op=p[2], left_expression=p[1], right_expression=p[3])
+            p[0] = ast.BinaryOp(op=p[2], left_expression=p[1], right_expression=p[3],
+                                line=p.lineno(2))
 
     #
     # [ECMA-262 11.7] Bitwise Shift Operators
@@ -534,7 +548,11 @@ class Parser(object):
         if len(p) == 2:
             p[0] = p[1]
         else:
-            p[0] = ast.Assignment(op=p[2], reference=p[1], expression=p[3])
+            if isinstance(p[1], ast.Identifier):
+                set_function_name(p[3], p[1].name)
+            elif isinstance(p[1], ast.PropertyAccess) and isinstance(p[1].key, ast.Literal):
+                set_function_name(p[3], unicode(p[1].key.value))
+            p[0] = ast.Assignment(op=p[2], reference=p[1], expression=p[3], line=p.lineno(2))
     
     def p_assignment_operator(self, p):
         """assignment_operator : EQUALS
@@ -548,6 +566,7 @@ class Parser(object):
                                | ANDEQUAL
                                | XOREQUAL
                                | OREQUAL"""
+        p.set_lineno(0, p.lineno(1))
         p[0] = p[1]
     
     #
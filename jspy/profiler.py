@@ -0,0 +1,116 @@
+"""Sampling profiler of JavaScript functions.
+
+A timer signal (`SIGPROF`, so only on Unix and in the main thread) interrupts the
+program every `interval` seconds of CPU time and the profiler records the stack
+of JavaScript functions that are running. The stack isn't kept up to date on
+every call; it's rebuilt from frames of the interpreter when a sample is taken:
+`js.Function.call` and `js.NativeFunction.call` frames for the recursive
+interpreter and `run_call` generators on the stack of a `jspy.machine.Machine`.
+
+Samples can be written in the collapsed stack format read by flame graph tools
+(https://github.com/brendangregg/FlameGraph) or summarized in a table."""
+import signal
+from collections import Counter
+from jspy import js, machine
+
+
+PROGRAM = '(program)'
+
+FUNCTION_CALL_CODE = js.Function.call.im_func.func_code
+NATIVE_CALL_CODE = js.NativeFunction.call.im_func.func_code
+MACHINE_RUN_CODE = machine.Machine.run.im_func.func_code
+RUN_CALL_CODE = machine.run_call.func_code
+
+
+class Profiler(object):
+    def __init__(self, interval=0.001, file_name=None):
+        self.interval = interval
+        self.file_name = file_name
+        # Number of samples of every stack, from the outermost function
+        self.samples = Counter()
+        self.old_handler = None
+
+    def start(self):
+        self.old_handler = signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self.old_handler)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def sample(self, signum, frame):
+        self.samples[tuple(self.get_stack(frame))] += 1
+
+    def get_stack(self, frame):
+        """Return names of JavaScript functions running in Python `frame`, starting with the outermost."""
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            if code is FUNCTION_CALL_CODE:
+                stack.append(self.get_label(frame.f_locals['function']))
+            elif code is NATIVE_CALL_CODE:
+                stack.append(self.get_label(frame.f_locals['self']))
+            elif code is MACHINE_RUN_CODE:
+                stack.extend(self.get_machine_stack(frame.f_locals['self']))
+            frame = frame.f_back
+        stack.append(PROGRAM)
+        stack.reverse()
+        return stack
+
+    def get_machine_stack(self, m):
+        stack = []
+        for generator in reversed(m.stack):
+            if generator.gi_code is RUN_CALL_CODE and generator.gi_frame is not None:
+                function = generator.gi_frame.f_locals['function']
+                # Native functions are called by the machine, so their frames are found anyway
+                if isinstance(function, js.Function):
+                    stack.append(self.get_label(function))
+        return stack
+
+    def get_label(self, function):
+        """Return the name of `function` with its position in source code."""
+        if isinstance(function, js.NativeFunction):
+            return '%s [native]' % getattr(function.f, '__name__', '(anonymous)')
+        name = function.name or '(anonymous)'
+        if function.line is None:
+            return name
+        elif self.file_name is None:
+            return '%s (line %d)' % (name, function.line)
+        return '%s (%s:%d)' % (name, self.file_name, function.line)
+
+    def write_collapsed(self, f):
+        """Write samples to file `f` in the collapsed stack format, one stack per line."""
+        for stack, count in sorted(self.samples.items()):
+            f.write('%s %d\n' % (';'.join(stack), count))
+
+    def get_top(self, n=20):
+        """Return up to `n` `(function, self samples, total samples)` tuples,
+        from the function with the most self samples."""
+        self_samples = Counter()
+        total_samples = Counter()
+        for stack, count in self.samples.items():
+            self_samples[stack[-1]] += count
+            # Recursive functions count once per sample
+            for function in set(stack):
+                total_samples[function] += count
+        top = sorted(total_samples, key=lambda function: (-self_samples[function],
+                                                          -total_samples[function],
+                                                          function))
+        return [(function, self_samples[function], total_samples[function])
+                for function in top[:n]]
+
+    def write_top(self, f, n=20):
+        """Write a table of `n` functions with the most self samples to file `f`."""
+        total = max(sum(self.samples.values()), 1)
+        f.write('%8s %7s %8s %7s  %s\n' % ('self', '', 'total', '', 'function'))
+        for function, self_count, total_count in self.get_top(n):
+            f.write('%8d %6.1f%% %8d %6.1f%%  %s\n' % (self_count, 100.0 * self_count / total,
+                                                      total_count, 100.0 * total_count / total,
+                                                      function))
@@ -0,0 +1,101 @@
+"""Cooperative scheduler running many JavaScript programs in a single thread.
+
+Programs are run by `jspy.machine`, in time slices of `quantum` checkpoints
+(loop back-edges and function calls), taking turns in round-robin order. A
+program stuck in an infinite loop only gets its share of time, instead of
+blocking the others.
+
+Timers and microtasks scheduled by a task run once its program finishes,
+counted against the task's budget like in `jspy.eval_program`."""
+from collections import deque
+from jspy import create_default_global_objects, create_global_context, flush_console, run_event_loop
+from jspy.machine import Machine
+from jspy.metering import Budget
+from jspy.parser import Parser
+
+
+class Task(object):
+    """A program run by the `Scheduler`."""
+    def __init__(self, program, context, budget=None):
+        self.context = context
+        self.budget = budget
+        self.machine = Machine(program, context, budget)
+        self.finished = False
+        self.cancelled = False
+        self.value = None
+        self.error = None
+
+    def cancel(self):
+        """Stop running the task. It is dropped at its next turn."""
+        self.cancelled = True
+
+    def run(self, steps):
+        """Run the task for a single time slice."""
+        try:
+            if self.machine.run(steps):
+                self.value = self.machine.value.value
+                run_event_loop(self.context, self.budget, stackless=True)
+                self.finished = True
+        except Exception, e:
+            # Errors in one program don't affect the others
+            self.error = e
+            self.finished = True
+        if self.finished:
+            flush_console(self.context)
+
+    def __repr__(self):
+        if self.error is not None:
+            state = 'error=%r' % self.error
+        elif self.finished:
+            state = 'value=%r' % self.value
+        elif self.cancelled:
+            state = 'cancelled'
+        else:
+            state = 'running'
+        return 'Task(%s)' % state
+
+
+class Scheduler(object):
+    def __init__(self, quantum=1000, parser=None):
+        self.quantum = quantum
+        self.parser = parser if parser is not None else Parser()
+        self.ready = deque()
+
+    def spawn(self, program, global_objects=None, max_steps=None, timeout=None):
+        """Add a new task running `program`, given as a parsed AST or source code.
+
+        See `jspy.eval_string` for `max_steps` and `timeout` limits. Note
+        that `timeout` also counts time spent waiting for other tasks."""
+        if isinstance(program, basestring):
+            program = self.parser.parse(program)
+        if global_objects is None:
+            global_objects = create_default_global_objects()
+        budget = None
+        if max_steps is not None or timeout is not None:
+            budget = Budget(max_steps, timeout)
+        task = Task(program, create_global_context(program, global_objects), budget)
+        self.ready.append(task)
+        return task
+
+    def step(self):
+        """Run a single time slice of the next task.
+
+        Returns False if there are no tasks left."""
+        ready = self.ready
+        while ready:
+            task = ready.popleft()
+            if task.cancelled:
+                continue
+            task.run(self.quantum)
+            if not task.finished:
+                ready.append(task)
+            return True
+        return False
+
+    def run(self, slices=None):
+        """Run tasks until all of them finish or `slices` time slices have passed."""
+        while slices is None or slices > 0:
+            if not self.step():
+                break
+            if slices is not None:
+                slices -= 1
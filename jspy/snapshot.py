@@ -0,0 +1,102 @@
+"""Snapshots of initialized global execution contexts.
+
+A program that starts by running a large prelude can run it once, save the
+global context with `save` and have later processes restore it with `load`
+instead of running the prelude again:
+
+    result, context = eval_file('prelude.js')
+    with open('prelude.snapshot', 'wb') as f:
+        snapshot.save(context, f)
+    ...
+    with open('prelude.snapshot', 'rb') as f:
+        context = snapshot.load(f)
+    eval_file('script.js', context=context)
+
+Everything reachable from the context is saved with `pickle`: variables,
+objects, functions with their scope chains and bodies. Host objects (by default
+the default global objects, like `console`) aren't saved. They and their
+properties are saved by name and bound again on load to objects from
+`host_objects`, so a restored program can get e.g. a `Console` writing
+somewhere else. Compiled code of hot functions isn't saved either."""
+import cPickle as pickle
+from cStringIO import StringIO
+from jspy import js
+
+
+# Values compared by identity, restored as the same objects
+SENTINELS = dict((name, getattr(js, name))
+                 for name in ['UNDEFINED', 'EMPTY', 'NORMAL', 'BREAK', 'CONTINUE', 'RETURN', 'THROW'])
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def get_host_objects(context):
+    """Return global variables of `context` named like default global objects (see
+    `jspy.create_default_global_objects`), assuming they're provided by the host."""
+    from jspy import create_default_global_objects
+    return dict((name, context.env[name]) for name in create_default_global_objects()
+                if name in context.env)
+
+
+def get_persistent_ids(host_objects):
+    """Return names of host objects and their properties by their ids."""
+    ids = dict((id(value), ('js', name)) for name, value in SENTINELS.items())
+    for name, value in host_objects.items():
+        ids[id(value)] = ('host', name)
+        if isinstance(value, js.Object):
+            for key, item in value.d.items():
+                ids.setdefault(id(item), ('host', name, key))
+    return ids
+
+
+def save(context, f, host_objects=None):
+    """Write global `context` to file `f`, leaving out `host_objects` (a dict of
+    objects by name, by default those found by `get_host_objects`)."""
+    if host_objects is None:
+        host_objects = get_host_objects(context)
+    ids = get_persistent_ids(host_objects)
+    pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = lambda obj: ids.get(id(obj))
+    try:
+        pickler.dump(context)
+    except (pickle.PicklingError, TypeError) as e:
+        raise SnapshotError('Can\'t save the context: %s' % e)
+
+
+def dumps(context, host_objects=None):
+    f = StringIO()
+    save(context, f, host_objects)
+    return f.getvalue()
+
+
+def load(f, host_objects=None):
+    """Read the global context saved in file `f`, binding host objects to
+    `host_objects` (by default `jspy.create_default_global_objects()`)."""
+    if host_objects is None:
+        from jspy import create_default_global_objects
+        host_objects = create_default_global_objects()
+
+    def persistent_load(persistent_id):
+        if persistent_id[0] == 'js':
+            return SENTINELS[persistent_id[1]]
+        try:
+            value = host_objects[persistent_id[1]]
+            if len(persistent_id) > 2:
+                value = value.d[persistent_id[2]]
+        except KeyError:
+            raise SnapshotError('Host object %s isn\'t provided' % '.'.join(persistent_id[1:]))
+        return value
+
+    unpickler = pickle.Unpickler(f)
+    unpickler.persistent_load = persistent_load
+    context = unpickler.load()
+    # Host objects that weren't in the saved context become global variables as well
+    for name, value in host_objects.items():
+        context.env.setdefault(name, value)
+    return context
+
+
+def loads(data, host_objects=None):
+    return load(StringIO(data), host_objects)
@@ -1,9 +1,29 @@
+import cPickle as pickle
+import math
 import os.path
+import shutil
+import struct
 import sys
+import tempfile
+import threading
+import time
 from StringIO import StringIO
 from jspy.compat import unittest
 from jspy.parser import Parser
-from jspy import ast, js, eval_file
+from jspy import ast, binary, compiler, js, snapshot, timers, typedarray, eval_file, eval_program, eval_string
+from jspy import create_default_global_objects, create_global_context, eval_many, eval_string_async
+from jspy.memoize import memoize, memoize_native
+from jspy.allocations import AllocationTracker, instrument as allocations_instrument
+from jspy.asynchronous import Future
+from jspy.flatast import FlatTree, LazyNode, NodeView
+from jspy.forking import ForkedDict
+from jspy.formatting import Formatter, format_number, format_value, iter_elements
+from jspy.hooks import Hooks, StatementHook, instrument as hooks_instrument
+from jspy.metering import BudgetExceeded, instrument as metering_instrument
+from jspy.output import BufferedConsole, FileSink, ListSink, NullSink
+from jspy.profiler import Profiler
+from jspy.scheduler import Scheduler
+from jspy.timers import EventLoop
 
 
 class TestExpression(unittest.TestCase):
@@ -62,6 +82,13 @@ class TestExpression(unittest.TestCase):
                                                                             left_expression=ast.Identifier(name='x'),
                                                                             right_expression=ast.Identifier(name='y')))])))
 
+    def test_function_definition_hoisting(self):
+        definition = self.parser.parse('function (x, y) { var a = 1; if (x) { var b; } return a; }')
+        self.assertEqual(definition.parameter_names, ['x', 'y'])
+        self.assertEqual(definition.declared_vars, set(['a', 'b']))
+        f = definition.eval(js.ExecutionContext({}))
+        self.assertTrue(f.frame_template is definition.frame_template)
+
     def test_binary_op(self):
         self.assertEqual(self.eval('1 + 2 * 7'), 15)
 
@@ -71,6 +98,55 @@ class TestExpression(unittest.TestCase):
     def test_unary_op(self):
         self.assertEqual(self.eval('+-1'), -1)
 
+    def test_integer_arithmetic(self):
+        self.assertIs(type(self.eval('2 * 3 + 1')), int)
+        self.assertIs(type(self.eval('6 / 3')), int)
+        self.assertEqual(self.eval('7 / 2'), 3.5)
+        self.assertEqual(self.eval('9007199254740991 + 2'), 9007199254740992.0)
+        self.assertIs(type(self.eval('9007199254740991 + 2')), float)
+
+    def test_division_by_zero(self):
+        self.assertEqual(self.eval('1 / 0'), float('inf'))
+        self.assertEqual(self.eval('-1 / 0'), float('-inf'))
+        self.assertTrue(math.isnan(self.eval('0 / 0')))
+
+    def test_remainder(self):
+        self.assertEqual(self.eval('-7 % 3'), -1)
+        self.assertEqual(self.eval('7 % -3'), 1)
+        self.assertEqual(math.copysign(1, self.eval('-6 % 3')), -1)
+
+    def test_bitwise_ops(self):
+        self.assertEqual(self.eval('1 << 31'), -2147483648)
+        self.assertEqual(self.eval('1 << 32'), 1)
+        self.assertEqual(self.eval('-16 >> 2'), -4)
+        self.assertEqual(self.eval('4294967297 | 0'), 1)
+        self.assertEqual(self.eval('7 / 2 | 0'), 3)
+        self.assertEqual(self.eval('6 & 3 ^ 1'), 3)
+        self.assertEqual(self.eval('~5'), -6)
+        self.assertEqual(self.eval('~2147483648'), 2147483647)
+
+    def test_bitwise_ops_convert_to_number(self):
+        self.assertEqual(self.eval('null | 0'), 0)
+        self.assertEqual(self.eval('void 0 & 1'), 0)
+        self.assertEqual(self.eval('"x" << 1'), 0)
+        self.assertEqual(self.eval('"12" >> 1'), 6)
+        self.assertEqual(self.eval('" 0x10 " | 0'), 16)
+        self.assertEqual(self.eval('true << 3'), 8)
+        self.assertEqual(self.eval('~"Infinity"'), -1)
+
+    def test_integral_property_keys(self):
+        context = js.ExecutionContext({'a': js.Array([1, 2, 3])})
+        self.assertEqual(self.eval('a[4 / 2]', context), 3)
+        self.assertEqual(self.eval('a[1] = 5, a[2 / 2]', context), 5)
+
+    def test_special_number_property_keys(self):
+        context = js.ExecutionContext({'o': js.Object()})
+        self.assertEqual(self.eval('o[0 / 0] = 1, o["NaN"]', context), 1)
+        self.assertEqual(self.eval('o[1 / 0] = 2, o["Infinity"]', context), 2)
+        self.assertEqual(self.eval('o[-1 / 0] = 3, o["-Infinity"]', context), 3)
+        self.assertEqual(self.eval('o[true] = 4, o["true"]', context), 4)
+        self.assertEqual(sorted(context['o'].d), ['-Infinity', 'Infinity', 'NaN', 'true'])
+
     def test_parens(self):
         self.assertEqual(self.eval('(1 + 2) * 7'), 21)
 
@@ -278,6 +354,26 @@ class TestProgram(unittest.TestCase):
                      sqr(7);"""
         self.assertEqual(self.eval(program), js.Completion(js.NORMAL, 49, js.EMPTY))
     
+    def test_parse_tail_call(self):
+        function = self.parser.parse('function (x) { return f(x); return x(); return f(x) + 1; };')
+        statements = function.statements[0].expression.body.statements
+        self.assertEqual([s.__class__ for s in statements],
+                         [ast.TailCallStatement, ast.TailCallStatement, ast.ReturnStatement])
+
+    def test_tail_recursion(self):
+        program = """var countdown = function (n, acc) {
+                         if (n == 0) return acc;
+                         return countdown(n - 1, acc + 1);
+                     };
+                     countdown(10000, 0);"""
+        self.assertEqual(self.eval(program), js.Completion(js.NORMAL, 10000, js.EMPTY))
+
+    def test_tail_call_to_native_function(self):
+        program = """var f = function (x) { return g(x, 2); };
+                     f(5);"""
+        context = js.ExecutionContext({'g': js.NativeFunction(lambda this, args: args[0] * args[1])})
+        self.assertEqual(self.eval(program, context), js.Completion(js.NORMAL, 10, js.EMPTY))
+
     def test_function_as_argument(self):
         program = """var double = function (f, x) { return f(f(x)); };
                      double(function (x) { return x * x; }, 2);"""
@@ -341,7 +437,153 @@ class TestProgram(unittest.TestCase):
         out = StringIO()
         context = js.ExecutionContext({'console': js.Console(out=out)})
         self.assertEqual(self.eval(program, context), js.Completion(js.NORMAL, 9, js.EMPTY))
-        self.assertEqual(out.getvalue(), "0.0\n1.0\n2.0\n3.0\n4.0\n5.0\n6.0\n7.0\n8.0\n9.0\n")
+        self.assertEqual(out.getvalue(), "0\n1\n2\n3\n4\n5\n6\n7\n8\n9\n")
+
+    def test_string_and_number_concatenation(self):
+        program = """var s = "", i = 0;
+                     while (i < 200) {
+                         s += "ab";
+                         i++;
+                     }
+                     s = s + 1;
+                     var t = 2 + s;
+                     var h = 3 / 2;
+                     [t, "n" + h, "" + [1, null, 3], true + "", null + "x"];
+                  """
+        result = self.eval(program, js.ExecutionContext({}))
+        t, number, array, boolean, null = result.value.to_python()
+        self.assertEqual(t, '2' + 'ab' * 200 + '1')
+        self.assertEqual([number, array, boolean, null], ['n1.5', '1,,3', 'true', 'nullx'])
+
+    def test_string_concatenation(self):
+        program = """var s = "", i = 0;
+                     while (i < 1000) {
+                         s += "ab";
+                         i++;
+                     }
+                     var o = {x: 0};
+                     o[s] = 1;
+                     console.log(s == s + "");
+                     s;
+                  """
+        out = StringIO()
+        context = js.ExecutionContext({'console': js.Console(out=out)})
+        result = self.eval(program, context)
+        self.assertIsInstance(result.value, js.Rope)
+        self.assertEqual(result.value, 'ab' * 1000)
+        self.assertEqual(context['o'].get('ab' * 1000), 1)
+        self.assertEqual(out.getvalue(), 'true\n')
+
+
+class TestTypedArray(unittest.TestCase):
+    def test_float64_array(self):
+        result, context = eval_string("""var a = new Float64Array(3);
+                                         a[0] = 3 / 2; a[2] = a[0] * 2;
+                                         a.length;""")
+        self.assertEqual(result, 3)
+        self.assertEqual(list(context['a'].elements), [1.5, 0, 3])
+
+    def test_undefined_elements(self):
+        result, context = eval_string("""var f = new Float64Array([void 0, "2.5", null]);
+                                         var i = new Int32Array([void 0, "12", "x"]);
+                                         f[2] = void 0;""")
+        elements = list(context['f'].elements)
+        self.assertTrue(math.isnan(elements[0]) and math.isnan(elements[2]))
+        self.assertEqual(elements[1], 2.5)
+        self.assertEqual(list(context['i'].elements), [0, 12, 0])
+
+    def test_constructor_arguments_are_numbers(self):
+        result, context = eval_string("""var b = new ArrayBuffer(void 0);
+                                         var c = new ArrayBuffer("16");
+                                         var f = new Float64Array("x");
+                                         var g = new Float64Array("3");
+                                         var h = new Int32Array(c, "4", void 0);""")
+        self.assertEqual(len(context['b'].data), 0)
+        self.assertEqual(len(context['f'].elements), 0)
+        self.assertEqual(len(context['g'].elements), 3)
+        self.assertEqual((context['h'].byte_offset, len(context['h'].elements)), (4, 3))
+
+    def test_int32_array_wraps_values(self):
+        result, context = eval_string("""var a = new Int32Array([7, 2147483648, 5]);
+                                         a[3] = 9;
+                                         a[0] + a[1];""")
+        self.assertEqual(result, 7 - 2147483648)
+        self.assertEqual(list(context['a'].elements), [7, -2147483648, 5])
+
+    def test_views_share_array_buffer(self):
+        result, context = eval_string("""var buffer = new ArrayBuffer(8);
+                                         var bytes = new Uint8Array(buffer);
+                                         var ints = new Int32Array(buffer, 4);
+                                         ints[0] = 258;
+                                         bytes[4] + bytes[5];""")
+        self.assertEqual(result, 3)
+        self.assertEqual(context['bytes'].get_binding_value('length'), 8)
+        self.assertEqual(context['ints'].get_binding_value('length'), 1)
+
+    def test_to_python_shares_memory(self):
+        data = bytearray(16)
+        array = typedarray.Float64Array(typedarray.ArrayBuffer(data))
+        view = js.to_python(array)
+        array.set_mutable_binding(1.0, 2.5)
+        self.assertEqual(struct.unpack('2d', view.tobytes()), (0.0, 2.5))
+        self.assertEqual(typedarray.Float64Array(typedarray.ArrayBuffer(data)).get(1.0), 2.5)
+
+    def test_invalid_offset(self):
+        buffer = typedarray.ArrayBuffer(bytearray(8))
+        self.assertRaises(js.RangeError, typedarray.Float64Array, buffer, 3)
+
+
+class TestFormatting(unittest.TestCase):
+    def test_numbers(self):
+        for value, expected in [(1, '1'), (2.0, '2'), (3.5, '3.5'), (-0.1, '-0.1'), (-0.0, '-0'),
+                                (1e21, '1e+21'), (1.5e300, '1.5e+300'), (2.5e-7, '2.5e-7'),
+                                (1e-6, '0.000001'), (2.0 ** 60, '1152921504606847000'),
+                                (float('nan'), 'NaN'), (float('-inf'), '-Infinity')]:
+            self.assertEqual(format_number(value), expected)
+
+    def test_values(self):
+        result, context = eval_string("""var f = function () { return 0; };
+                                         var o = {a: {b: {c: {d: 1}}}, "x-y": "it's", t: true};
+                                         o.self = o;
+                                         [f, [1, "two"], void 0, null];""")
+        self.assertEqual(format_value(result),
+                         "[ [Function: f], [ 1, 'two' ], undefined, null ]")
+        self.assertEqual(sorted(format_value(context['o'])[2:-2].split(', ')),
+                         ['\'x-y\': "it\'s"', 'a: { b: { c: [Object] } }', 'self: [Circular]', 't: true'])
+        self.assertEqual(format_value(js.Array([js.NativeFunction(None), js.Array([]), js.Object()])),
+                         '[ [Function (native)], [], {} ]')
+        self.assertEqual(format_value(typedarray.Int32Array(typedarray.ArrayBuffer(bytearray(8)))),
+                         'Int32Array(2) [ 0, 0 ]')
+
+    def test_holes(self):
+        array = js.Array([1, 2])
+        array[5] = 3
+        array['name'] = 'x'
+        self.assertEqual(format_value(array), "[ 1, 2, <3 empty items>, 3, name: 'x' ]")
+        array = js.Array()
+        array[10 ** 9] = 1
+        array[1] = 2
+        self.assertEqual(format_value(array), '[ <1 empty item>, 2, <999999998 empty items>, 1 ]')
+        self.assertEqual(list(iter_elements(array)), [(1, 2), (10 ** 9, 1)])
+
+    def test_limits(self):
+        self.assertEqual(format_value(js.Array(range(1000))),
+                         '[ %s, ... 900 more items ]' % ', '.join(str(i) for i in range(100)))
+        array = js.Array(range(150))
+        array['name'] = 'x'
+        self.assertEqual(format_value(array), "[ %s, ... 50 more items, name: 'x' ]"
+                         % ', '.join(str(i) for i in range(100)))
+        formatter = Formatter(max_depth=0, max_array_length=2, max_string_length=3)
+        self.assertEqual(formatter.format_value(js.Array(['abcd', 'abc', js.Array([]), 3])),
+                         "[ 'abc'... 1 more character, 'abc', ... 2 more items ]")
+        self.assertEqual(formatter.format_value(js.Array([js.Array([]), js.Object()])),
+                         '[ [Array], [Object] ]')
+
+    def test_console(self):
+        out = StringIO()
+        eval_string(u'console.log("\u0105", 1, [true, "s"], o);',
+                    {'console': js.Console(out, Formatter(max_array_length=1)), 'o': js.Object()})
+        self.assertEqual(out.getvalue(), "\xc4\x85 1 [ true, ... 1 more item ] {}\n")
 
 
 class TestFile(unittest.TestCase):
@@ -371,23 +613,23 @@ class TestFile(unittest.TestCase):
     def test_primes(self):
         self.eval('primes.js')
         self.assertEqual(self.out.getvalue(),
-                         "2.0\n3.0\n5.0\n7.0\n11.0\n13.0\n17.0\n19.0\n23.0\n"
-                         "29.0\n31.0\n37.0\n41.0\n43.0\n47.0\n53.0\n59.0\n"
-                         "61.0\n67.0\n71.0\n")
+                         "2\n3\n5\n7\n11\n13\n17\n19\n23\n"
+                         "29\n31\n37\n41\n43\n47\n53\n59\n"
+                         "61\n67\n71\n")
 
     def test_pascal(self):
         self.eval('pascal.js')
         self.assertEqual(self.out.getvalue(), """\
-[1.0]
-[1.0, 1.0]
-[1.0, 2.0, 1.0]
-[1.0, 3.0, 3.0, 1.0]
-[1.0, 4.0, 6.0, 4.0, 1.0]
-[1.0, 5.0, 10.0, 10.0, 5.0, 1.0]
-[1.0, 6.0, 15.0, 20.0, 15.0, 6.0, 1.0]
-[1.0, 7.0, 21.0, 35.0, 35.0, 21.0, 7.0, 1.0]
-[1.0, 8.0, 28.0, 56.0, 70.0, 56.0, 28.0, 8.0, 1.0]
-[1.0, 9.0, 36.0, 84.0, 126.0, 126.0, 84.0, 36.0, 9.0, 1.0]
+[ 1 ]
+[ 1, 1 ]
+[ 1, 2, 1 ]
+[ 1, 3, 3, 1 ]
+[ 1, 4, 6, 4, 1 ]
+[ 1, 5, 10, 10, 5, 1 ]
+[ 1, 6, 15, 20, 15, 6, 1 ]
+[ 1, 7, 21, 35, 35, 21, 7, 1 ]
+[ 1, 8, 28, 56, 70, 56, 28, 8, 1 ]
+[ 1, 9, 36, 84, 126, 126, 84, 36, 9, 1 ]
 """)
 
     def test_object_literal(self):
@@ -405,3 +647,1055 @@ class TestFile(unittest.TestCase):
                                             u'airdate': u'04.05.2000',
                                             u'thumbnail_larger': u'http://example.com/episode_thumbnails/s04e02_480.jpg?width=63',
                                             u'thumbnail': u'http://example.com/episode_thumbnails/s04e02_480.jpg?width=55'})])})}))
+
+
+class TestStackless(TestFile):
+    """Runs the same files as `TestFile`, using `jspy.machine`."""
+    def eval(self, file_name):
+        package_directory = os.path.dirname(__file__)
+        file_path = os.path.join(package_directory, 'test_files', file_name)
+        return eval_file(file_path, stackless=True)
+
+    def test_deep_recursion(self):
+        program = """var sum = function (n) {
+                         if (n == 0) return 0;
+                         return n + sum(n - 1);
+                     };
+                     sum(20000);"""
+        self.assertRaises(RuntimeError, eval_string, program)
+        result, context = eval_string(program, stackless=True)
+        self.assertEqual(result, 20000 * 20001 / 2)
+
+    def test_deeply_nested_expression(self):
+        program = '1' + ' + 1' * 5000 + ';'
+        result, context = eval_string(program, stackless=True)
+        self.assertEqual(result, 5001)
+
+
+class TestFlatTree(TestFile):
+    """Runs the same files as `TestFile` from a `jspy.flatast.FlatTree`."""
+    def eval(self, file_name):
+        package_directory = os.path.dirname(__file__)
+        file_path = os.path.join(package_directory, 'test_files', file_name)
+        tree = FlatTree.from_node(Parser().parse(open(file_path).read().decode('utf-8')))
+        context = create_global_context(tree.root, create_default_global_objects())
+        return tree.root.eval(context).value, context
+
+    def test_materialize(self):
+        package_directory = os.path.dirname(__file__)
+        for file_name in os.listdir(os.path.join(package_directory, 'test_files')):
+            source = open(os.path.join(package_directory, 'test_files', file_name)).read()
+            program = Parser().parse(source.decode('utf-8'))
+            self.assertEqual(FlatTree.from_node(program).materialize(), program)
+
+    def test_views(self):
+        tree = FlatTree.from_node(Parser().parse('var x = 1, y = true; x + "a";'))
+        declarations, statement = tree.root.statements
+        self.assertEqual(declarations.node_class, ast.VariableDeclarationList)
+        self.assertEqual([d.identifier.name for d in declarations.declarations], ['x', 'y'])
+        # Equal constants of different types are kept apart
+        self.assertEqual([type(d.initialiser.value) for d in declarations.declarations], [int, bool])
+        self.assertEqual([child.node_class for child in statement.expression.iter_children()],
+                         [ast.Identifier, ast.Literal])
+        self.assertEqual(tree.root.get_declared_vars(), set(['x', 'y']))
+
+    def test_hot_code_is_interpreted(self):
+        compiler.set_thresholds(1, 1)
+        try:
+            program = Parser().parse("""var f = function (x) { return x + 1; };
+                                        var i = 0, s = 0;
+                                        while (i < 10) { s = f(s); i++; }""")
+            tree = FlatTree.from_node(program)
+            context = create_global_context(tree.root, {})
+            tree.root.eval(context)
+        finally:
+            compiler.set_thresholds(100, 1000)
+        self.assertEqual(context['s'], 10)
+        self.assertIsNone(context['f'].code)
+        self.assertTrue(isinstance(context['f'].body, NodeView))
+
+
+class TestBinary(TestFile):
+    """Runs the same files as `TestFile`, serialized with `jspy.binary` and loaded back."""
+    def setUp(self):
+        super(TestBinary, self).setUp()
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super(TestBinary, self).tearDown()
+        shutil.rmtree(self.temp_dir)
+
+    def load(self, source):
+        file_name = os.path.join(self.temp_dir, 'program.jsb')
+        with open(file_name, 'wb') as f:
+            binary.dump(Parser().parse(source), f)
+        return binary.load(file_name)
+
+    def eval(self, file_name):
+        package_directory = os.path.dirname(__file__)
+        file_path = os.path.join(package_directory, 'test_files', file_name)
+        return eval_program(self.load(open(file_path).read().decode('utf-8')))
+
+    def test_round_trip(self):
+        package_directory = os.path.dirname(__file__)
+        for file_name in os.listdir(os.path.join(package_directory, 'test_files')):
+            source = open(os.path.join(package_directory, 'test_files', file_name)).read()
+            program = Parser().parse(source.decode('utf-8'))
+            self.assertEqual(binary.load_tree(binary.dumps(program)).materialize(), program)
+
+    def test_constants(self):
+        for value in [None, True, False, 0, -2 ** 40, 2.5, -0.0, u'\u017c\xf3\u0142w', 'abc']:
+            decoded = binary.decode_constant(binary.encode_constant(value), 0)
+            self.assertEqual((type(decoded), repr(decoded)), (type(value), repr(value)))
+        program = Parser().parse(u'var a = [1, true, false, null, "\u017c\xf3\u0142w"];')
+        self.assertEqual(binary.loads(binary.dumps(program)), program)
+
+    def test_function_bodies_are_loaded_on_first_call(self):
+        program = self.load("""var f = function (x) { var y = x * 2; return y; };
+                               var g = function () { return 0; };
+                               f(21);""")
+        f, g = [s.declarations[0].initialiser for s in program.statements[:2]]
+        self.assertTrue(isinstance(f.body, LazyNode))
+        self.assertEqual(f.declared_vars, set(['y']))
+        result, context = eval_program(program)
+        self.assertEqual(result, 42)
+        self.assertIsNotNone(f.body.node)
+        self.assertIsNone(g.body.node)
+
+    def test_hooks(self):
+        hooks = RecordingHooks()
+        eval_program(self.load('var f = function () { return 1; }; f();'), hooks=hooks)
+        self.assertIn(('exit', 'f', 1), hooks.events)
+
+    def test_stackless(self):
+        result, context = eval_program(self.load('var f = function (x) { return x + 1; }; f(1);'),
+                                       stackless=True)
+        self.assertEqual(result, 2)
+
+    def test_invalid_files(self):
+        data = binary.dumps(Parser().parse('1;'))
+        self.assertRaises(binary.FormatError, binary.loads, 'JSPY')
+        self.assertRaises(binary.FormatError, binary.loads, 'x' + data[1:])
+        self.assertRaises(binary.FormatError, binary.loads, data[:8] + '\xff\xff' + data[10:])
+
+
+class TestSnapshot(unittest.TestCase):
+    prelude = """var makeCounter = function () {
+                     var n = 0;
+                     return function () { n = n + 1; return n; };
+                 };
+                 var counter = makeCounter();
+                 counter();
+                 var table = {a: [1, 2, 3]}, alias = table;
+                 var log = console.log;
+                 var square = memoize(function (x) { return x * x; });
+                 square(3);
+                 var bytes = new Uint8Array(4);
+                 bytes[1] = 7;"""
+
+    def restore(self, context, host_objects=None):
+        return snapshot.loads(snapshot.dumps(context), host_objects)
+
+    def test_restore(self):
+        result, context = eval_string(self.prelude)
+        out = StringIO()
+        host_objects = create_default_global_objects()
+        host_objects['console'] = js.Console(out)
+        restored = self.restore(context, host_objects)
+        result, restored = eval_string("""log(counter(), square(3), bytes[1]);
+                                          alias.a[0] = 5;
+                                          table.a[0];""", context=restored)
+        self.assertEqual(out.getvalue(), '2 9 7\n')
+        self.assertEqual(result, 5)
+        self.assertEqual((restored['square'].stats()['hits'], restored['square'].stats()['misses']), (1, 1))
+        # The original context is intact
+        self.assertEqual(context['counter'].call(None, []), 2)
+
+    def test_compiled_functions(self):
+        compiler.set_thresholds(1, 1)
+        try:
+            result, context = eval_string('var f = function (x) { return x + 1; }; f(1);')
+            self.assertIsNotNone(context['f'].code)
+            restored = self.restore(context)
+        finally:
+            compiler.set_thresholds(100, 1000)
+        self.assertIsNone(restored['f'].code)
+        self.assertEqual(restored['f'].call(None, [2]), 3)
+        self.assertIs(restored['f'].frame_template['x'], js.UNDEFINED)
+
+    def test_lazy_function_bodies(self):
+        program = binary.loads(binary.dumps(Parser().parse('var f = function (x) { return x * 2; };')))
+        result, context = eval_program(program)
+        result, context = eval_string('f(21);', context=self.restore(context))
+        self.assertEqual(result, 42)
+
+    def test_missing_host_object(self):
+        result, context = eval_string('var log = console.log;')
+        self.assertRaises(snapshot.SnapshotError, self.restore, context, {})
+
+
+class TestFork(unittest.TestCase):
+    prelude = """var makeCounter = function () {
+                     var n = 0;
+                     return function () { n = n + 1; return n; };
+                 };
+                 var counter = makeCounter();
+                 var table = {a: [1, 2, 3]}, alias = table, untouched = {b: [4]};
+                 var bytes = new Uint8Array(4);
+                 var total = 0;"""
+
+    scenario = """counter();
+                  alias.a[0] = alias.a[0] + 10;
+                  bytes[0] = bytes[0] + 1;
+                  total = total + counter();"""
+
+    def test_forks_are_independent(self):
+        result, context = eval_string(self.prelude)
+        for i in range(3):
+            result, forked = eval_string(self.scenario, context=context.fork())
+            self.assertEqual(result, 2)
+            self.assertEqual(forked['table'].to_python(), {'a': [11, 2, 3]})
+            self.assertIs(forked['table'], forked['alias'])
+            self.assertEqual(forked['bytes'].elements[0], 1)
+        self.assertEqual(context['table'].to_python(), {'a': [1, 2, 3]})
+        self.assertEqual(context['bytes'].elements[0], 0)
+        self.assertEqual(context['total'], 0)
+        self.assertEqual(context['counter'].call(None, []), 1)
+
+    def test_only_touched_state_is_copied(self):
+        result, context = eval_string(self.prelude)
+        result, forked = eval_string(self.scenario, context=context.fork())
+        copied = set(dict.keys(forked.env))
+        self.assertTrue('alias' in copied)
+        self.assertFalse('untouched' in copied)
+        self.assertIsNot(forked['table'], context['table'])
+        self.assertIs(forked['console'], context['console'])
+        # Function bodies are shared
+        self.assertIs(forked['counter'].body, context['counter'].body)
+        self.assertEqual(set(forked.env), set(context.env))
+
+    def test_forks_have_own_timers(self):
+        out = StringIO()
+        global_objects = create_default_global_objects()
+        global_objects['console'] = js.Console(out)
+        result, context = eval_string('var done = "";', global_objects)
+        template_loop = timers.get_event_loop(context)
+        forks = []
+        for name in ['a', 'b']:
+            result, forked = eval_string(
+                'setTimeout(function () { done = done + "%s"; console.log("%s"); }, 10);' % (name, name),
+                context=context.fork())
+            forks.append(forked)
+            self.assertIsNot(timers.get_event_loop(forked), template_loop)
+        self.assertEqual(template_loop.pending, 0)
+        self.assertEqual(out.getvalue(), 'a\nb\n')
+        self.assertEqual([forked['done'] for forked in forks], ['a', 'b'])
+        self.assertEqual(context['done'], '')
+
+    def test_forked_dict(self):
+        result, context = eval_string('var o = {x: 1, y: [2]};')
+        forked = context.fork()
+        d = forked['o'].d
+        self.assertTrue(isinstance(d, ForkedDict))
+        self.assertEqual(len(d), 2)
+        self.assertTrue('y' in d)
+        self.assertEqual(d.get('z', 3), 3)
+        d['x'] = 5
+        self.assertEqual(sorted(d.keys()), ['x', 'y'])
+        self.assertEqual(forked['o'].to_python(), {'x': 5, 'y': [2]})
+        self.assertEqual(context['o'].to_python(), {'x': 1, 'y': [2]})
+
+    def test_snapshot_of_fork(self):
+        result, context = eval_string(self.prelude)
+        forked = context.fork()
+        forked['counter'].call(None, [])
+        restored = snapshot.loads(snapshot.dumps(forked))
+        self.assertEqual(restored['counter'].call(None, []), 2)
+        self.assertEqual(restored['table'].to_python(), {'a': [1, 2, 3]})
+
+
+class TestThreads(unittest.TestCase):
+    """Runs one parsed program in many threads, each in its own context."""
+    program = """var fib = function (n) { if (n < 2) return n; return fib(n - 1) + fib(n - 2); };
+                 var square = memoize(function (x) { return x * x; });
+                 var i = 0, s = 0;
+                 while (i < 30) { s = s + fib(i % 8 + n) + square(i % 5); i++; }
+                 s;"""
+
+    def get_global_objects(self, n):
+        return {'n': n, 'memoize': js.NativeFunction(memoize_native)}
+
+    def run_threads(self, program, count=8):
+        results = {}
+        def run(n):
+            results[n] = eval_program(program, self.get_global_objects(n))[0]
+        threads = [threading.Thread(target=run, args=(n,)) for n in range(count)]
+        old_interval = sys.getcheckinterval()
+        sys.setcheckinterval(10)
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setcheckinterval(old_interval)
+        return results
+
+    def setUp(self):
+        compiler.set_thresholds(5, 10)
+
+    def tearDown(self):
+        compiler.set_thresholds(100, 1000)
+
+    def test_parsed_program(self):
+        program = Parser().parse(self.program)
+        before = pickle.dumps(program, 2)
+        results = self.run_threads(program)
+        for n, result in results.items():
+            self.assertEqual(result, eval_string(self.program, self.get_global_objects(n))[0])
+        # Nothing is stored on nodes of the program
+        self.assertEqual(pickle.dumps(program, 2), before)
+
+    def test_loaded_program(self):
+        program = binary.loads(binary.dumps(Parser().parse(self.program)))
+        expected = self.run_threads(Parser().parse(self.program))
+        self.assertEqual(self.run_threads(program), expected)
+
+    def test_shared_memoized_function(self):
+        result, context = eval_string('var f = function (x) { return x + 1; };')
+        f = memoize(context['f'], max_size=10)
+        errors = []
+        def run():
+            for i in range(200):
+                if f.call(None, [i % 20]) != i % 20 + 1:
+                    errors.append(i)
+        threads = [threading.Thread(target=run) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        stats = f.stats()
+        self.assertEqual(stats['hits'] + stats['misses'], 800)
+        self.assertTrue(stats['size'] <= 10)
+
+
+class TestBatch(unittest.TestCase):
+    def test_eval_many(self):
+        package_directory = os.path.dirname(__file__)
+        sources = ['1 + 2;',
+                   os.path.join(package_directory, 'test_files', 'primes.js'),
+                   'console.log("a", 1); [1, {x: 2}];',
+                   'undeclared;',
+                   'var f = function () { return 0; }; f;',
+                   'var i = 0; while (true) { i++; }']
+        results = sorted(eval_many(sources, workers=2, max_steps=1000))
+        self.assertEqual([result.index for result in results], range(len(sources)))
+        self.assertEqual(results[0].value, 3)
+        self.assertEqual(results[1].file_name, sources[1])
+        self.assertTrue(results[1].output.startswith('2\n3\n5\n'))
+        self.assertEqual((results[2].value, results[2].output), ([1, {'x': 2}], 'a 1\n'))
+        self.assertTrue(results[3].error.startswith('ReferenceError'))
+        self.assertTrue(results[4].error.startswith('ValueError'))
+        self.assertTrue(results[5].error.startswith('BudgetExceeded'))
+        for result in results:
+            self.assertTrue(result.seconds >= 0)
+            if result.index < 3:
+                self.assertIsNone(result.error)
+
+
+class TestAsync(unittest.TestCase):
+    def setUp(self):
+        self.requests = []
+
+    def fetch(self, this, args):
+        future = Future()
+        self.requests.append((args[0], future))
+        return future
+
+    def eval(self, program, **kwargs):
+        return eval_string_async(program, {'fetch': js.NativeFunction(self.fetch)}, **kwargs)
+
+    def test_waits_for_future(self):
+        future = self.eval("""var sum = 0;
+                              var i = 0;
+                              while (i < 3) { sum += fetch(i); i++; }
+                              sum;""")
+        for n in range(3):
+            self.assertFalse(future.done())
+            key, request = self.requests[n]
+            self.assertEqual(key, n)
+            request.set_result(10 * n)
+        result, context = future.result()
+        self.assertEqual(result, 30)
+        self.assertEqual(context['i'], 3)
+
+    def test_done_future(self):
+        def cached(this, args):
+            future = Future()
+            future.set_result(args[0] + 1)
+            return future
+        future = eval_string_async('cached(1) + cached(2);', {'cached': js.NativeFunction(cached)})
+        self.assertEqual(future.result()[0], 5)
+
+    def test_interleaving(self):
+        first = self.eval('var a = fetch("a"); fetch(a + 1);')
+        second = self.eval('fetch("b") * 2;')
+        self.assertEqual([key for key, request in self.requests], ['a', 'b'])
+        self.requests[1][1].set_result(21)
+        self.assertEqual(second.result()[0], 42)
+        self.requests[0][1].set_result(1)
+        self.assertFalse(first.done())
+        self.assertEqual(self.requests[2][0], 2)
+        self.requests[2][1].set_result('done')
+        self.assertEqual(first.result()[0], 'done')
+
+    def test_errors(self):
+        future = self.eval('fetch(1); 1;')
+        self.requests[0][1].set_exception(IOError('Connection reset'))
+        self.assertRaises(IOError, future.result)
+        future = self.eval('var i = fetch(1); while (true) { i++; }', max_steps=100)
+        self.requests[1][1].set_result(0)
+        self.assertRaises(BudgetExceeded, future.result)
+        self.assertRaises(js.ReferenceError, self.eval('undeclared;').result)
+
+    def test_repr(self):
+        future = self.eval('fetch(1);')
+        self.assertEqual(repr(future), 'Future(pending)')
+        self.requests[0][1].set_result(2)
+        self.assertTrue(repr(future).startswith('Future(value=(2, '))
+        failed = Future()
+        failed.set_exception(IOError('Connection reset'))
+        self.assertEqual(repr(failed), "Future(error=IOError('Connection reset',))")
+
+    def test_synchronous_run(self):
+        self.assertRaises(RuntimeError, eval_string, 'fetch(1);',
+                          {'fetch': js.NativeFunction(self.fetch)}, stackless=True)
+
+
+class TestTimers(unittest.TestCase):
+    def setUp(self):
+        self.loop = EventLoop(virtual_time=True)
+        self.log = []
+        self.global_objects = self.loop.get_global_objects()
+        self.global_objects['log'] = js.NativeFunction(self.record)
+
+    def record(self, this, args):
+        self.log.append((self.loop.now, args[0]))
+
+    def eval(self, program, **kwargs):
+        return eval_string(program, self.global_objects, **kwargs)
+
+    def test_timeouts(self):
+        for stackless in [False, True]:
+            self.setUp()
+            result, context = self.eval("""var a = setTimeout(log, 3600000, 'hour');
+                                           setTimeout(log, 10, 'first');
+                                           setTimeout(log, 10, 'second');
+                                           var t = setTimeout(log, 5, 'cleared');
+                                           setTimeout(function () {
+                                               log('zero');
+                                               setTimeout(log, 1, 'nested');
+                                           });
+                                           clearTimeout(t);
+                                           log('program');
+                                           a;""", stackless=stackless)
+            self.assertEqual(result, 1)
+            self.assertEqual(self.log, [(0, 'program'),
+                                        (0, 'zero'),
+                                        (1, 'nested'),
+                                        (10, 'first'),
+                                        (10, 'second'),
+                                        (3600000, 'hour')])
+            self.assertEqual(self.loop.pending, 0)
+
+    def test_intervals(self):
+        self.eval("""var n = 0;
+                     var i = setInterval(function () {
+                         n++;
+                         log(n);
+                         if (n == 3) clearInterval(i);
+                     }, 100);""")
+        self.assertEqual(self.log, [(100, 1), (200, 2), (300, 3)])
+
+    def test_microtasks(self):
+        self.eval("""setTimeout(log, 0, 'timeout');
+                     queueMicrotask(function () {
+                         log('first');
+                         queueMicrotask(function () { log('nested'); });
+                     });
+                     queueMicrotask(function () { log('second'); });
+                     log('program');""")
+        self.assertEqual([message for time, message in self.log],
+                         ['program', 'first', 'second', 'nested', 'timeout'])
+
+    def test_advance(self):
+        self.loop.add_timer(self.global_objects['log'], 50, ['a'])
+        self.loop.add_timer(self.global_objects['log'], 150, ['b'])
+        self.loop.advance(100)
+        self.assertEqual((self.loop.now, self.log), (100, [(50, 'a')]))
+        self.loop.advance(100)
+        self.assertEqual(self.log, [(50, 'a'), (150, 'b')])
+        self.assertEqual(self.loop.now, 200)
+
+    def test_many_timers(self):
+        log = self.global_objects['log']
+        ids = [self.loop.add_timer(log, (i * 7919) % 100000, [i]) for i in range(20000)]
+        for i, id in enumerate(ids):
+            if i % 4:
+                self.loop.cancel_timer(id)
+        # Cancelled timers were dropped once they made up most of the heap
+        self.assertTrue(len(self.loop.heap) < 10000)
+        self.loop.run()
+        self.assertEqual(len(self.log), 5000)
+        self.assertEqual(self.log, sorted(self.log))
+        self.assertEqual(self.loop.pending, 0)
+
+    def test_arguments(self):
+        self.eval("""setTimeout(log, "100", 'string');
+                     setTimeout(log, null, 'null');
+                     var n = 0;
+                     var i = setInterval(function () {
+                         n++;
+                         if (n == 3) { clearInterval(i); log(n); }
+                     }, 0);""")
+        self.assertEqual(self.log, [(0, 'null'), (3, 3), (100, 'string')])
+        for program in ['setTimeout();', 'setInterval();', 'setTimeout(1);', 'queueMicrotask();']:
+            self.assertRaises(js.TypeError, self.eval, program)
+
+    def test_budget(self):
+        for stackless in [False, True]:
+            for callback in ['function () { log(1); }', 'log']:
+                self.setUp()
+                with self.assertRaises(BudgetExceeded):
+                    self.eval('setInterval(%s, 0, 1);' % callback, max_steps=100, stackless=stackless)
+                self.assertTrue(0 < len(self.log) <= 101)
+
+    def test_async(self):
+        future = eval_string_async("""var n = 0;
+                                      setTimeout(function () { n++; log(n); }, 10);
+                                      log(n);
+                                      n;""", self.global_objects)
+        result, context = future.result()
+        self.assertEqual(result, 0)
+        self.assertEqual(context['n'], 1)
+        self.assertEqual(self.log, [(0, 0), (10, 1)])
+
+    def test_default_global_objects(self):
+        out = StringIO()
+        global_objects = create_default_global_objects()
+        global_objects['console'] = js.Console(out)
+        eval_string('setTimeout(function () { console.log(2); }); console.log(1);', global_objects)
+        self.assertEqual(out.getvalue(), '1\n2\n')
+        self.assertRaises(TypeError, eval_string, 'setTimeout(1);')
+
+
+class TestOutput(unittest.TestCase):
+    program = """var i = 0;
+                 while (i < 5) {
+                     console.log("line", i);
+                     i++;
+                 }"""
+
+    def test_buffer_size(self):
+        sink = ListSink()
+        console = BufferedConsole(sink, buffer_size=20)
+        console.log(None, ['line', 1])
+        console.log(None, ['line', 2])
+        self.assertEqual(sink.lines, [])
+        console.log(None, ['line', 3])
+        self.assertEqual(sink.lines, ['line 1', 'line 2', 'line 3'])
+        console.log(None, ['line', 4])
+        console.flush()
+        self.assertEqual(sink.lines[3:], ['line 4'])
+
+    def test_flush_at_end(self):
+        for stackless in [False, True]:
+            out = StringIO()
+            console = BufferedConsole(FileSink(out))
+            eval_string(self.program, {'console': console}, stackless=stackless)
+            self.assertEqual(out.getvalue(), ''.join('line %d\n' % i for i in range(5)))
+        sink = ListSink()
+        self.assertRaises(BudgetExceeded, eval_string, self.program.replace('i < 5', 'true'),
+                          {'console': BufferedConsole(sink)}, max_steps=10)
+        self.assertEqual(len(sink.lines), 10)
+
+    def test_flush_at_end_async(self):
+        sink = ListSink()
+        future = eval_string_async(self.program, {'console': BufferedConsole(sink)})
+        future.result()
+        self.assertEqual(sink.lines, ['line %d' % i for i in range(5)])
+        sink = ListSink()
+        future = eval_string_async(self.program.replace('i < 5', 'true'),
+                                   {'console': BufferedConsole(sink)}, max_steps=10)
+        self.assertRaises(BudgetExceeded, future.result)
+        self.assertEqual(sink.lines[:10], ['line %d' % i for i in range(10)])
+
+    def test_background(self):
+        sink = ListSink()
+        console = BufferedConsole(sink, buffer_size=10, background=True)
+        eval_string(self.program, {'console': console})
+        self.assertEqual(sink.lines, ['line %d' % i for i in range(5)])
+        console.close()
+        self.assertFalse(console.writer)
+
+    def test_background_error(self):
+        class FailingSink(ListSink):
+            def write(self, lines):
+                if 'fail' in lines:
+                    raise IOError('Disk full')
+                super(FailingSink, self).write(lines)
+        sink = FailingSink()
+        console = BufferedConsole(sink, buffer_size=1, background=True)
+        console.log(None, ['fail'])
+        self.assertRaises(IOError, console.flush)
+        console.log(None, ['written'])
+        console.flush()
+        self.assertEqual(sink.lines, ['written'])
+        console.log(None, ['fail'])
+        self.assertRaises(IOError, console.close)
+        self.assertFalse(console.writer)
+
+    def test_flush_interval(self):
+        sink = ListSink()
+        console = BufferedConsole(sink, flush_interval=0.01, background=True)
+        console.log(None, ['waiting'])
+        for i in range(100):
+            if sink.lines:
+                break
+            time.sleep(0.01)
+        self.assertEqual(sink.lines, ['waiting'])
+        console.close()
+
+    def test_null_sink(self):
+        result, context = eval_string(self.program + ' i;', {'console': BufferedConsole(NullSink())})
+        self.assertEqual(result, 5)
+
+
+class TestTiered(TestFile):
+    """Runs the same files as `TestFile`, compiling every function and loop right away."""
+    def setUp(self):
+        super(TestTiered, self).setUp()
+        compiler.set_thresholds(1, 1)
+
+    def tearDown(self):
+        super(TestTiered, self).tearDown()
+        compiler.set_thresholds(100, 1000)
+        compiler.background = False
+
+    def assertSameAsInterpreter(self, program):
+        result, context = eval_string(program)
+        compiler.set_thresholds(None, None)
+        expected, expected_context = eval_string(program)
+        compiler.set_thresholds(1, 1)
+        self.assertEqual(result, expected)
+        primitive = (int, long, float, basestring, bool)
+        self.assertEqual(dict((name, value) for name, value in context.env.items()
+                              if isinstance(value, primitive)),
+                         dict((name, value) for name, value in expected_context.env.items()
+                              if isinstance(value, primitive)))
+
+    def test_hot_function_is_compiled(self):
+        compiler.set_thresholds(3, 1000)
+        program = """var f = function (x) { return x + 1; };
+                     f(1); f(2);"""
+        result, context = eval_string(program)
+        self.assertIsNone(context['f'].code)
+        result, context = eval_string('f(3);', context.env)
+        self.assertEqual(result, 4)
+        self.assertTrue(context['f'].code.valid)
+        self.assertEqual(context['f'].calls, 0)
+
+    def test_instrumented_code_is_compiled(self):
+        compiler.set_thresholds(2, 1000)
+        program = """var f = function (x) { return x + 1; };
+                     var i = 0, s = 0;
+                     while (i < 5) { s = s + f(i); i++; }
+                     s;"""
+        for options in [{'max_steps': 1000}, {'hooks': Hooks()}, {'allocations': AllocationTracker()}]:
+            result, context = eval_string(program, **options)
+            self.assertEqual(result, 15)
+            f = context['f']
+            self.assertTrue(f.code.valid)
+            # Not just falling back to the interpreter
+            self.assertNotEqual(f.code.run, f.body.eval)
+
+    def test_loops_switch_to_compiled_code(self):
+        for program in ["var i = 0; while (i < 10) { i++; }",
+                        "var i = 0; do { i += 2; } while (i < 10);",
+                        "var i = 0, s = 0; while (true) { ++i; if (i > 5) break; s = s + i; }",
+                        "var i = 0, s = 0; while (i < 10) { ++i; if (i % 2) continue; s += i; }"]:
+            self.assertSameAsInterpreter(program)
+
+    def test_same_results_as_interpreter(self):
+        for program in ["""var makeCounter = function () {
+                               var n = 0;
+                               return function () { n = n + 1; return n; };
+                           };
+                           var c = makeCounter(); c(); c(); c();""",
+                        """var o = {x: 1}, a = [1, 2, 3];
+                           var f = function (i) { o.x = o.x * 2; a[i] = -a[i]; return o.x + a[i]; };
+                           f(0) + f(1) + f(2);""",
+                        """var f = function (s, n) { if (n == 0) return s; return f(s + "ab", n - 1); };
+                           f("", 300);""",
+                        """var g = 1;
+                           var f = function (x) { undeclared = x; return g + x; };
+                           f(1) + f(2) + undeclared;"""]:
+            self.assertSameAsInterpreter(program)
+
+    def test_deoptimization(self):
+        compiler.set_thresholds(2, 1000)
+        program = """var add = function (x, y) { return x + y; };
+                     add(1, 2); add(3, 4); add(5, 6);"""
+        result, context = eval_string(program)
+        add = context['add']
+        code = add.code
+        self.assertTrue(code.speculate)
+        for i in range(compiler.Code.max_deopts):
+            self.assertEqual(add.call(None, ['a', 'b']), 'ab')
+        self.assertFalse(code.valid)
+        # Interpreted until it's hot again, then compiled without speculation
+        self.assertEqual(add.call(None, ['a', 'c']), 'ac')
+        self.assertEqual(add.call(None, [1, 2]), 3)
+        self.assertFalse(add.code.speculate)
+        self.assertEqual(add.call(None, ['a', 'b']), 'ab')
+        self.assertTrue(add.code.valid)
+
+    def test_background_compilation(self):
+        compiler.background = True
+        program = """var f = function (x) { return x * 2; };
+                     f(1);"""
+        result, context = eval_string(program)
+        self.assertIsNone(context['f'].code)
+        compiler.wait()
+        self.assertEqual(context['f'].call(None, [3]), 6)
+        self.assertTrue(context['f'].code.valid)
+
+
+class TestProfiler(unittest.TestCase):
+    program = """var outer = function () { sample(); inner(); return 0; };
+                 var o = {x: 0};
+                 o.method = function () {
+                     sample();
+                 };
+                 inner = function () { o.method(); return 0; };
+                 outer();"""
+
+    def run_sampled(self, stackless):
+        profiler = Profiler(file_name='test.js')
+        def sample(this, args):
+            profiler.sample(None, sys._getframe())
+        eval_string(self.program, {'sample': js.NativeFunction(sample)}, stackless=stackless)
+        return profiler
+
+    def test_function_names(self):
+        program = Parser().parse(self.program)
+        outer = program.statements[0].declarations[0].initialiser
+        method = program.statements[2].expression.expression
+        inner = program.statements[3].expression.expression
+        self.assertEqual((outer.name, outer.line), ('outer', 1))
+        self.assertEqual((method.name, method.line), ('method', 3))
+        self.assertEqual((inner.name, inner.line), ('inner', 6))
+
+    def test_collapsed_stacks(self):
+        for stackless in [False, True]:
+            out = StringIO()
+            self.run_sampled(stackless).write_collapsed(out)
+            self.assertEqual(out.getvalue(),
+                             "(program);outer (test.js:1);inner (test.js:6);"
+                             "method (test.js:3);sample [native] 1\n"
+                             "(program);outer (test.js:1);sample [native] 1\n")
+
+    def test_top(self):
+        top = self.run_sampled(False).get_top(3)
+        self.assertEqual(top, [('sample [native]', 2, 2),
+                               ('(program)', 0, 2),
+                               ('outer (test.js:1)', 0, 2)])
+
+
+class RecordingHooks(Hooks):
+    def __init__(self):
+        self.events = []
+
+    def enter_function(self, definition, context):
+        self.events.append(('enter', definition.name, list(context['arguments'])))
+
+    def exit_function(self, definition, context, value):
+        if isinstance(value, js.TailCall):
+            value = 'tail call'
+        self.events.append(('exit', definition.name, value))
+
+    def statement(self, statement, context):
+        self.events.append(('statement', statement.__class__.__name__))
+
+    def back_edge(self, loop, context):
+        self.events.append(('back edge', context['i']))
+
+    def enter_native(self, function, args):
+        self.events.append(('native', args))
+
+    def exit_native(self, function, args, value):
+        self.events.append(('native exit', value))
+
+
+class TestHooks(unittest.TestCase):
+    program = """var i = 0;
+                 var f = function (x) { return g(x + 1); };
+                 var g = function (x) { return x * 2; };
+                 while (i < 2) { i = f(i); }
+                 log(i);"""
+
+    def test_events(self):
+        for stackless in [False, True]:
+            hooks = RecordingHooks()
+            log = js.NativeFunction(lambda this, args: None)
+            eval_string(self.program, {'log': log}, stackless=stackless, hooks=hooks)
+            self.assertEqual(hooks.events, [
+                ('statement', 'VariableDeclarationList'),
+                ('statement', 'VariableDeclarationList'),
+                ('statement', 'VariableDeclarationList'),
+                ('statement', 'WhileStatement'),
+                ('statement', 'ExpressionStatement'),
+                ('enter', 'f', [0]),
+                ('statement', 'TailCallHook'),
+                ('exit', 'f', 'tail call'),
+                ('enter', 'g', [1]),
+                ('statement', 'ReturnStatement'),
+                ('exit', 'g', 2),
+                ('back edge', 2),
+                ('statement', 'ExpressionStatement'),
+                ('native', [2]),
+                ('native exit', None)])
+
+    def test_with_allocations(self):
+        source = self.program + """
+                 var h = function () { return log(new Float64Array(2)); };
+                 h();"""
+        global_objects = create_default_global_objects()
+        global_objects['log'] = js.NativeFunction(lambda this, args: None)
+        expected = RecordingHooks()
+        eval_string(source, dict(global_objects), hooks=expected)
+        try:
+            for thresholds in [(100, 1000), (1, 1)]:
+                compiler.set_thresholds(*thresholds)
+                for stackless in [False, True]:
+                    for hooks_first in [False, True]:
+                        hooks = RecordingHooks()
+                        tracker = AllocationTracker()
+                        program = Parser().parse(source)
+                        if hooks_first:
+                            program = allocations_instrument(hooks_instrument(program, hooks), tracker)
+                            tail_call = 'TailCallHook'
+                        else:
+                            program = hooks_instrument(allocations_instrument(program, tracker), hooks)
+                            tail_call = 'TailCallSite'
+                        eval_program(program, dict(global_objects), stackless=stackless)
+                        self.assertEqual(hooks.events,
+                                         [('statement', tail_call) if event == ('statement', 'TailCallHook')
+                                          else event for event in expected.events])
+                        counts = dict(((line, kind), count) for line, kind, count, size in tracker.get_top())
+                        self.assertEqual(counts, {(2, 'Function'): 1,
+                                                  (3, 'Function'): 1,
+                                                  (6, 'Function'): 1,
+                                                  (4, 'ExecutionContext'): 1,
+                                                  (2, 'ExecutionContext'): 1,
+                                                  (7, 'ExecutionContext'): 1,
+                                                  (6, 'Float64Array'): 1})
+        finally:
+            compiler.set_thresholds(100, 1000)
+
+    def test_program_without_hooks_is_not_instrumented(self):
+        program = Parser().parse(self.program)
+        instrumented = hooks_instrument(program, Hooks())
+        self.assertEqual([s.__class__ for s in program.statements],
+                         [ast.VariableDeclarationList] * 3 + [ast.WhileStatement, ast.ExpressionStatement])
+        self.assertEqual([s.__class__ for s in instrumented.statements], [StatementHook] * 5)
+
+
+class TestAllocations(unittest.TestCase):
+    program = """var makePoint = function (x, y) {
+                     return {x: x, y: y};
+                 };
+                 var i = 0, points = [], s = "";
+                 while (i < 5) {
+                     points[i] = makePoint(i, i);
+                     s += "a";
+                     i = i + 1;
+                 }"""
+
+    def test_sites(self):
+        for stackless in [False, True]:
+            tracker = AllocationTracker()
+            eval_string(self.program, stackless=stackless, allocations=tracker)
+            counts = dict(((line, kind), count) for line, kind, count, size in tracker.get_top())
+            self.assertEqual(counts, {(1, 'Function'): 1,
+                                      (2, 'Object'): 5,
+                                      (4, 'Array'): 1,
+                                      (6, 'ExecutionContext'): 5,
+                                      (7, 'string'): 5})
+
+    def test_sizes(self):
+        tracker = AllocationTracker()
+        eval_string("var a = new Float64Array(1000);", allocations=tracker)
+        [(line, kind, count, size)] = tracker.get_top()
+        self.assertEqual((line, kind, count), (1, 'Float64Array', 1))
+        self.assertTrue(size > 8000)
+
+    def test_report(self):
+        tracker = AllocationTracker()
+        eval_string(self.program, allocations=tracker)
+        out = StringIO()
+        tracker.write_top(out, 1)
+        self.assertEqual(out.getvalue().splitlines()[1].split()[0], '5')
+
+
+class TestScheduler(unittest.TestCase):
+    def test_infinite_loop_doesnt_block_other_tasks(self):
+        scheduler = Scheduler(quantum=10)
+        forever = scheduler.spawn('var i = 0; while (true) { ++i; }')
+        counter = scheduler.spawn('var i = 0; while (i < 100) { ++i; } i;')
+        scheduler.run(slices=50)
+        self.assertTrue(counter.finished)
+        self.assertEqual(counter.value, 100)
+        self.assertFalse(forever.finished)
+        self.assertTrue(forever.context['i'] > 100)
+
+        forever.cancel()
+        scheduler.run()
+        self.assertFalse(forever.finished)
+        self.assertEqual(len(scheduler.ready), 0)
+
+    def test_round_robin(self):
+        out = StringIO()
+        scheduler = Scheduler(quantum=1)
+        program = """var i = 0;
+                     while (i < 3) {
+                         console.log(name);
+                         ++i;
+                     }"""
+        for name in ['a', 'b']:
+            scheduler.spawn(program, {'console': js.Console(out=out), 'name': name})
+        scheduler.run()
+        self.assertEqual(out.getvalue(), 'a\nb\na\nb\na\nb\n')
+
+    def test_task_error(self):
+        scheduler = Scheduler()
+        failing = scheduler.spawn('x;')
+        working = scheduler.spawn('1 + 2;')
+        scheduler.run()
+        self.assertIsInstance(failing.error, js.ReferenceError)
+        self.assertEqual(working.value, 3)
+
+    def test_timers_and_console(self):
+        sink = ListSink()
+        global_objects = create_default_global_objects()
+        global_objects['console'] = BufferedConsole(sink)
+        scheduler = Scheduler()
+        task = scheduler.spawn("""setTimeout(function () { console.log('timeout'); }, 10);
+                                  queueMicrotask(function () { console.log('microtask'); });
+                                  console.log('main');""", global_objects)
+        scheduler.run()
+        self.assertTrue(task.finished)
+        self.assertEqual(sink.lines, ['main', 'microtask', 'timeout'])
+
+        sink = ListSink()
+        global_objects = create_default_global_objects()
+        global_objects['console'] = BufferedConsole(sink)
+        task = scheduler.spawn("setInterval(function () { console.log('tick'); }, 10);",
+                               global_objects, max_steps=10)
+        scheduler.run()
+        self.assertIsInstance(task.error, BudgetExceeded)
+        self.assertTrue(len(sink.lines) > 0)
+
+
+class TestMetering(unittest.TestCase):
+    infinite_loop = 'var i = 0; while (true) { ++i; }'
+    recursion = """var f = function (n) { if (n == 0) return 0; return 1 + f(n - 1); };
+                   f(50);"""
+
+    def test_max_steps(self):
+        for stackless in [False, True]:
+            with self.assertRaises(BudgetExceeded):
+                eval_string(self.infinite_loop, max_steps=1000, stackless=stackless)
+
+    def test_function_calls_are_counted(self):
+        for stackless in [False, True]:
+            self.assertEqual(eval_string(self.recursion, max_steps=51, stackless=stackless)[0], 50)
+            with self.assertRaises(BudgetExceeded):
+                eval_string(self.recursion, max_steps=50, stackless=stackless)
+
+    def test_timeout(self):
+        for stackless in [False, True]:
+            with self.assertRaises(BudgetExceeded):
+                eval_string(self.infinite_loop, timeout=0.05, stackless=stackless)
+
+    def test_compiled_loops_are_counted(self):
+        program = Parser().parse('var i = 0; while (i < 3000) { ++i; } i;')
+        self.assertIs(metering_instrument(program), metering_instrument(program))
+        # Later runs reuse the code compiled by the first one
+        for i in range(2):
+            self.assertEqual(eval_program(program, max_steps=3000)[0], 3000)
+            self.assertRaises(BudgetExceeded, eval_program, program, max_steps=2999)
+
+    def test_budget_in_scheduler(self):
+        scheduler = Scheduler()
+        task = scheduler.spawn(self.infinite_loop, max_steps=5000)
+        scheduler.run()
+        self.assertIsInstance(task.error, BudgetExceeded)
+
+
+class TestMemoize(unittest.TestCase):
+    def test_memoize_in_javascript(self):
+        program = """var calls = 0;
+                     var square = memoize(function (x) { ++calls; return x * x; }, 2);
+                     square(2) + square(3) + square(2) + square(4) + square(3);"""
+        result, context = eval_string(program)
+        self.assertEqual(result, 4 + 9 + 4 + 16 + 9)
+        self.assertEqual(context['calls'], 4)
+        self.assertEqual(context['square'].stats(),
+                         {'hits': 1, 'misses': 4, 'evictions': 2, 'bypasses': 0,
+                          'size': 2, 'max_size': 2})
+
+    def test_memoize_from_python(self):
+        program = """var fib = function (n) {
+                         if (n < 2) return n;
+                         return fib(n - 1) + fib(n - 2);
+                     };"""
+        result, context = eval_string(program)
+        context['fib'] = memoize(context['fib'])
+        result, context = eval_string('fib(60);', context.env)
+        self.assertEqual(result, 1548008755920)
+        self.assertEqual(context['fib'].stats()['misses'], 61)
+
+    def test_no_cache(self):
+        program = """var calls = 0;
+                     var f = memoize(function (x) { ++calls; return x; }, 0);
+                     f(1) + f(1);"""
+        result, context = eval_string(program)
+        self.assertEqual((result, context['calls']), (2, 2))
+        self.assertEqual(context['f'].stats()['size'], 0)
+        self.assertRaises(ValueError, memoize, context['f'], -1)
+
+    def test_invalid_arguments(self):
+        for program in ['memoize();', 'memoize(1);', 'memoize(function (x) { return x; }, "x");']:
+            self.assertRaises(js.TypeError, eval_string, program)
+        self.assertRaises(js.RangeError, eval_string, 'memoize(function (x) { return x; }, -1);')
+        result, context = eval_string('var f = memoize(function (x) { return x; }, "5");')
+        self.assertEqual(context['f'].max_size, 5)
+
+    def test_primitive_keys(self):
+        program = """var f = memoize(function (x) { return x; });
+                     [f(1), f(true), f("1"), f(1)];"""
+        result, context = eval_string(program)
+        self.assertEqual(result, js.Array([1, True, '1', 1]))
+        self.assertTrue(result.get(1.0) is True)
+
+    def test_objects_bypass_cache(self):
+        program = """var calls = 0;
+                     var f = memoize(function (o) { ++calls; return o.x; });
+                     var o = {x: 1};
+                     f(o); o.x = 2; f(o);"""
+        result, context = eval_string(program)
+        self.assertEqual(result, 2)
+        self.assertEqual(context['calls'], 2)
+        self.assertEqual(context['f'].stats()['bypasses'], 2)
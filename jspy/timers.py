@@ -0,0 +1,207 @@
+"""Timers and microtasks: `setTimeout`, `setInterval`, `clearTimeout`,
+`clearInterval` and `queueMicrotask` global functions.
+
+They are bound to an `EventLoop`, which `jspy.eval_program` runs once the
+program itself has finished: timer callbacks are called in order of their due
+time (and of scheduling for equal times), and after the program and every
+callback all queued microtasks are run, including the ones they queue, like in
+browsers and Node.
+
+Pending timers are kept in a heap, so scheduling and running a timer costs
+O(log n) for n pending timers. Cleared timers are only marked as cancelled and
+dropped when they come up, or all at once when they make up most of the heap.
+
+With `virtual_time` set, the loop doesn't wait for timers, it jumps right to
+the next one. So tests can run timers of hours in no time and check the order
+of callbacks and `loop.now`:
+
+    loop = EventLoop(virtual_time=True)
+    global_objects = create_default_global_objects()
+    global_objects.update(loop.get_global_objects())
+    eval_string('setTimeout(function () { console.log("late"); }, 3600000);', global_objects)"""
+import heapq
+import math
+import time
+from collections import deque
+from jspy import js
+
+
+class Timer(object):
+    __slots__ = ('id', 'callback', 'args', 'interval', 'cancelled')
+
+    def __init__(self, id, callback, args, interval=None):
+        self.id = id
+        self.callback = callback
+        self.args = args
+        # Delay of the next runs of an interval, None for a timeout
+        self.interval = interval
+        self.cancelled = False
+
+    def __repr__(self):
+        return 'Timer(id=%r, interval=%r, cancelled=%r)' % (self.id, self.interval, self.cancelled)
+
+
+def call(function, this, args):
+    return function.call(this, args)
+
+
+def to_delay(value):
+    """Return the delay in milliseconds given by JavaScript `value`."""
+    value = js.to_number(value)
+    if math.isnan(value) or value < 0:
+        return 0
+    return value
+
+
+class EventLoop(object):
+    # Shortest delay between runs of an interval, so a zero one doesn't keep the loop spinning
+    min_interval = 1
+    # Cancelled timers are dropped from the heap when there's more of them than that and live ones
+    min_cleanup = 1024
+
+    def __init__(self, virtual_time=False):
+        self.virtual_time = virtual_time
+        self.started = time.time()
+        self.virtual_now = 0
+        # (due time, sequence number, timer) tuples
+        self.heap = []
+        self.sequence = 0
+        # Live timers by id
+        self.timers = {}
+        self.cancelled = 0
+        self.last_id = 0
+        # (callback, args) tuples
+        self.microtasks = deque()
+
+    @property
+    def now(self):
+        """Milliseconds since the loop was created (or virtual ones)."""
+        if self.virtual_time:
+            return self.virtual_now
+        return (time.time() - self.started) * 1000
+
+    @property
+    def pending(self):
+        """Number of timers and microtasks waiting to run."""
+        return len(self.timers) + len(self.microtasks)
+
+    def get_global_objects(self):
+        """Return global functions bound to this loop by name."""
+        return {'setTimeout': js.NativeFunction(self.set_timeout),
+                'setInterval': js.NativeFunction(self.set_interval),
+                'clearTimeout': js.NativeFunction(self.clear_timeout),
+                'clearInterval': js.NativeFunction(self.clear_timeout),
+                'queueMicrotask': js.NativeFunction(self.queue_microtask)}
+
+    def add_timer(self, callback, delay, args, interval=None):
+        """Schedule `callback` to be called with `args` after `delay` milliseconds
+        (and every `interval` milliseconds after that) and return its id."""
+        if not hasattr(callback, 'call'):
+            raise js.TypeError('Timer callback %r is not a function' % (callback,))
+        self.last_id += 1
+        timer = Timer(self.last_id, callback, args, interval)
+        self.timers[timer.id] = timer
+        self.push(timer, self.now + delay)
+        return timer.id
+
+    def push(self, timer, when):
+        self.sequence += 1
+        heapq.heappush(self.heap, (when, self.sequence, timer))
+
+    def cancel_timer(self, id):
+        timer = self.timers.pop(id, None)
+        if timer is None:
+            return
+        timer.cancelled = True
+        self.cancelled += 1
+        if self.cancelled > self.min_cleanup and self.cancelled > len(self.heap) / 2:
+            self.heap = [entry for entry in self.heap if not entry[2].cancelled]
+            heapq.heapify(self.heap)
+            self.cancelled = 0
+
+    def set_timeout(self, this, args):
+        """Implementation of `setTimeout(callback[, delay[, arg...]])` global function."""
+        callback = args[0] if args else js.UNDEFINED
+        return self.add_timer(callback, to_delay(args[1]) if len(args) > 1 else 0, args[2:])
+
+    def set_interval(self, this, args):
+        """Implementation of `setInterval(callback[, delay[, arg...]])` global function."""
+        callback = args[0] if args else js.UNDEFINED
+        delay = max(to_delay(args[1]) if len(args) > 1 else 0, self.min_interval)
+        return self.add_timer(callback, delay, args[2:], interval=delay)
+
+    def clear_timeout(self, this, args):
+        """Implementation of `clearTimeout(id)` and `clearInterval(id)` global functions."""
+        if args:
+            self.cancel_timer(args[0])
+        return js.UNDEFINED
+
+    def queue_microtask(self, this, args):
+        """Implementation of `queueMicrotask(callback)` global function."""
+        self.add_microtask(args[0] if args else js.UNDEFINED)
+        return js.UNDEFINED
+
+    def add_microtask(self, callback, args=()):
+        if not hasattr(callback, 'call'):
+            raise js.TypeError('Microtask %r is not a function' % (callback,))
+        self.microtasks.append((callback, list(args)))
+
+    def run_microtasks(self, call=call):
+        microtasks = self.microtasks
+        while microtasks:
+            callback, args = microtasks.popleft()
+            call(callback, js.UNDEFINED, args)
+
+    def run(self, until=None, call=call):
+        """Run microtasks and timers until there are none left or, if `until`
+        is given, until the next one is due after `until` milliseconds.
+
+        Callbacks are called with `call(function, this, args)`, e.g. to run
+        them with `jspy.machine.call`."""
+        self.run_microtasks(call)
+        heap = self.heap
+        while heap:
+            when, sequence, timer = heap[0]
+            if timer.cancelled:
+                heapq.heappop(heap)
+                self.cancelled -= 1
+                continue
+            if until is not None and when > until:
+                break
+            heapq.heappop(heap)
+            self.wait(when)
+            if timer.interval is None:
+                del self.timers[timer.id]
+            else:
+                self.push(timer, when + timer.interval)
+            call(timer.callback, js.UNDEFINED, list(timer.args))
+            self.run_microtasks(call)
+            heap = self.heap
+        if until is not None:
+            self.wait(until)
+
+    def advance(self, milliseconds, call=call):
+        """Run timers due in the next `milliseconds`."""
+        self.run(self.now + milliseconds, call)
+
+    def wait(self, when):
+        """Wait until `when` milliseconds."""
+        if self.virtual_time:
+            self.virtual_now = max(self.virtual_now, when)
+        else:
+            delay = when - self.now
+            if delay > 0:
+                time.sleep(delay / 1000.0)
+
+    def __repr__(self):
+        return 'EventLoop(now=%r, timers=%d, microtasks=%d)' % (self.now, len(self.timers),
+                                                                len(self.microtasks))
+
+
+def get_event_loop(context):
+    """Return the `EventLoop` bound to `setTimeout` global function of `context`, if any."""
+    set_timeout = context.env.get('setTimeout')
+    loop = getattr(getattr(set_timeout, 'f', None), 'im_self', None)
+    if isinstance(loop, EventLoop):
+        return loop
+    return None
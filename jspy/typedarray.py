@@ -0,0 +1,212 @@
+"""Typed arrays and array buffers, as defined in [ECMA-262 6th edition, 22.2 and 24.1].
+
+Bytes of an `ArrayBuffer` live in a `bytearray` and every typed array is a ctypes
+array laid over (a slice of) it. This keeps element access in C and lets us hand
+the memory over to Python code without copying it (`array.array` doesn't support
+the new buffer protocol in Python 2, so it can't be shared the same way)."""
+import ctypes
+from jspy import js
+from jspy.compat import numpy
+
+
+def get_index(name):
+    """Return `name` as an integer index or None if it's not an array index."""
+    if isinstance(name, (int, long, float)) and not isinstance(name, bool):
+        if name % 1 == 0:
+            return int(name)
+    elif isinstance(name, basestring) and name.isdigit():
+        return int(name)
+    return None
+
+
+def to_integer(value):
+    """Truncate a number towards zero, mapping NaN and infinities to 0.
+
+    Wrapping to the element size (see [ECMA-262 6th edition, 7.1.5]) is done by ctypes."""
+    if value != value or value in (float('inf'), float('-inf')):
+        return 0
+    return int(value)
+
+
+def get_length(obj):
+    """Return the length of array-like `obj`."""
+    if isinstance(obj, TypedArray):
+        return len(obj.elements)
+    length = 0
+    for key in obj.d.keys():
+        try:
+            index = get_index(float(key))
+        except ValueError:
+            continue
+        if index is not None and index >= length:
+            length = index + 1
+    return length
+
+
+class ArrayBuffer(js.Object):
+    """Fixed-length raw binary data buffer, backed by a `bytearray`.
+
+    Passing an existing `bytearray` shares it with JavaScript code."""
+    def __init__(self, data):
+        super(ArrayBuffer, self).__init__()
+        self.data = data
+
+    @classmethod
+    def construct(cls, this, args):
+        byte_length = to_integer(js.to_number(args[0])) if len(args) > 0 else 0
+        if byte_length < 0:
+            raise js.RangeError('Invalid array buffer length: %r' % args[0])
+        return cls(bytearray(byte_length))
+
+    def get_binding_value(self, name):
+        if name == 'byteLength':
+            return len(self.data)
+        return super(ArrayBuffer, self).get_binding_value(name)
+
+    def __repr__(self):
+        return 'ArrayBuffer(%r)' % self.data
+
+    def __eq__(self, other):
+        return isinstance(other, ArrayBuffer) and self.data == other.data
+
+    def to_python(self):
+        return memoryview(self.data)
+
+
+class TypedArray(js.Object):
+    """Abstract base class for typed array views over an `ArrayBuffer`."""
+    element_type = None
+    numpy_type = None
+
+    def __init__(self, buffer, byte_offset=0, length=None):
+        super(TypedArray, self).__init__()
+        element_size = ctypes.sizeof(self.element_type)
+        if byte_offset % element_size != 0:
+            raise js.RangeError('Start offset of %s should be a multiple of %d'
+                                % (self.__class__.__name__, element_size))
+        if length is None:
+            length = (len(buffer.data) - byte_offset) // element_size
+        if length < 0 or byte_offset + length * element_size > len(buffer.data):
+            raise js.RangeError('Invalid %s length: %r' % (self.__class__.__name__, length))
+        self.buffer = buffer
+        self.byte_offset = byte_offset
+        self.elements = (self.element_type * length).from_buffer(buffer.data, byte_offset)
+
+    @classmethod
+    def construct(cls, this, args):
+        """Implements `new TypedArray(length)`, `new TypedArray(arrayLike)` and
+        `new TypedArray(buffer[, byteOffset[, length]])`."""
+        if len(args) == 0:
+            return cls.allocate(0)
+        source = args[0]
+        if isinstance(source, ArrayBuffer):
+            byte_offset = to_integer(js.to_number(args[1])) if len(args) > 1 else 0
+            length = (to_integer(js.to_number(args[2]))
+                      if len(args) > 2 and args[2] is not js.UNDEFINED else None)
+            return cls(source, byte_offset, length)
+        elif isinstance(source, TypedArray):
+            result = cls.allocate(len(source.elements))
+            for i, value in enumerate(source.elements):
+                result.set_element(i, value)
+            return result
+        elif isinstance(source, js.Object):
+            length = get_length(source)
+            result = cls.allocate(length)
+            for i in range(length):
+                result.set_element(i, source.get(i))
+            return result
+        else:
+            length = to_integer(js.to_number(source))
+            if length < 0:
+                raise js.RangeError('Invalid %s length: %r' % (cls.__name__, source))
+            return cls.allocate(length)
+
+    @classmethod
+    def allocate(cls, length):
+        """Create a zero-filled typed array with its own buffer."""
+        return cls(ArrayBuffer(bytearray(length * ctypes.sizeof(cls.element_type))))
+
+    def to_element(self, value):
+        return to_integer(js.to_number(value))
+
+    def set_element(self, index, value):
+        self.elements[index] = self.to_element(value)
+
+    def get_binding_value(self, name):
+        index = get_index(name)
+        if index is not None:
+            if 0 <= index < len(self.elements):
+                return self.elements[index]
+            return js.UNDEFINED
+        elif name == 'length':
+            return len(self.elements)
+        elif name == 'byteLength':
+            return ctypes.sizeof(self.elements)
+        elif name == 'byteOffset':
+            return self.byte_offset
+        elif name == 'buffer':
+            return self.buffer
+        elif name == 'BYTES_PER_ELEMENT':
+            return ctypes.sizeof(self.element_type)
+        return super(TypedArray, self).get_binding_value(name)
+
+    def set_mutable_binding(self, name, value):
+        index = get_index(name)
+        if index is not None:
+            # Out of bounds writes are ignored, as specified in [ECMA-262 6th edition, 9.4.5.9]
+            if 0 <= index < len(self.elements):
+                self.set_element(index, value)
+        else:
+            super(TypedArray, self).set_mutable_binding(name, value)
+
+    def get(self, name):
+        return self.get_binding_value(name)
+
+    def __getstate__(self):
+        # ctypes arrays can't be pickled, elements are viewed again over the buffer
+        state = self.__dict__.copy()
+        state['elements'] = len(self.elements)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.elements = (self.element_type * state['elements']).from_buffer(self.buffer.data,
+                                                                            self.byte_offset)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, list(self.elements))
+
+    def __str__(self):
+        from jspy.formatting import format_value
+        return format_value(self)
+
+    def __eq__(self, other):
+        return (self.__class__ is other.__class__
+                and list(self.elements) == list(other.elements))
+
+    def to_python(self):
+        """Return elements without copying, as a NumPy array if it's available
+        or a `memoryview` otherwise."""
+        if numpy is not None:
+            return numpy.frombuffer(self.buffer.data, dtype=self.numpy_type,
+                                    count=len(self.elements), offset=self.byte_offset)
+        return memoryview(self.elements)
+
+
+class Float64Array(TypedArray):
+    element_type = ctypes.c_double
+    numpy_type = 'float64'
+
+    def to_element(self, value):
+        # Unlike integer arrays, undefined and other non-numbers are stored as NaN
+        return float(js.to_number(value))
+
+
+class Int32Array(TypedArray):
+    element_type = ctypes.c_int32
+    numpy_type = 'int32'
+
+
+class Uint8Array(TypedArray):
+    element_type = ctypes.c_uint8
+    numpy_type = 'uint8'